@@ -12,7 +12,7 @@ except ImportError:
     HAS_VADER = False
 
 try:
-    from .analyzer_client import analyze_comments_batch_sync
+    from .analyzer_client import analyze_comments_batch_sync as _analyze_comments_batch
     HAS_ANALYZER = True
 except ImportError:
     HAS_ANALYZER = False
@@ -26,6 +26,7 @@ def analyze_sentiment_via_vader_sync(comments):
 def analyze_comments_batch_sync(comments):
     if not HAS_ANALYZER:
         return []
+    return _analyze_comments_batch(comments) or []
 
 def analysis_worker(q: queue.Queue, scraped_data: dict, worker_id: int):
     batch = []
@@ -37,28 +38,52 @@ def analysis_worker(q: queue.Queue, scraped_data: dict, worker_id: int):
 
     executor = ThreadPoolExecutor(max_workers=2)  # analyze sentiments & attributes in parallel
 
-    def process_batch(batch_to_process):
-        try:
-            input_comments = [{"id": c["id"], "body": c["body"]} for c in batch_to_process]
+    def enrich_batch(batch_to_process):
+        input_comments = [{"id": c["id"], "body": c["body"]} for c in batch_to_process]
+
+        future_other = executor.submit(analyze_comments_batch_sync, input_comments)
+        future_vader = executor.submit(analyze_sentiment_via_vader_sync, input_comments)
 
-            future_other = executor.submit(analyze_comments_batch_sync, input_comments)
-            future_vader = executor.submit(analyze_sentiment_via_vader_sync, input_comments)
+        other_attr_results = future_other.result()
+        vader_results = future_vader.result()
 
-            other_attr_results = future_other.result()
-            vader_results = future_vader.result()
+        other_result_map = {r["id"]: r for r in other_attr_results}
+        vader_result_map = {r["id"]: r for r in vader_results.get("results", [])}
 
-            other_result_map = {r["id"]: r for r in other_attr_results}
-            vader_result_map = {r["id"]: r for r in vader_results.get("results", [])}
+        # The queued dicts are the scraper's own comment dicts, so enrich them in place
+        for c in batch_to_process:
+            cid = c["id"]
+            if cid in other_result_map:
+                for key, val in other_result_map[cid].items():
+                    if key not in {"id", "body"}:
+                        c[key] = val
+            if cid in vader_result_map:
+                c["sentiment"] = vader_result_map[cid]["sentiment"]
+                c["sentiment_score"] = vader_result_map[cid]["sentiment_score"]
 
+    def process_batch(batch_to_process):
+        try:
+            try:
+                enrich_batch(batch_to_process)
+            except Exception as e:
+                # Keep the rows; they are written without analysis results
+                print(f"[analyzer_worker-{worker_id}] Analysis failed for batch of {len(batch_to_process)}: {e}")
+
+            # Stream the finished rows to their subreddit's CSV; after this the scraper holds no copy
+            by_subreddit = {}
             for c in batch_to_process:
-                cid = c["id"]
-                if cid in other_result_map:
-                    for key, val in other_result_map[cid].items():
-                        if key not in {"id", "body"}:
-                            scraped_data['comments_by_id'][cid][key] = val
-                if cid in vader_result_map:
-                    scraped_data['comments_by_id'][cid]["sentiment"] = vader_result_map[cid]["sentiment"]
-                    scraped_data['comments_by_id'][cid]["sentiment_score"] = vader_result_map[cid]["sentiment_score"]
+                by_subreddit.setdefault(c["subreddit"], []).append(c)
+            for subreddit, rows in by_subreddit.items():
+                sink = scraped_data['sinks'].get(subreddit)
+                if sink is None:
+                    # The attempt that queued them was abandoned
+                    print(f"[analyzer_worker-{worker_id}] Dropping {len(rows)} rows of r/{subreddit}; no open sink")
+                    continue
+                sink.write_rows(rows)
+
+            progress = scraped_data.get('progress')
+            if progress is not None:
+                progress.add(comments_analysed=len(batch_to_process))
         finally:
             for _ in batch_to_process:
                 q.task_done()
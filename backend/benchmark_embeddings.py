@@ -0,0 +1,127 @@
+"""
+Compare the torch and ONNX embedding backends: throughput, memory and output parity.
+
+Usage: python backend/benchmark_embeddings.py [--texts N] [--batch-size N] [--min-cosine X]
+
+Each backend runs in its own subprocess (EMBEDDING_BACKEND is read at import time,
+and separate processes keep the RSS numbers honest). The script exits non-zero when
+any ONNX vector drifts below --min-cosine similarity from its torch counterpart.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BACKENDS = ["torch", "onnx"]
+
+SAMPLE_TEXTS = [
+    "I started therapy last month and it's already helping with my anxiety.",
+    "Does anyone else get panic attacks right before falling asleep?",
+    "My psychiatrist switched me to a new SSRI and the side effects are rough.",
+    "CBT worksheets felt silly at first but they honestly work.",
+    "lol same",
+    "Has anyone tried EMDR for trauma? Looking for honest experiences, good or bad, "
+    "because my counselor suggested it and I'm nervous about reliving things.",
+    "Sleep hygiene tips that actually made a difference for me: no phone in bed, same wake time, "
+    "and getting sunlight in the morning even when it's cloudy.",
+    "Thank you all for the support, I finally booked an appointment.",
+]
+
+
+def run_worker(backend: str, n_texts: int, batch_size: int, out_path: str):
+    # Runs inside the subprocess; the env var is already set by the parent
+    import psutil
+    from backend import embedding_service
+
+    proc = psutil.Process()
+    rss_before = proc.memory_info().rss
+    load_start = time.perf_counter()
+    if not embedding_service.is_available():
+        print(json.dumps({'backend': backend, 'error': str(embedding_service._load_error)}), flush=True)
+        sys.exit(1)
+    load_seconds = time.perf_counter() - load_start
+
+    texts = [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] + f" ({i})" for i in range(n_texts)]
+    embedding_service.embed_batch(texts[:batch_size])  # warm-up
+    peak_rss = proc.memory_info().rss
+    vectors = []
+    start = time.perf_counter()
+    for i in range(0, n_texts, batch_size):
+        vectors.extend(embedding_service.embed_batch(texts[i:i + batch_size]))
+        peak_rss = max(peak_rss, proc.memory_info().rss)
+    seconds = time.perf_counter() - start
+
+    np.save(out_path, np.asarray(vectors, dtype=np.float32))
+    print(json.dumps({
+        'backend': backend,
+        'load_seconds': round(load_seconds, 2),
+        'embeddings_per_second': round(n_texts / seconds, 1),
+        'model_rss_mb': round((peak_rss - rss_before) / 1024 ** 2, 1),
+        'peak_rss_mb': round(peak_rss / 1024 ** 2, 1),
+    }), flush=True)
+
+
+def run_backend(backend: str, args, out_path: str) -> dict:
+    env = {**os.environ, 'EMBEDDING_BACKEND': backend}
+    cmd = [sys.executable, __file__, '--worker', backend, '--texts', str(args.texts),
+           '--batch-size', str(args.batch_size), '--out', out_path]
+    result = subprocess.run(cmd, env=env, capture_output=True, text=True,
+                            cwd=str(Path(__file__).resolve().parent.parent))
+    lines = result.stdout.strip().splitlines()
+    if not lines:
+        return {'backend': backend, 'error': result.stderr.strip()[-500:]}
+    return json.loads(lines[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--texts', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--min-cosine', type=float, default=0.99)
+    parser.add_argument('--worker', choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+        run_worker(args.worker, args.texts, args.batch_size, args.out)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for backend in BACKENDS:
+            print(f'Benchmarking {backend} backend on {args.texts} texts...', flush=True)
+            results[backend] = run_backend(backend, args, os.path.join(tmp, f'{backend}.npy'))
+            print(f'  {results[backend]}', flush=True)
+
+        if any('error' in r for r in results.values()):
+            print('FATAL ERROR: a backend failed to run', file=sys.stderr, flush=True)
+            sys.exit(1)
+
+        torch_vecs = np.load(os.path.join(tmp, 'torch.npy'))
+        onnx_vecs = np.load(os.path.join(tmp, 'onnx.npy'))
+
+    # Both backends return L2-normalised vectors, so the row-wise dot product is the cosine
+    cosine = np.sum(torch_vecs * onnx_vecs, axis=1)
+    speedup = results['onnx']['embeddings_per_second'] / results['torch']['embeddings_per_second']
+    print(f'\n==== 📊 Embedding backends ====', flush=True)
+    print(f'⚡ ONNX speed-up: {speedup:.2f}x', flush=True)
+    print(f'🧠 Model RSS: torch {results["torch"]["model_rss_mb"]} MB, onnx {results["onnx"]["model_rss_mb"]} MB',
+          flush=True)
+    print(f'🎯 Cosine similarity to torch: min {cosine.min():.4f}, mean {cosine.mean():.4f}', flush=True)
+
+    if cosine.min() < args.min_cosine:
+        print(f'FATAL ERROR: ONNX embeddings drift below {args.min_cosine} cosine similarity',
+              file=sys.stderr, flush=True)
+        sys.exit(1)
+    print('✅ ONNX backend is within tolerance', flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,8 @@ import brotli
 import hashlib
 import time
 import os
-import psutil
-import threading
 import logging
-from typing import List
+from .resource_monitor import ResourceMonitor
 
 # --- LOGGING SETUP ---
 # Create a logger
@@ -35,6 +33,7 @@ logger.addHandler(console_handler)
 
 # Configuration - These are now defaults that can be overridden
 COMPRESSION_LEVEL = 6  # 0=fastest, 11=maximum compression
+MEMORY_SAMPLE_INTERVAL = 0.01  # seconds; (de)compression calls are short, so sample finely
 
 class BrotliFileCompressor:
     """Simple Brotli file compressor with comprehensive reporting."""
@@ -43,18 +42,9 @@ class BrotliFileCompressor:
         self.compression_level = compression_level
         logger.info(f"BrotliFileCompressor initialized with compression level: {self.compression_level}")
 
-    def sample_memory(self, mem_samples: List[float], stop_flag: dict):
-        """Monitor memory usage during compression/decompression."""
-        process = psutil.Process(os.getpid())
-        while not stop_flag["stop"]:
-            try:
-                mem = process.memory_info().rss / 1024 / 1024  # MB
-                mem_samples.append(mem)
-                time.sleep(0.01)
-            except Exception as e:
-                # Log a warning if the memory sampling thread encounters an issue
-                logger.warning(f"Memory sampling thread failed: {e}")
-                break
+    def sample_memory(self, stage: str) -> ResourceMonitor:
+        """Monitor memory usage during compression/decompression: `with self.sample_memory("compress") as m:`."""
+        return ResourceMonitor(interval=MEMORY_SAMPLE_INTERVAL, stage=stage)
 
     def hash_file(self, filepath: str) -> str:
         """Calculate SHA256 hash of a file."""
@@ -93,25 +83,15 @@ class BrotliFileCompressor:
 
         logger.info(f"Original file size: {self.bytes_to_mb(original_size)}")
 
-        # Start memory monitoring
-        mem_samples = []
-        stop_flag = {"stop": False}
-        memory_thread = threading.Thread(target=self.sample_memory, args=(mem_samples, stop_flag))
-        memory_thread.daemon = True # Make thread a daemon so it doesn't block exit.
-        memory_thread.start()
-
-        # Compress data
-        start_time = time.time()
-        try:
-            compressed_data = brotli.compress(original_data, quality=self.compression_level)
-        except Exception as e:
-            logger.critical(f"Brotli compression failed: {e}", exc_info=True)
-            raise Exception(f"Brotli compression failed: {e}")
-        end_time = time.time()
-
-        # Stop memory monitoring
-        stop_flag["stop"] = True
-        memory_thread.join()
+        # Compress data while memory is monitored
+        with self.sample_memory("compress") as monitor:
+            start_time = time.time()
+            try:
+                compressed_data = brotli.compress(original_data, quality=self.compression_level)
+            except Exception as e:
+                logger.critical(f"Brotli compression failed: {e}", exc_info=True)
+                raise Exception(f"Brotli compression failed: {e}")
+            end_time = time.time()
 
         # Save compressed file
         try:
@@ -129,8 +109,8 @@ class BrotliFileCompressor:
         space_saved = original_size - compressed_size
         space_saved_percent = (space_saved / original_size * 100) if original_size > 0 else 0
 
-        avg_memory = sum(mem_samples) / len(mem_samples) if mem_samples else 0
-        peak_memory = max(mem_samples) if mem_samples else 0
+        avg_memory = monitor.overall.avg
+        peak_memory = monitor.overall.max or 0
         gb_seconds = (avg_memory / 1024) * compression_time
         throughput = (original_size / 1024 / 1024) / compression_time if compression_time > 0 else 0
 
@@ -165,28 +145,18 @@ class BrotliFileCompressor:
             logger.critical(f"Critical error reading compressed file: {e}", exc_info=True)
             raise Exception(f"Error reading compressed file: {e}")
 
-        # Start memory monitoring
-        mem_samples = []
-        stop_flag = {"stop": False}
-        memory_thread = threading.Thread(target=self.sample_memory, args=(mem_samples, stop_flag))
-        memory_thread.daemon = True # Make thread a daemon so it doesn't block exit.
-        memory_thread.start()
-
-        # Decompress data
-        start_time = time.time()
-        try:
-            decompressed_data = brotli.decompress(compressed_data)
-        except brotli.error as e:
-            logger.error(f"Brotli decompression failed. Data may be corrupted: {e}", exc_info=True)
-            raise brotli.error(f"Decompression failed: {e}")
-        except Exception as e:
-            logger.critical(f"Critical error during decompression: {e}", exc_info=True)
-            raise Exception(f"Decompression failed: {e}")
-        end_time = time.time()
-
-        # Stop memory monitoring
-        stop_flag["stop"] = True
-        memory_thread.join()
+        # Decompress data while memory is monitored
+        with self.sample_memory("decompress") as monitor:
+            start_time = time.time()
+            try:
+                decompressed_data = brotli.decompress(compressed_data)
+            except brotli.error as e:
+                logger.error(f"Brotli decompression failed. Data may be corrupted: {e}", exc_info=True)
+                raise brotli.error(f"Decompression failed: {e}")
+            except Exception as e:
+                logger.critical(f"Critical error during decompression: {e}", exc_info=True)
+                raise Exception(f"Decompression failed: {e}")
+            end_time = time.time()
 
         # Save decompressed file
         try:
@@ -202,8 +172,8 @@ class BrotliFileCompressor:
         decompressed_hash = hashlib.sha256(decompressed_data).hexdigest()
         integrity_ok = decompressed_hash == expected_hash
 
-        avg_memory = sum(mem_samples) / len(mem_samples) if mem_samples else 0
-        peak_memory = max(mem_samples) if mem_samples else 0
+        avg_memory = monitor.overall.avg
+        peak_memory = monitor.overall.max or 0
         gb_seconds = (avg_memory / 1024) * decompression_time
         throughput = (decompressed_size / 1024 / 1024) / decompression_time if decompression_time > 0 else 0
 
@@ -0,0 +1,224 @@
+"""
+Typed, columnar (Parquet) copies of the scraped comment files.
+
+Next to every reddit_<subreddit>_comments_<ts>.csv.br the scraper writes a
+.parquet with the same columns plus pre-expanded analysis columns:
+    emotion_<label>    float score per emotion label (null when absent)
+    topic_labels       list of the comment's topic labels
+    practitioner_type  lowercase practitioner type from practitioner_reference
+    created_at         created_utc as a UTC timestamp
+so the API can read just the columns it needs, push the time, feature-page and
+emotion-intensity filters down into the file, and skip the per-row json.loads.
+pyarrow is optional: without it no .parquet is written and readers use the CSV.
+"""
+import io
+import json
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+logger = logging.getLogger("reddit-scraper-lambda")
+
+PARQUET_SUFFIX = ".parquet"
+# Rows per Parquet row group; also the unit in which the CSV is re-read while writing
+ROW_GROUP_SIZE = 10000
+
+INT_FIELDS = {'score'}
+FLOAT_FIELDS = {'sentiment_score'}
+EMOTION_PREFIX = "emotion_"
+
+# Feature pages: a comment belongs to one when the column is neither null nor empty
+FEATURE_COLUMNS = [
+    'desire_and_wish', 'trigger_phrase', 'metaphors', 'question',
+    'practitioner_reference', 'painpointsxfrustrations', 'failed_solutions'
+]
+
+TIME_WINDOWS = {
+    "past_day": timedelta(days=1),
+    "past_week": timedelta(weeks=1),
+    "past_month": timedelta(days=30),
+    "past_year": timedelta(days=365),
+}
+
+
+def parquet_name(csv_br_name: str) -> str:
+    """reddit_x_comments_ts.csv.br -> reddit_x_comments_ts.parquet"""
+    return re.sub(r"\.csv\.br$", "", csv_br_name) + PARQUET_SUFFIX
+
+
+def emotion_column(label: str) -> str:
+    return EMOTION_PREFIX + re.sub(r"[^a-z0-9_]", "_", label.lower())
+
+
+def _as_dict(value) -> dict:
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+def _as_text(value):
+    # Same encoding as the CSV: lists and dicts are JSON, empty means missing
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if value is None or value == '':
+        return None
+    return str(value)
+
+
+def _as_number(value, cast):
+    try:
+        return cast(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_timestamp(value):
+    if not value:
+        return None
+    try:
+        created = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return created if created.tzinfo else created.replace(tzinfo=timezone.utc)
+
+
+def expand_comment(comment: dict, fieldnames: List[str]) -> dict:
+    """One Parquet row: the CSV columns plus the expanded analysis columns."""
+    row = {}
+    for key in fieldnames:
+        value = comment.get(key)
+        if key in INT_FIELDS:
+            row[key] = _as_number(value, lambda v: int(float(v)))
+        elif key in FLOAT_FIELDS:
+            row[key] = _as_number(value, float)
+        else:
+            row[key] = _as_text(value)
+
+    for label, score in _as_dict(comment.get('emotions')).items():
+        score = _as_number(score, float)
+        if score is not None:
+            row[emotion_column(label)] = score
+    row['topic_labels'] = [label.lower() for label, score in _as_dict(comment.get('topics')).items()
+                           if score is not None]
+    practitioner_type = _as_dict(comment.get('practitioner_reference')).get('practitioner_type')
+    row['practitioner_type'] = practitioner_type.lower() if isinstance(practitioner_type, str) else None
+    row['created_at'] = _to_timestamp(comment.get('created_utc'))
+    return row
+
+
+def build_schema(fieldnames: List[str], emotion_columns: Iterable[str]):
+    fields = []
+    for key in fieldnames:
+        if key in INT_FIELDS:
+            fields.append(pa.field(key, pa.int64()))
+        elif key in FLOAT_FIELDS:
+            fields.append(pa.field(key, pa.float64()))
+        else:
+            fields.append(pa.field(key, pa.string()))
+    fields.extend(pa.field(column, pa.float64()) for column in sorted(set(emotion_columns)))
+    fields.append(pa.field('topic_labels', pa.list_(pa.string())))
+    fields.append(pa.field('practitioner_type', pa.string()))
+    fields.append(pa.field('created_at', pa.timestamp('us', tz='UTC')))
+    return pa.schema(fields)
+
+
+def write_parquet(comments, path, fieldnames: List[str]) -> int:
+    """
+    Write comments to a Parquet file in row groups of ROW_GROUP_SIZE.
+
+    Args:
+        comments: Re-iterable collection of comment dicts (e.g. SavedComments); it is
+            read twice, first to find the emotion labels that become columns
+        path: Destination file
+        fieldnames (list): CSV columns to keep
+
+    Returns:
+        int: Number of rows written
+    """
+    emotion_columns = set()
+    for comment in comments:
+        emotion_columns.update(emotion_column(label) for label in _as_dict(comment.get('emotions')))
+    schema = build_schema(fieldnames, emotion_columns)
+
+    rows_written = 0
+    with pq.ParquetWriter(str(path), schema, compression="zstd") as writer:
+        batch = []
+        for comment in comments:
+            batch.append(expand_comment(comment, fieldnames))
+            if len(batch) >= ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                rows_written += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            rows_written += len(batch)
+    return rows_written
+
+
+def pushdown_filters(filters: dict, available_columns: Iterable[str]):
+    """
+    Conjunctive Parquet predicates that drop rows the filter function would reject anyway.
+
+    Only filters whose meaning is a plain conjunction are pushed down: the active
+    feature page, the time window and emotions with a minimum intensity.
+
+    Returns:
+        list or None: Predicate tuples for pq.read_table, or None when no row can match
+    """
+    available = set(available_columns)
+    predicates = []
+
+    active_feature = next((f for f in FEATURE_COLUMNS if filters.get(f)), None)
+    if active_feature and active_feature in available:
+        # Nulls never satisfy a comparison, so this keeps non-null, non-empty values
+        predicates.append((active_feature, "!=", ""))
+
+    time_filter = (filters.get('time') or "").lower()
+    if time_filter in TIME_WINDOWS and 'created_at' in available:
+        predicates.append(('created_at', ">=", pd.Timestamp(datetime.now(timezone.utc) - TIME_WINDOWS[time_filter])))
+
+    if filters.get('emotions') and filters.get('min_intensity') is not None:
+        for label in filters['emotions']:
+            column = emotion_column(label)
+            if column not in available:
+                # Every listed emotion must reach the intensity; this file has none of one of them
+                return None
+            predicates.append((column, ">=", float(filters['min_intensity'])))
+    return predicates
+
+
+def read_parquet(data: bytes, columns: Optional[List[str]] = None, filters: dict = None) -> pd.DataFrame:
+    """
+    Load a Parquet file, reading only `columns` and the rows that can pass `filters`.
+
+    Args:
+        data (bytes): The Parquet file
+        columns (list): Columns to return; None for all
+        filters (dict): FilterRequest fields, used for predicate pushdown
+
+    Returns:
+        pd.DataFrame: The matching rows
+    """
+    parquet_file = pq.ParquetFile(io.BytesIO(data))
+    available = parquet_file.schema_arrow.names
+    if columns is not None:
+        columns = [c for c in columns if c in available]
+
+    predicates = pushdown_filters(filters or {}, available) if filters else []
+    if predicates is None:
+        return parquet_file.schema_arrow.empty_table().select(columns or available).to_pandas()
+    table = pq.read_table(io.BytesIO(data), columns=columns, filters=predicates or None)
+    return table.to_pandas()
@@ -0,0 +1,105 @@
+"""
+Keyset pagination over a filtered comment result, for /comments/query.
+
+A result is sorted once, newest first, by (created_utc, id). A page is located by
+binary search on that key, so serving page N costs the same as page 1 and does not
+depend on the size of the result. The cursor is the opaque key of the last row
+served.
+"""
+import base64
+import json
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .frame_cache import frame_bytes
+
+# Memory for sorted results reused across page requests; 0 disables
+RESULT_PAGE_CACHE_MAX_MB = int(os.getenv("RESULT_PAGE_CACHE_MAX_MB", "64"))
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Separates created_utc from id in the sort key; sorts before every printable character
+KEY_SEPARATOR = "\x00"
+
+
+def encode_cursor(key: str, offset: int = 0) -> str:
+    """Cursor of the row offset rows into the run of rows with this sort key."""
+    return base64.urlsafe_b64encode(json.dumps({'k': key, 'o': offset}).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    """(sort key, offset) of a cursor; ValueError when it was not made by encode_cursor."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(payload['k']), int(payload.get('o', 0))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class PagedResult:
+    """
+    A filtered result held in ascending key order, served newest first.
+
+    Scraped created_utc values share one ISO format, so their string order is time
+    order; comments without one sort as the oldest.
+
+    Args:
+        df (pd.DataFrame): The filtered comments
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        created = df['created_utc'].fillna("").astype(str) if 'created_utc' in df.columns else pd.Series("", index=df.index)
+        ids = df['id'].fillna("").astype(str) if 'id' in df.columns else pd.Series(df.index.astype(str), index=df.index)
+        keys = (created + KEY_SEPARATOR + ids).to_numpy(dtype=str)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.df = df.iloc[order].reset_index(drop=True)
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def nbytes(self) -> int:
+        return frame_bytes(self.df) + self.keys.nbytes
+
+    def _cursor(self, position: int) -> str:
+        key = self.keys[position]
+        # Duplicate rows share a key; the offset keeps the ones before position from being skipped
+        return encode_cursor(str(key), position - int(np.searchsorted(self.keys, key, side="left")))
+
+    def page(self, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+             columns: Optional[List[str]] = None) -> dict:
+        """
+        One page of rows, newest first.
+
+        Args:
+            cursor (str): next_cursor of the previous page; None for the first page
+            limit (int): Rows per page, capped at MAX_PAGE_SIZE
+            columns (list): Columns to return; None for all
+
+        Returns:
+            dict: total, rows (list of dicts), next_cursor (None on the last page) and columns
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        columns = list(self.df.columns) if columns is None else columns
+        unknown = [c for c in columns if c not in self.df.columns]
+        if unknown:
+            raise ValueError(f"Unknown columns: {unknown}")
+
+        # Rows are served from the end of the ascending order; the page ends just before the cursor
+        if cursor is None:
+            end = len(self.keys)
+        else:
+            key, offset = decode_cursor(cursor)
+            end = min(int(np.searchsorted(self.keys, key, side="left")) + max(offset, 0), len(self.keys))
+        start = max(0, end - limit)
+        page = self.df.iloc[start:end][columns].iloc[::-1]
+        rows = page.astype(object).where(page.notna(), None).to_dict(orient="records")
+        return {
+            'total': len(self.keys),
+            'rows': rows,
+            'next_cursor': self._cursor(start) if start > 0 else None,
+            'columns': columns,
+        }
@@ -0,0 +1,229 @@
+import codecs
+import csv
+import io
+import json
+import logging
+import shutil
+import threading
+from pathlib import Path
+
+import brotli
+
+logger = logging.getLogger("reddit-scraper-lambda")
+
+# Finished comment files are written here before upload; wiped at the start of each session
+LOCAL_OUTPUT_DIR = Path("/tmp") / "comment_output"
+
+# Same level the one-shot compressor used; the cost is now spread over the analysis batches
+STREAM_QUALITY = 11
+# Vector-record metadata updates are sent in chunks of this many rows
+METADATA_BATCH_SIZE = 500
+READ_CHUNK_SIZE = 64 * 1024
+
+# Free-text columns are never JSON-decoded when reading rows back
+TEXT_FIELDS = {'id', 'post_id', 'subreddit', 'author', 'body', 'created_utc', 'parent_id', 'sentiment'}
+
+
+def csv_row(comment: dict, fieldnames: list) -> dict:
+    """Project a comment onto the CSV columns, JSON-encoding lists and dicts."""
+    row = {}
+    for key in fieldnames:
+        val = comment.get(key)
+        if isinstance(val, (dict, list)):
+            val = json.dumps(val, ensure_ascii=False)
+        row[key] = val
+    return row
+
+
+def metadata_row(comment: dict) -> dict:
+    """Row for the update_reddit_records_attr RPC; missing values default to an empty dict."""
+    row = {
+        'id': comment['id'],
+        'subreddit': comment.get('subreddit'),
+        'emotions': comment.get('emotions'),
+        'topics': comment.get('topics'),
+        'practitioner_reference': comment.get('practitioner_reference'),
+        'created_at': comment.get('created_utc')
+    }
+    return {k: (v if v is not None else {}) for k, v in row.items()}
+
+
+class CommentCsvSink:
+    """
+    Append-only CSV of analysed comments for one subreddit, Brotli-compressed as it is written.
+
+    Analysis workers call write_rows() as each batch finishes, so a comment is held
+    in memory only from the moment it is scraped until its batch is analysed; after
+    that it exists solely as compressed bytes on disk. The vector-record metadata
+    for written rows is pushed to Supabase in chunks along the way.
+
+    Args:
+        path: Local .csv.br file to write
+        fieldnames (list): CSV columns
+        pending (dict): Comments queued for analysis, by id; written ones are removed
+        vectorised_ids (set): Ids with a vector record; metadata waits for these
+        update_metadata: Callable sending a list of metadata rows, or None to skip
+        resume_from: Partial .csv.br written by checkpoint() to continue from
+        rows_written (int): Number of rows already in resume_from
+    """
+
+    def __init__(self, path, fieldnames: list, pending: dict, vectorised_ids: set, update_metadata=None,
+                 resume_from=None, rows_written: int = 0, quality: int = STREAM_QUALITY):
+        self.path = Path(path)
+        self.fieldnames = fieldnames
+        self.pending = pending
+        self.vectorised_ids = vectorised_ids
+        self.update_metadata = update_metadata
+        self.rows_written = 0
+        self.raw_bytes = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._metadata_rows = []
+        self._compressor = brotli.Compressor(quality=quality)
+        self._buffer = io.StringIO()
+        self._writer = csv.DictWriter(self._buffer, fieldnames=fieldnames)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'wb')
+        if resume_from:
+            # Re-compress what the interrupted run wrote; the header is part of it
+            for chunk in iter_decompressed(resume_from):
+                self.raw_bytes += len(chunk)
+                self._file.write(self._compressor.process(chunk))
+            self.rows_written = rows_written
+        else:
+            self._writer.writeheader()
+            self._drain()
+
+    def _drain(self):
+        data = self._buffer.getvalue().encode('utf-8')
+        self._buffer.seek(0)
+        self._buffer.truncate(0)
+        if data:
+            self.raw_bytes += len(data)
+            self._file.write(self._compressor.process(data))
+
+    def write_rows(self, comments: list):
+        """
+        Append analysed comments and drop them from the pending map. Thread-safe.
+        Comments this sink is not waiting for, e.g. from an abandoned scrape attempt,
+        are dropped, so every comment is written at most once.
+        """
+        with self._lock:
+            if self.closed:
+                return
+            written = 0
+            for comment in comments:
+                if self.pending.pop(comment['id'], None) is None:
+                    continue
+                self._writer.writerow(csv_row(comment, self.fieldnames))
+                self._metadata_rows.append(metadata_row(comment))
+                written += 1
+            self.rows_written += written
+            self._drain()
+            ready = self._take_metadata(only_vectorised=True)
+        self._send_metadata(ready)
+
+    def _take_metadata(self, only_vectorised: bool) -> list:
+        # Metadata can only update vector records that were already inserted
+        if only_vectorised and len(self._metadata_rows) < METADATA_BATCH_SIZE:
+            return []
+        if not only_vectorised:
+            ready, self._metadata_rows = self._metadata_rows, []
+            return ready
+        ready = [row for row in self._metadata_rows if row['id'] in self.vectorised_ids]
+        self._metadata_rows = [row for row in self._metadata_rows if row['id'] not in self.vectorised_ids]
+        return ready
+
+    def _send_metadata(self, rows: list):
+        if not rows or self.update_metadata is None:
+            return
+        for i in range(0, len(rows), METADATA_BATCH_SIZE):
+            try:
+                self.update_metadata(rows[i:i + METADATA_BATCH_SIZE])
+            except Exception as e:
+                logger.error(f"Error updating Supabase records metadata: {e}", exc_info=True)
+
+    def checkpoint(self, dest, comment_keys: list):
+        """
+        Copy a readable prefix of the file to dest and return (rows_written, pending comments).
+        Both are taken under the write lock, so every comment is either in the copy or pending.
+        """
+        with self._lock:
+            self._file.write(self._compressor.flush())
+            self._file.flush()
+            shutil.copyfile(self.path, dest)
+            pending = [{k: c.get(k) for k in comment_keys} for c in self.pending.values()]
+            return self.rows_written, pending
+
+    def close(self):
+        """Finish the Brotli stream and send any metadata still buffered."""
+        with self._lock:
+            if self.closed:
+                return
+            self._file.write(self._compressor.finish())
+            self._file.close()
+            self.closed = True
+            ready = self._take_metadata(only_vectorised=False)
+        self._send_metadata(ready)
+
+
+def iter_decompressed(path, chunk_size: int = READ_CHUNK_SIZE):
+    """Yield the decompressed bytes of a (possibly unfinished) .csv.br file chunk by chunk."""
+    decompressor = brotli.Decompressor()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            data = decompressor.process(chunk)
+            if data:
+                yield data
+
+
+def _iter_lines(path):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    tail = ''
+    for data in iter_decompressed(path):
+        lines = (tail + decoder.decode(data)).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def _decode_value(key, value):
+    if value == '':
+        return None
+    if key not in TEXT_FIELDS and value[0] in '[{':
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+class SavedComments:
+    """
+    Comments of a scrape, read back lazily from the compressed CSV files.
+
+    Behaves like the list it replaces for len(), truthiness and iteration, but
+    only one row is decoded at a time.
+    """
+
+    def __init__(self, paths: list, count: int):
+        self.paths = [Path(p) for p in paths]
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for path in self.paths:
+            for row in csv.DictReader(_iter_lines(path)):
+                yield {key: _decode_value(key, value) for key, value in row.items()}
+
+
+def clear_output_dir():
+    """Remove the comment files of the previous session."""
+    shutil.rmtree(LOCAL_OUTPUT_DIR, ignore_errors=True)
+    LOCAL_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,280 @@
+"""
+Index of the scraped comment files in S3, kept as a single JSON object next to them.
+
+The scraper adds an entry for every .csv.br it uploads, so the API can pick the
+files a request needs from one small cached object instead of listing the whole
+bucket. Each entry records:
+    key              S3 key of the .csv.br
+    subreddit        subreddit the file was scraped from
+    rows             number of comments in it
+    min_created_utc  oldest and newest comment timestamps (naive ISO, UTC)
+    max_created_utc
+    schema_version   SCHEMA_VERSION of the CSV columns
+    etag, size       of the uploaded object
+    parquet_key      S3 key and ETag of the Parquet copy, when one was written
+    parquet_etag
+    index_key        S3 key and ETag of the label index (see label_index), when one was written
+    index_etag
+Files uploaded before the manifest existed are added with
+`python -m backend.dataset_manifest`.
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from . import comment_sink
+from . import columnar_store
+from . import label_index
+
+logger = logging.getLogger("reddit-scraper-lambda")
+
+MANIFEST_NAME = "manifest.json"
+# Bump when the CSV columns change so readers can tell old files apart
+SCHEMA_VERSION = 1
+# How long the API trusts its cached copy before revalidating it with a conditional GET
+MANIFEST_TTL_SECONDS = float(os.getenv("DATASET_MANIFEST_TTL_SECONDS", "60"))
+# Attempts at a conditional write before giving up on a concurrent writer
+MAX_WRITE_ATTEMPTS = 5
+
+
+def manifest_key(prefix: str) -> str:
+    """S3 key of the manifest object."""
+    return f"{prefix}{MANIFEST_NAME}"
+
+
+def new_manifest() -> dict:
+    return {'version': SCHEMA_VERSION, 'updated_at': None, 'files': {}}
+
+
+def file_entry(key: str, subreddit: str, comments, etag: str = None, size: int = None,
+               parquet_key: str = None, parquet_etag: str = None,
+               index_key: str = None, index_etag: str = None) -> dict:
+    """
+    Manifest entry of one comment file.
+
+    Args:
+        key (str): S3 key of the .csv.br
+        subreddit (str): Subreddit the comments come from
+        comments: Iterable of the file's comment dicts (e.g. SavedComments); read once
+            for the row count and time range
+    """
+    rows = 0
+    min_created = max_created = None
+    for comment in comments:
+        rows += 1
+        created = comment.get('created_utc')
+        if not created:
+            continue
+        # Scraped timestamps share one ISO format, so string order is time order
+        created = str(created)
+        if min_created is None or created < min_created:
+            min_created = created
+        if max_created is None or created > max_created:
+            max_created = created
+    return {
+        'key': key,
+        'subreddit': subreddit,
+        'rows': rows,
+        'min_created_utc': min_created,
+        'max_created_utc': max_created,
+        'schema_version': SCHEMA_VERSION,
+        'etag': etag,
+        'size': size,
+        'parquet_key': parquet_key,
+        'parquet_etag': parquet_etag,
+        'index_key': index_key,
+        'index_etag': index_etag,
+    }
+
+
+def _error_code(e: ClientError) -> str:
+    return str(e.response.get('Error', {}).get('Code'))
+
+
+def load_manifest(s3_client, bucket: str, prefix: str):
+    """
+    Read the manifest and its ETag.
+
+    Returns:
+        tuple: (manifest dict, etag); (None, None) when no manifest has been written yet
+    """
+    try:
+        obj = s3_client.get_object(Bucket=bucket, Key=manifest_key(prefix))
+    except ClientError as e:
+        if _error_code(e) in ('NoSuchKey', '404'):
+            return None, None
+        raise
+    return json.loads(obj["Body"].read()), obj.get("ETag")
+
+
+def add_files(s3_client, bucket: str, prefix: str, entries: List[dict]):
+    """
+    Add or replace entries in the manifest.
+
+    Uses conditional writes (If-Match / If-None-Match) and retries on conflict, so
+    subreddits finishing at the same time, or concurrent scrape jobs, never drop
+    each other's entries.
+    """
+    if not entries:
+        return
+    for attempt in range(1, MAX_WRITE_ATTEMPTS + 1):
+        manifest, etag = load_manifest(s3_client, bucket, prefix)
+        manifest = manifest or new_manifest()
+        for entry in entries:
+            manifest['files'][entry['key']] = entry
+        manifest['updated_at'] = datetime.now(timezone.utc).isoformat()
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        try:
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=manifest_key(prefix),
+                Body=json.dumps(manifest).encode("utf-8"),
+                ContentType="application/json",
+                **condition
+            )
+            logger.info(f"🗂️ Dataset manifest updated with {len(entries)} file(s) "
+                        f"({len(manifest['files'])} in total)")
+            return
+        except ClientError as e:
+            if _error_code(e) not in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                raise
+            logger.warning(f"Dataset manifest changed while updating it (attempt {attempt}); retrying")
+    raise RuntimeError(f"Could not update the dataset manifest after {MAX_WRITE_ATTEMPTS} attempts")
+
+
+def select_files(files: Dict[str, dict], subreddits: Optional[List[str]] = None,
+                 time_filter: Optional[str] = None) -> List[dict]:
+    """
+    Entries of the files a request needs, in key order.
+
+    Args:
+        files (dict): The manifest's 'files'
+        subreddits (list): Keep only these subreddits (case-insensitive); None for all
+        time_filter (str): FilterRequest.time; files with no comment inside the window are
+            skipped. Unknown values select every file and are rejected later by the filter.
+    """
+    wanted = {s.lower() for s in subreddits} if subreddits else None
+    since = None
+    window = columnar_store.TIME_WINDOWS.get((time_filter or "").lower())
+    if window is not None:
+        # Same format as the scraped created_utc values: naive UTC, e.g. 2025-01-31T12:00:00
+        since = (datetime.now(timezone.utc) - window).replace(tzinfo=None, microsecond=0).isoformat()
+
+    selected = []
+    for key in sorted(files):
+        entry = files[key]
+        if wanted is not None and (entry.get('subreddit') or "").lower() not in wanted:
+            continue
+        # Entries without a time range (no timestamped comments) are always kept
+        if since and entry.get('max_created_utc') and entry['max_created_utc'] < since:
+            continue
+        selected.append(entry)
+    return selected
+
+
+class ManifestCache:
+    """
+    Process-wide copy of the manifest for the API.
+
+    The object is fetched once and then revalidated at most every ttl seconds with
+    a conditional GET, so an unchanged manifest costs one 304 response per TTL.
+    Safe to share between threads.
+    """
+
+    def __init__(self, ttl: float = MANIFEST_TTL_SECONDS):
+        self.ttl = ttl
+        self._files = None
+        self._etag = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Revalidate on the next call, e.g. after this process finished a scrape."""
+        with self._lock:
+            self._checked_at = float('-inf')
+
+    def get(self, s3_client, bucket: str, prefix: str) -> Optional[Dict[str, dict]]:
+        """The manifest's files by key, or None when there is no manifest yet."""
+        with self._lock:
+            if self._files is not None and time.monotonic() - self._checked_at < self.ttl:
+                return self._files
+            kwargs = {'IfNoneMatch': self._etag} if self._etag else {}
+            try:
+                obj = s3_client.get_object(Bucket=bucket, Key=manifest_key(prefix), **kwargs)
+                self._files = json.loads(obj["Body"].read()).get('files', {})
+                self._etag = obj.get("ETag")
+                logger.info(f"🗂️ Loaded dataset manifest with {len(self._files)} file(s)")
+            except ClientError as e:
+                if _error_code(e) in ('304', 'NotModified'):
+                    pass
+                elif _error_code(e) in ('NoSuchKey', '404'):
+                    self._files, self._etag = None, None
+                else:
+                    raise
+            self._checked_at = time.monotonic()
+            return self._files
+
+
+def backfill(s3_client, bucket: str, prefix: str) -> int:
+    """
+    Add every comment .csv.br in the bucket that the manifest does not know yet.
+
+    Returns:
+        int: Number of files added
+    """
+    manifest, _ = load_manifest(s3_client, bucket, prefix)
+    known = set((manifest or new_manifest())['files'])
+    keys = set()
+    paginator = s3_client.get_paginator("list_objects_v2")
+    # The whole bucket, like main.list_s3_files: early scrapes were uploaded without the prefix
+    for page in paginator.paginate(Bucket=bucket):
+        keys.update(obj["Key"] for obj in page.get("Contents", []))
+
+    entries = []
+    for key in sorted(keys):
+        if not key.endswith(".csv.br") or "filtered_comments" in key or key in known:
+            continue
+        name = key.rsplit("/", 1)[-1]
+        # reddit_<subreddit>_comments_<timestamp>.csv.br
+        subreddit = name[len("reddit_"):name.rfind("_comments_")] if name.startswith("reddit_") else None
+        with tempfile.TemporaryDirectory() as tmp:
+            local_path = os.path.join(tmp, name)
+            s3_client.download_file(bucket, key, local_path)
+            head = s3_client.head_object(Bucket=bucket, Key=key)
+            comments = comment_sink.SavedComments([local_path], 0)
+            parquet_key = columnar_store.parquet_name(key)
+            parquet_etag = s3_client.head_object(Bucket=bucket, Key=parquet_key)["ETag"] \
+                if parquet_key in keys else None
+            # Older files have no label index yet; build it while the file is at hand
+            index_key = label_index.index_name(key)
+            index_path = os.path.join(tmp, label_index.index_name(name))
+            label_index.LabelIndex.from_comments(comments).save(index_path)
+            s3_client.upload_file(index_path, bucket, index_key)
+            index_etag = s3_client.head_object(Bucket=bucket, Key=index_key)["ETag"]
+            entries.append(file_entry(key, subreddit, comments,
+                                      etag=head["ETag"], size=head["ContentLength"],
+                                      parquet_key=parquet_key if parquet_etag else None,
+                                      parquet_etag=parquet_etag, index_key=index_key, index_etag=index_etag))
+        print(f'  + {key} ({entries[-1]["rows"]} rows)', flush=True)
+    add_files(s3_client, bucket, prefix, entries)
+    return len(entries)
+
+
+if __name__ == '__main__':
+    import boto3
+
+    bucket = os.getenv("BROTLI_OUTPUT_BUCKET")
+    if not bucket:
+        print('FATAL ERROR: BROTLI_OUTPUT_BUCKET is not set', file=sys.stderr, flush=True)
+        sys.exit(1)
+    prefix = os.getenv("BROTLI_OUTPUT_PREFIX", "reddit-comments/")
+    added = backfill(boto3.client("s3", region_name="ca-central-1"), bucket, prefix)
+    print(f'✅ Added {added} file(s) to s3://{bucket}/{manifest_key(prefix)}', flush=True)
@@ -0,0 +1,151 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from . import embedding_service
+
+logger = logging.getLogger("embedding-service")
+
+# Local on-disk cache; on Lambda /tmp survives between invocations of a warm container.
+# Set EMBEDDING_CACHE_PATH to an empty string to disable caching.
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "/tmp/embedding_cache.sqlite3")
+# Each entry is a 384-d float32 vector plus its key, roughly 1.6 KB on disk
+MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+# Evict down to this fraction of MAX_ENTRIES so eviction does not run on every insert
+EVICT_TO = 0.9
+# Keys per SQL statement; stays below SQLite's bound-parameter limit
+SQL_CHUNK_SIZE = 500
+
+
+def normalise_text(text: str) -> str:
+    """Collapse whitespace; texts that normalise the same share one embedding."""
+    return " ".join((text or "").split())
+
+
+def cache_key(text: str) -> bytes:
+    """Hash of the model identity and the normalised text."""
+    return hashlib.sha256(f"{embedding_service.model_key()}\0{normalise_text(text)}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent text -> embedding cache in SQLite with least-recently-used eviction.
+
+    Keys are content hashes (see cache_key), so a comment that is scraped again with
+    an unchanged body is never re-embedded, and switching model or backend starts a
+    fresh key space. Safe to share between threads.
+
+    Args:
+        path (str): SQLite database file
+        max_entries (int): Entries kept before the least recently used ones are evicted
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def __len__(self):
+        return self._count
+
+    def get_many(self, texts: List[str]) -> Dict[int, List[float]]:
+        """
+        Look texts up and mark the hits as recently used.
+
+        Returns:
+            Dict[int, List[float]]: Embedding by index into texts, for the hits only
+        """
+        keys = [cache_key(text) for text in texts]
+        found = {}
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), SQL_CHUNK_SIZE):
+                chunk = unique_keys[i:i + SQL_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+                found.update(rows)
+            now = time.time()
+            found_keys = list(found)
+            for i in range(0, len(found_keys), SQL_CHUNK_SIZE):
+                chunk = found_keys[i:i + SQL_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                self._conn.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+                                   [now, *chunk])
+            self._conn.commit()
+
+        hits = {i: np.frombuffer(found[key], dtype=np.float32).tolist()
+                for i, key in enumerate(keys) if key in found}
+        self.hits += len(hits)
+        self.misses += len(texts) - len(hits)
+        return hits
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]):
+        """Store embeddings for texts, evicting the least recently used entries beyond max_entries."""
+        if not texts:
+            return
+        now = time.time()
+        rows = [(cache_key(text), np.asarray(embedding, dtype=np.float32).tobytes(), now)
+                for text, embedding in zip(texts, embeddings)]
+        with self._lock:
+            # Keys hash the model and text, so a stored embedding never changes; rowcount is then
+            # the number of new entries and the count is kept without scanning the table
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)", rows).rowcount
+            if inserted < len(rows):
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key, _, _ in rows])
+            self._count += inserted
+            if self._count > self.max_entries:
+                evict = self._count - int(self.max_entries * EVICT_TO)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (evict,))
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                logger.info(f"🧹 Evicted {evict} least recently used embeddings from the cache")
+            self._conn.commit()
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+_cache = None
+_cache_error = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[EmbeddingCache]:
+    """The process-wide cache, opened on first use; None when disabled or unusable."""
+    global _cache, _cache_error
+    if not CACHE_PATH:
+        return None
+    with _cache_lock:
+        if _cache is None and _cache_error is None:
+            try:
+                _cache = EmbeddingCache(CACHE_PATH)
+                logger.info(f"✅ Embedding cache opened at {CACHE_PATH} ({len(_cache)} entries)")
+            except Exception as e:
+                # Embedding still works without the cache, just slower
+                _cache_error = e
+                logger.error(f"❌ Could not open embedding cache at {CACHE_PATH}: {e}. Caching is disabled.")
+        return _cache
@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger("embedding-service")
+
+MODEL_ID = "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
+# Use environment variable for flexibility, default to ~/models/m for local development
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", os.path.expanduser("~/models/m"))
+# Tokens per text; longer texts are truncated
+MAX_LENGTH = 128
+
+# "torch" runs the fp32 PyTorch model; "onnx" runs the int8-quantized export on ONNX Runtime
+# (see export_onnx_model.py) and keeps torch off the hot path.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+ONNX_S3_BUCKET_NAME = os.getenv("ONNX_MODEL_BUCKET")
+ONNX_S3_KEY = os.getenv("ONNX_MODEL_KEY", "models/model-quant.onnx")
+ONNX_LOCAL_PATH = Path(os.getenv("ONNX_LOCAL_PATH", "/tmp/model-quant.onnx"))
+
+# Length-bucketed batching: a batch's padded size (rows x longest text) stays under this many tokens
+MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "8192"))
+# ...and never holds more than this many texts, however short they are
+MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "256"))
+
+# The single copy of the weights in this process, loaded on first use
+# (a torch module, or an onnxruntime InferenceSession for the onnx backend)
+_tokenizer = None
+_model = None
+_load_error = None
+_load_lock = threading.Lock()
+# Fast tokenizers are not safe to call from several threads at once, so inference is serialised
+_infer_lock = threading.Lock()
+
+
+def _log_model_dir():
+    # Show what is actually at the model path; most load failures are a wrong path or a partial download
+    config_path = os.path.join(LOCAL_MODEL_PATH, 'config.json')
+    if os.path.exists(config_path):
+        return
+    logger.error(f"config.json NOT FOUND at {config_path}")
+    if os.path.isdir(LOCAL_MODEL_PATH):
+        for root, dirs, files in os.walk(LOCAL_MODEL_PATH):
+            logger.error(f"  Dir: {root}, Files: {files}, Dirs: {dirs}")
+
+
+def _ensure_onnx_model():
+    """Download the quantized ONNX model from S3 unless it is already on disk."""
+    if ONNX_LOCAL_PATH.exists():
+        return
+    if not ONNX_S3_BUCKET_NAME:
+        raise FileNotFoundError(
+            f"{ONNX_LOCAL_PATH} not found and ONNX_MODEL_BUCKET is not set; run backend/export_onnx_model.py")
+    import boto3
+    logger.info(f"Downloading ONNX model from s3://{ONNX_S3_BUCKET_NAME}/{ONNX_S3_KEY} ...")
+    ONNX_LOCAL_PATH.parent.mkdir(parents=True, exist_ok=True)
+    boto3.client("s3").download_file(ONNX_S3_BUCKET_NAME, ONNX_S3_KEY, str(ONNX_LOCAL_PATH))
+
+
+def _load():
+    global _tokenizer, _model, _load_error
+    with _load_lock:
+        if _model is not None or _load_error is not None:
+            return
+        try:
+            from transformers import AutoTokenizer
+            logger.info(f"Loading {EMBEDDING_BACKEND} embedding model from local path: {LOCAL_MODEL_PATH}")
+            _tokenizer = AutoTokenizer.from_pretrained(LOCAL_MODEL_PATH, local_files_only=True)
+            if EMBEDDING_BACKEND == "onnx":
+                import onnxruntime as ort
+                _ensure_onnx_model()
+                _model = ort.InferenceSession(str(ONNX_LOCAL_PATH), providers=["CPUExecutionProvider"])
+            else:
+                from transformers import AutoModel
+                _model = AutoModel.from_pretrained(LOCAL_MODEL_PATH, local_files_only=True)
+                _model.eval()
+            logger.info("✅ Embedding model loaded successfully")
+        except Exception as e:
+            # Remember the failure so every caller does not retry a slow, doomed load
+            _load_error = e
+            logger.error(f"❌ Failed to load embedding model: {e}. Embeddings are disabled.")
+            logger.info("⚠️  To fix this, run: python backend/download_model.py")
+            _log_model_dir()
+
+
+def model_key() -> str:
+    """Identity of the vectors this process produces; the backends differ slightly numerically."""
+    return f"{MODEL_ID}:{EMBEDDING_BACKEND}"
+
+
+def is_available() -> bool:
+    """Load the model if needed and report whether embeddings can be computed."""
+    if _model is None and _load_error is None:
+        _load()
+    return _model is not None
+
+
+# Mean Pooling - Take average of all tokens
+def _mean_pooling(model_output, attention_mask):
+    import torch
+    token_embeddings = model_output[0] # First element of model_output contains all token embeddings
+    input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
+    return torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
+
+
+def _encode_torch(texts: List[str]) -> List[List[float]]:
+    import torch
+    import torch.nn.functional as F
+
+    with _infer_lock:
+        encoded_input = _tokenizer(
+            texts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=MAX_LENGTH
+        )
+        with torch.no_grad():
+            model_output = _model(**encoded_input)
+
+    embeddings = _mean_pooling(model_output, encoded_input['attention_mask'])
+    return F.normalize(embeddings, p=2, dim=1).tolist()
+
+
+def _encode_onnx(texts: List[str]) -> List[List[float]]:
+    # Same tokenisation, mean pooling and L2 normalisation as the torch path, in numpy
+    import numpy as np
+
+    with _infer_lock:
+        encoded_input = _tokenizer(
+            texts,
+            return_tensors="np",
+            padding=True,
+            truncation=True,
+            max_length=MAX_LENGTH
+        )
+        input_names = {i.name for i in _model.get_inputs()}
+        feed = {k: v.astype(np.int64) for k, v in encoded_input.items() if k in input_names}
+        token_embeddings = _model.run(None, feed)[0]
+
+    mask = encoded_input['attention_mask'][..., None].astype(np.float32)
+    embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    norms = np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+    return (embeddings / norms).tolist()
+
+
+def embed_batch(texts: List[str]) -> Optional[List[List[float]]]:
+    """
+    Embed texts with MiniLM: mean-pooled, L2-normalised 384-d vectors.
+    EMBEDDING_BACKEND picks the fp32 torch model or the int8 ONNX export.
+
+    Args:
+        texts (List[str]): Texts to embed
+
+    Returns:
+        List[List[float]] or None: One vector per text, or None if the model is unavailable
+    """
+    if not is_available():
+        return None
+    if not texts:
+        return []
+    if EMBEDDING_BACKEND == "onnx":
+        return _encode_onnx(texts)
+    return _encode_torch(texts)
+
+
+def token_lengths(texts: List[str]) -> Optional[List[int]]:
+    """Token count of each text after truncation, special tokens included; None if the model is unavailable."""
+    if not is_available():
+        return None
+    if not texts:
+        return []
+    with _infer_lock:
+        encoded = _tokenizer(texts, truncation=True, max_length=MAX_LENGTH)
+    return [len(ids) for ids in encoded['input_ids']]
+
+
+def plan_batches(lengths: List[int], max_tokens: int = MAX_BATCH_TOKENS,
+                 max_size: int = MAX_BATCH_SIZE) -> List[List[int]]:
+    """
+    Group text indices into batches of similar length so little compute goes to padding.
+
+    Indices are sorted by token length and cut into consecutive runs whose padded
+    size (batch rows x longest text in the batch) stays within max_tokens.
+
+    Args:
+        lengths (List[int]): Token length of each text, as returned by token_lengths
+        max_tokens (int): Padded token budget per batch
+        max_size (int): Maximum number of texts per batch
+
+    Returns:
+        List[List[int]]: Indices into lengths, one list per batch
+    """
+    batches = []
+    current = []
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        # Ascending order, so lengths[i] is the longest text of the batch once added
+        if current and ((len(current) + 1) * lengths[i] > max_tokens or len(current) >= max_size):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def embed_bucketed(texts: List[str], lengths: List[int] = None) -> Optional[List[List[float]]]:
+    """
+    Embed any number of texts in length-bucketed, token-capped batches (see plan_batches).
+
+    Args:
+        texts (List[str]): Texts to embed
+        lengths (List[int]): Their token lengths, if already known
+
+    Returns:
+        List[List[float]] or None: One vector per text in the original order, or None if the model is unavailable
+    """
+    if lengths is None:
+        lengths = token_lengths(texts)
+    if lengths is None:
+        return None
+
+    embeddings = [None] * len(texts)
+    for batch in plan_batches(lengths):
+        for i, embedding in zip(batch, embed_batch([texts[i] for i in batch])):
+            embeddings[i] = embedding
+    return embeddings
+
+
+def embed_query(text: str) -> Optional[List[float]]:
+    """Embed a single search query; None if the model is unavailable."""
+    embeddings = embed_batch([text])
+    return embeddings[0] if embeddings else None
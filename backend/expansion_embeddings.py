@@ -0,0 +1,112 @@
+"""
+Precomputed embeddings of the category_config.CFG expansion phrases.
+
+fetch_by_feature searches with every expansion of a feature; the phrases are
+constant, so their vectors are computed once and persisted instead of running
+the model on each request. Build them into the image with
+
+    python -m backend.expansion_embeddings
+
+Otherwise they are computed in a single batch on first use and saved then.
+"""
+import logging
+import os
+import sys
+import threading
+from typing import Dict, List
+
+import numpy as np
+
+from . import category_config
+from . import embedding_service
+from .embedding_cache import normalise_text
+
+logger = logging.getLogger("query_db")
+
+EXPANSION_EMBEDDINGS_PATH = os.getenv(
+    "EXPANSION_EMBEDDINGS_PATH", os.path.join(embedding_service.LOCAL_MODEL_PATH, "expansion_embeddings.npz"))
+# Used when the model directory is read-only (e.g. the Lambda image outside /tmp)
+FALLBACK_PATH = "/tmp/expansion_embeddings.npz"
+
+_embeddings = None
+_lock = threading.Lock()
+
+
+def expansion_texts() -> List[str]:
+    """Every distinct, normalised expansion phrase in CFG."""
+    texts = (normalise_text(q) for cfg in category_config.CFG.values() for q in cfg.get("expansions", []))
+    return list(dict.fromkeys(texts))
+
+
+def compute() -> Dict[str, List[float]]:
+    """Embed all expansion phrases in one batch; empty if the model is unavailable."""
+    texts = expansion_texts()
+    embeddings = embedding_service.embed_batch(texts)
+    if embeddings is None:
+        return {}
+    return dict(zip(texts, embeddings))
+
+
+def save(embeddings: Dict[str, List[float]], path: str = EXPANSION_EMBEDDINGS_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # np.savez appends .npz unless the name already ends with it
+    np.savez(
+        path,
+        model_key=np.array(embedding_service.model_key()),
+        texts=np.array(list(embeddings)),
+        embeddings=np.asarray(list(embeddings.values()), dtype=np.float32),
+    )
+
+
+def _read(path: str) -> Dict[str, List[float]]:
+    # Vectors from another model or backend, or for old phrases, are not used
+    with np.load(path) as data:
+        if str(data["model_key"]) != embedding_service.model_key():
+            logger.warning(f"Ignoring {path}: computed with {data['model_key']}")
+            return {}
+        stored = dict(zip(data["texts"].tolist(), data["embeddings"].tolist()))
+    wanted = set(expansion_texts())
+    return {text: vector for text, vector in stored.items() if text in wanted}
+
+
+def get() -> Dict[str, List[float]]:
+    """Normalised expansion phrase -> embedding, loaded from disk or computed and persisted once."""
+    global _embeddings
+    if _embeddings is not None:
+        return _embeddings
+    with _lock:
+        if _embeddings is not None:
+            return _embeddings
+        embeddings = {}
+        for path in (EXPANSION_EMBEDDINGS_PATH, FALLBACK_PATH):
+            if os.path.exists(path):
+                try:
+                    embeddings = _read(path)
+                except Exception as e:
+                    logger.error(f"Error reading expansion embeddings from {path}: {e}")
+                if len(embeddings) == len(expansion_texts()):
+                    logger.info(f"✅ Loaded {len(embeddings)} expansion embeddings from {path}")
+                    break
+
+        if len(embeddings) < len(expansion_texts()):
+            embeddings = compute()
+            if embeddings:
+                for path in (EXPANSION_EMBEDDINGS_PATH, FALLBACK_PATH):
+                    try:
+                        save(embeddings, path)
+                        logger.info(f"✅ Computed and saved {len(embeddings)} expansion embeddings to {path}")
+                        break
+                    except OSError as e:
+                        logger.warning(f"Could not save expansion embeddings to {path}: {e}")
+        _embeddings = embeddings
+        return _embeddings
+
+
+if __name__ == '__main__':
+    print(f'Embedding {len(expansion_texts())} CFG expansion phrases...', flush=True)
+    computed = compute()
+    if not computed:
+        print('FATAL ERROR: embedding model could not be loaded', file=sys.stderr, flush=True)
+        sys.exit(1)
+    save(computed)
+    print(f'✅ Saved expansion embeddings to: {EXPANSION_EMBEDDINGS_PATH}', flush=True)
@@ -0,0 +1,81 @@
+"""
+Export multi-qa-MiniLM-L6-cos-v1 to ONNX and quantize it to int8 for the onnx embedding backend.
+
+Usage: python backend/export_onnx_model.py [--upload]
+
+Reads the model downloaded by download_model.py (LOCAL_MODEL_PATH), writes the fp32
+export next to ONNX_LOCAL_PATH and the dynamically quantized model to ONNX_LOCAL_PATH.
+With --upload the quantized model is copied to s3://$ONNX_MODEL_BUCKET/$ONNX_MODEL_KEY,
+where the Lambda downloads it from on a cold start.
+"""
+import sys
+from pathlib import Path
+
+import torch
+from transformers import AutoModel
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from backend.embedding_service import (  # noqa: E402
+    LOCAL_MODEL_PATH, MAX_LENGTH, ONNX_LOCAL_PATH, ONNX_S3_BUCKET_NAME, ONNX_S3_KEY
+)
+
+OPSET_VERSION = 14
+
+
+class _TokenEmbeddings(torch.nn.Module):
+    # Only the token embeddings are exported; mean pooling stays in embedding_service
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                          token_type_ids=token_type_ids)[0]
+
+
+def export(fp32_path: Path):
+    print(f'Exporting {LOCAL_MODEL_PATH} to {fp32_path}...', flush=True)
+    model = AutoModel.from_pretrained(LOCAL_MODEL_PATH, local_files_only=True)
+    model.eval()
+    dummy = torch.ones((2, MAX_LENGTH), dtype=torch.long)
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'}
+                    for name in ('input_ids', 'attention_mask', 'token_type_ids', 'last_hidden_state')}
+    torch.onnx.export(
+        _TokenEmbeddings(model),
+        (dummy, dummy, torch.zeros_like(dummy)),
+        str(fp32_path),
+        input_names=['input_ids', 'attention_mask', 'token_type_ids'],
+        output_names=['last_hidden_state'],
+        dynamic_axes=dynamic_axes,
+        opset_version=OPSET_VERSION,
+    )
+
+
+def quantize(fp32_path: Path, int8_path: Path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    print(f'Quantizing weights to int8: {int8_path}...', flush=True)
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+
+
+if __name__ == '__main__':
+    try:
+        ONNX_LOCAL_PATH.parent.mkdir(parents=True, exist_ok=True)
+        fp32_path = ONNX_LOCAL_PATH.with_name(ONNX_LOCAL_PATH.stem + '-fp32.onnx')
+        export(fp32_path)
+        quantize(fp32_path, ONNX_LOCAL_PATH)
+        print(f'Model sizes: fp32 {fp32_path.stat().st_size / 1024 ** 2:.1f} MB, '
+              f'int8 {ONNX_LOCAL_PATH.stat().st_size / 1024 ** 2:.1f} MB', flush=True)
+
+        if '--upload' in sys.argv[1:]:
+            if not ONNX_S3_BUCKET_NAME:
+                print('FATAL ERROR: ONNX_MODEL_BUCKET is not set', file=sys.stderr, flush=True)
+                sys.exit(1)
+            import boto3
+            boto3.client('s3').upload_file(str(ONNX_LOCAL_PATH), ONNX_S3_BUCKET_NAME, ONNX_S3_KEY)
+            print(f'Uploaded to s3://{ONNX_S3_BUCKET_NAME}/{ONNX_S3_KEY}', flush=True)
+
+        print(f'✅ Quantized ONNX model ready at: {ONNX_LOCAL_PATH}', flush=True)
+        print('   Run python backend/benchmark_embeddings.py to check parity and speed.', flush=True)
+    except Exception as e:
+        print(f'FATAL ERROR IN export_onnx_model.py: {e}', file=sys.stderr, flush=True)
+        sys.exit(1)
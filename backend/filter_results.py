@@ -0,0 +1,113 @@
+"""
+Cache of /get_filtered_cmts results, so an identical filter never re-filters or re-uploads.
+
+A result is stored in S3 under a deterministic key, derived from a hash of the
+canonical filter set and the ETags of the input comment files. New scrapes change
+the inputs and therefore the key, so stale results are never returned. Keys already
+known to exist are also remembered in memory, which skips the S3 HEAD request.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Tuple
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger("lambda-fastapi-router")
+
+# Bump when the filter semantics or the output format change
+RESULT_VERSION = 1
+# The name keeps results out of list_s3_files and the manifest backfill
+RESULT_PREFIX = "filtered_comments/"
+# Time-window filters move with the clock; their results are reused within one bucket of this length
+TIME_BUCKET_SECONDS = int(os.getenv("FILTER_RESULT_TIME_BUCKET_SECONDS", "3600"))
+# Result keys remembered in memory
+MAX_REMEMBERED = 1024
+
+# Filters whose values the filter function compares case-insensitively and as sets
+LABEL_FIELDS = ('emotions', 'topics', 'practitioner_types')
+
+
+def canonical_filters(filters: dict) -> dict:
+    """Filters with the None values dropped and order and case removed where they do not matter."""
+    canonical = {}
+    for field, value in filters.items():
+        if value is None:
+            continue
+        if field in LABEL_FIELDS:
+            value = sorted({v.lower() for v in value})
+        elif field == 'subreddits':
+            value = sorted(set(value))
+        elif field in ('time', 'keyword'):
+            value = value.lower()
+        elif field == 'min_intensity':
+            value = float(value)
+        canonical[field] = value
+    return canonical
+
+
+def result_key(filters: dict, inputs: Iterable[Tuple[str, str]]) -> str:
+    """
+    Deterministic S3 key of the result of filters over inputs.
+
+    Args:
+        filters (dict): FilterRequest fields
+        inputs: (S3 key, ETag) of every input comment file
+    """
+    canonical = canonical_filters(filters)
+    payload = {
+        'version': RESULT_VERSION,
+        'filters': canonical,
+        'inputs': sorted(inputs),
+    }
+    if canonical.get('time'):
+        payload['time_bucket'] = int(time.time() // TIME_BUCKET_SECONDS)
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{RESULT_PREFIX}{digest}.csv.br"
+
+
+class FilterResultCache:
+    """
+    Remembers which result keys exist in S3. Safe to share between threads.
+
+    Args:
+        max_remembered (int): Keys kept in memory, least recently used dropped first
+    """
+
+    def __init__(self, max_remembered: int = MAX_REMEMBERED):
+        self.max_remembered = max_remembered
+        self.hits = 0
+        self.misses = 0
+        self._known = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, key: str):
+        with self._lock:
+            self._known[key] = True
+            self._known.move_to_end(key)
+            while len(self._known) > self.max_remembered:
+                self._known.popitem(last=False)
+
+    def exists(self, s3_client, bucket: str, key: str) -> bool:
+        """Whether the result is already stored, from memory or a HEAD request."""
+        with self._lock:
+            if key in self._known:
+                self._known.move_to_end(key)
+                self.hits += 1
+                return True
+        try:
+            s3_client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if str(e.response.get('Error', {}).get('Code')) not in ('404', 'NoSuchKey', 'NotFound'):
+                logger.warning(f"Could not check for cached filter result {key}: {e}")
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        self.remember(key)
+        return True
@@ -0,0 +1,109 @@
+"""
+Process-local cache of the decoded comment DataFrames behind the filter routes,
+together with their label indexes.
+
+Entries are keyed by (bucket, key, ETag). A re-uploaded object has a new ETag, so a
+stale frame is never served; it just ages out. A warm container can therefore
+answer a repeated or slightly changed filter without touching S3.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger("lambda-fastapi-router")
+
+# Memory budget for cached frames; 0 disables the cache
+FRAME_CACHE_MAX_MB = int(os.getenv("FRAME_CACHE_MAX_MB", "256"))
+
+CacheKey = Tuple[str, str, str]
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    """In-memory size of a frame, including the Python strings of object columns."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def value_bytes(value) -> int:
+    """Size of a cached value: a frame, an object with nbytes, or a tuple of them."""
+    if isinstance(value, pd.DataFrame):
+        return frame_bytes(value)
+    if isinstance(value, tuple):
+        return sum(value_bytes(v) for v in value)
+    return int(getattr(value, 'nbytes', 0))
+
+
+class FrameCache:
+    """
+    LRU of DataFrames (or tuples of a frame and its indexes) bounded by their total
+    in-memory size. Safe to share between threads.
+
+    Cached values are shared between requests and must be treated as read-only;
+    pd.concat copies, and filter_reddit_comments does not modify its input.
+
+    Args:
+        max_bytes (int): Budget; the least recently used frames are dropped beyond it
+    """
+
+    def __init__(self, max_bytes: int = FRAME_CACHE_MAX_MB * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, key: CacheKey) -> Optional[Any]:
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: CacheKey, value):
+        size = value_bytes(value)
+        if size > self.max_bytes:
+            # Would evict everything else and still not fit
+            logger.info(f"Not caching {key[1]}: {size / 1024 ** 2:.1f} MB exceeds the frame cache budget")
+            return
+        with self._lock:
+            old = self._frames.pop(key, None)
+            if old is not None:
+                self.size_bytes -= old[1]
+            self._frames[key] = (value, size)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._frames.popitem(last=False)
+                self.size_bytes -= evicted_size
+
+    def get_or_load(self, key: CacheKey, load: Callable[[], Any]):
+        """The cached value for key, or load() it and cache the result."""
+        value = self.get(key)
+        if value is None:
+            value = load()
+            self.put(key, value)
+        return value
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'frames': len(self._frames),
+            'size_mb': round(self.size_bytes / 1024 ** 2, 1),
+            'max_mb': round(self.max_bytes / 1024 ** 2, 1),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
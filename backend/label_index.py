@@ -0,0 +1,219 @@
+"""
+Inverted indexes over the emotion, topic and practitioner-type labels of a comment file.
+
+For every lowercase label the index holds the sorted positions of the rows that carry
+it, and for emotions their scores, in CSR form: one flat row array per kind plus
+offsets into it. A label filter is then a union or intersection of a few short
+sorted arrays instead of a JSON parse of every row. The scraper writes one next to
+each comment file (<name>.labels.npz); the API loads it with the file, or builds it
+from the DataFrame when there is none.
+"""
+import io
+import json
+import re
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+INDEX_SUFFIX = ".labels.npz"
+# Bump when the file layout changes; older files are rebuilt from the data
+INDEX_VERSION = 1
+KINDS = ('emotions', 'topics', 'practitioner_types')
+# Source column of each kind
+SOURCE_COLUMNS = {
+    'emotions': 'emotions',
+    'topics': 'topics',
+    'practitioner_types': 'practitioner_reference',
+}
+
+
+def index_name(csv_br_name: str) -> str:
+    """reddit_x_comments_ts.csv.br -> reddit_x_comments_ts.labels.npz"""
+    return re.sub(r"\.csv\.br$", "", csv_br_name) + INDEX_SUFFIX
+
+
+def _parse_dict(raw):
+    """A JSON analysis cell as a dict; None when it is not a JSON object."""
+    if raw is None or raw is pd.NA or (isinstance(raw, float) and np.isnan(raw)):
+        return {}
+    if isinstance(raw, str):
+        if not raw.strip():
+            return {}
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError:
+            return None
+    return raw if isinstance(raw, dict) else None
+
+
+class _Builder:
+    """Collects postings row by row."""
+
+    def __init__(self):
+        self.n_rows = 0
+        self.rows = {kind: {} for kind in KINDS}
+        self.scores = {}
+        self.invalid = {kind: [] for kind in KINDS}
+
+    def _add_scores(self, kind: str, row: int, raw):
+        # Same reading as the old per-row filter: every non-null value must be a number
+        parsed = _parse_dict(raw)
+        try:
+            scores = {k.lower(): float(v) for k, v in parsed.items() if v is not None}
+        except (AttributeError, ValueError, TypeError):
+            self.invalid[kind].append(row)
+            return
+        for label, score in scores.items():
+            self.rows[kind].setdefault(label, []).append(row)
+            if kind == 'emotions':
+                self.scores.setdefault(label, []).append(score)
+
+    def add(self, emotions, topics, practitioner_reference):
+        row = self.n_rows
+        self.n_rows += 1
+        self._add_scores('emotions', row, emotions)
+        self._add_scores('topics', row, topics)
+
+        parsed = _parse_dict(practitioner_reference)
+        practitioner_type = parsed.get("practitioner_type", "") if parsed is not None else None
+        if parsed is None or (practitioner_type and not isinstance(practitioner_type, str)):
+            self.invalid['practitioner_types'].append(row)
+        elif practitioner_type:
+            self.rows['practitioner_types'].setdefault(practitioner_type.lower(), []).append(row)
+
+    def finish(self) -> "LabelIndex":
+        arrays = {'n_rows': np.array(self.n_rows, dtype=np.int64)}
+        for kind in KINDS:
+            labels = sorted(self.rows[kind])
+            postings = [np.asarray(self.rows[kind][label], dtype=np.int32) for label in labels]
+            arrays[f'{kind}_labels'] = np.array(labels, dtype=str)
+            arrays[f'{kind}_offsets'] = np.cumsum([0] + [len(p) for p in postings], dtype=np.int64)
+            arrays[f'{kind}_rows'] = np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32)
+            arrays[f'{kind}_invalid'] = np.asarray(self.invalid[kind], dtype=np.int32)
+            if kind == 'emotions':
+                arrays['emotions_scores'] = (np.concatenate([np.asarray(self.scores[label], dtype=np.float64)
+                                                             for label in labels])
+                                             if labels else np.zeros(0, dtype=np.float64))
+        return LabelIndex(arrays)
+
+
+class LabelIndex:
+    """
+    Label -> row positions of one comment file, or of several concatenated ones.
+
+    Rows whose JSON could not be parsed carry no labels and are listed per kind, so
+    filters can reproduce how the per-row checks treated them.
+
+    Args:
+        arrays (dict): The CSR arrays, as written by save()
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.arrays = arrays
+        self.n_rows = int(arrays['n_rows'])
+        self._positions = {kind: {label: i for i, label in enumerate(arrays[f'{kind}_labels'].tolist())}
+                           for kind in KINDS}
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def labels(self, kind: str) -> List[str]:
+        return list(self._positions[kind])
+
+    def _slice(self, kind: str, label: str):
+        i = self._positions[kind].get(label.lower())
+        if i is None:
+            return None
+        offsets = self.arrays[f'{kind}_offsets']
+        return slice(offsets[i], offsets[i + 1])
+
+    def rows(self, kind: str, label: str) -> np.ndarray:
+        """Sorted positions of the rows with the label; empty when no row has it."""
+        s = self._slice(kind, label)
+        return self.arrays[f'{kind}_rows'][s] if s is not None else np.zeros(0, dtype=np.int32)
+
+    def scores(self, label: str) -> np.ndarray:
+        """Emotion scores of rows('emotions', label), in the same order."""
+        s = self._slice('emotions', label)
+        return self.arrays['emotions_scores'][s] if s is not None else np.zeros(0, dtype=np.float64)
+
+    def _mask(self, rows: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def any_mask(self, kind: str, labels: Iterable[str]) -> np.ndarray:
+        """Rows carrying at least one of the labels."""
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for label in labels:
+            mask[self.rows(kind, label)] = True
+        return mask
+
+    def all_at_least_mask(self, labels: Iterable[str], min_score: float) -> np.ndarray:
+        """Rows whose emotions parsed and where every label scores at least min_score."""
+        mask = ~self.invalid_mask('emotions')
+        for label in labels:
+            mask &= self._mask(self.rows('emotions', label)[self.scores(label) >= min_score])
+        return mask
+
+    def invalid_mask(self, kind: str) -> np.ndarray:
+        return self._mask(self.arrays[f'{kind}_invalid'])
+
+    def save(self, path):
+        np.savez_compressed(path, version=np.array(INDEX_VERSION), **self.arrays)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Optional["LabelIndex"]:
+        """Load a saved index; None when it was written by another INDEX_VERSION."""
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            if int(npz['version']) != INDEX_VERSION:
+                return None
+            return cls({key: npz[key] for key in npz.files if key != 'version'})
+
+    @classmethod
+    def from_comments(cls, comments: Iterable[dict]) -> "LabelIndex":
+        """Index comment dicts, e.g. the SavedComments of a scrape, in iteration order."""
+        builder = _Builder()
+        for comment in comments:
+            builder.add(comment.get('emotions'), comment.get('topics'), comment.get('practitioner_reference'))
+        return builder.finish()
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "LabelIndex":
+        """Index the rows of a DataFrame in positional order."""
+        missing = [None] * len(df)
+        columns = [df[SOURCE_COLUMNS[kind]].tolist() if SOURCE_COLUMNS[kind] in df.columns else missing
+                   for kind in KINDS]
+        builder = _Builder()
+        for emotions, topics, practitioner_reference in zip(*columns):
+            builder.add(emotions, topics, practitioner_reference)
+        return builder.finish()
+
+    @classmethod
+    def concat(cls, indexes: List["LabelIndex"]) -> "LabelIndex":
+        """Index of the row-wise concatenation of the indexed frames, in the same order."""
+        offsets = np.cumsum([0] + [index.n_rows for index in indexes])
+        arrays = {'n_rows': np.array(offsets[-1], dtype=np.int64)}
+        for kind in KINDS:
+            labels = sorted(set().union(*(index.labels(kind) for index in indexes)))
+            postings, scores = [], []
+            for label in labels:
+                # Offsets grow with each index, so the merged postings stay sorted
+                postings.append(np.concatenate([index.rows(kind, label).astype(np.int64) + offset
+                                                for index, offset in zip(indexes, offsets)]).astype(np.int32))
+                if kind == 'emotions':
+                    scores.append(np.concatenate([index.scores(label) for index in indexes]))
+            arrays[f'{kind}_labels'] = np.array(labels, dtype=str)
+            arrays[f'{kind}_offsets'] = np.cumsum([0] + [len(p) for p in postings], dtype=np.int64)
+            arrays[f'{kind}_rows'] = np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32)
+            arrays[f'{kind}_invalid'] = np.concatenate(
+                [index.arrays[f'{kind}_invalid'].astype(np.int64) + offset
+                 for index, offset in zip(indexes, offsets)] or [np.zeros(0)]).astype(np.int32)
+            if kind == 'emotions':
+                arrays['emotions_scores'] = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float64)
+        return cls(arrays)
@@ -0,0 +1,357 @@
+"""
+In-process flat vector index, a drop-in alternative to the match_reddit_records RPC.
+
+The index is a directory holding
+    vectors.f32    - row-major float32 matrix of L2-normalised embeddings, memory-mapped
+    metadata.json  - id, comment, subreddit, emotions, topics, practitioner_reference and
+                     created_at of every row, in the same order
+so a search is one matrix-vector product over the rows that pass the filters. It is
+built from scrape output (see build_from_comments, or run
+`python -m backend.local_vector_index OUT_DIR FILE.csv.br ...`) and needs no Supabase.
+`python -m backend.local_vector_index --self-test` checks the build, filters and search
+offline on synthetic comments and vectors.
+query_db routes searches here when LOCAL_VECTOR_INDEX_PATH is set.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+
+from . import vectorise_comment
+
+logger = logging.getLogger("query_db")
+
+# Directory of the local index; empty disables it and searches go to Supabase
+LOCAL_VECTOR_INDEX_PATH = os.getenv("LOCAL_VECTOR_INDEX_PATH", "")
+VECTORS_FILE = "vectors.f32"
+METADATA_FILE = "metadata.json"
+EMBEDDING_DIM = 384
+# Comments embedded per vectorise_batch call while building
+BUILD_CHUNK_SIZE = 1000
+
+TIME_WINDOWS = {
+    "past_day": timedelta(days=1),
+    "past_week": timedelta(weeks=1),
+    "past_month": timedelta(days=30),
+    "past_year": timedelta(days=365),
+}
+
+
+def _as_dict(value) -> dict:
+    # Analysis columns arrive as dicts from the sink and as JSON strings from older CSVs
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+def _to_epoch(value) -> float:
+    # Scraped timestamps are naive UTC ISO strings
+    if not value:
+        return np.nan
+    try:
+        created = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return np.nan
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return created.timestamp()
+
+
+def metadata_record(comment: dict) -> dict:
+    """The row stored for a comment; field names match what match_reddit_records returns."""
+    return {
+        'id': comment.get('id'),
+        'comment': comment.get('body') or comment.get('comment') or "",
+        'subreddit': comment.get('subreddit'),
+        'emotions': _as_dict(comment.get('emotions')),
+        'topics': _as_dict(comment.get('topics')),
+        'practitioner_reference': _as_dict(comment.get('practitioner_reference')),
+        'created_at': comment.get('created_utc') or comment.get('created_at'),
+    }
+
+
+class LocalVectorIndex:
+    """
+    Flat cosine-similarity index over a memory-mapped embedding matrix.
+
+    Filters are evaluated on columns derived from the metadata once at load time:
+    lowercase subreddit and practitioner type arrays, creation timestamps, a score
+    column per emotion label and a row set per topic label.
+
+    Args:
+        path (str): Index directory written by build()
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.rows = meta['rows']
+        self.dim = meta.get('dim', EMBEDDING_DIM)
+        n = len(self.rows)
+        self.positions = {r['id']: i for i, r in enumerate(self.rows)}
+        self.vectors = (np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float32, mode="r", shape=(n, self.dim))
+                        if n else np.zeros((0, self.dim), dtype=np.float32))
+
+        self.subreddits = np.array([(r['subreddit'] or "").lower() for r in self.rows], dtype=object)
+        self.practitioner_types = np.array(
+            [(r['practitioner_reference'].get('practitioner_type') or "").lower() for r in self.rows], dtype=object)
+        self.created = np.array([_to_epoch(r['created_at']) for r in self.rows], dtype=np.float64)
+        self.emotion_scores = {}
+        self.topic_rows = {}
+        for i, r in enumerate(self.rows):
+            for label, score in r['emotions'].items():
+                if score is None:
+                    continue
+                column = self.emotion_scores.setdefault(label.lower(), np.full(n, np.nan, dtype=np.float32))
+                column[i] = float(score)
+            for label, score in r['topics'].items():
+                if score is not None:
+                    self.topic_rows.setdefault(label.lower(), []).append(i)
+        self.topic_rows = {label: np.array(idx, dtype=np.int64) for label, idx in self.topic_rows.items()}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def filter_mask(self, subreddit_filter=None, emotion_filter=None, intensity_score_filter=None,
+                    topic_filter=None, practitioner_types_filter=None, time_filter=None,
+                    candidate_ids=None) -> np.ndarray:
+        """
+        Boolean mask of the rows matching the RPC filters; None filters are ignored.
+        candidate_ids restricts the rows to a precomputed id set (e.g. an already filtered DataFrame).
+        """
+        n = len(self.rows)
+        mask = np.ones(n, dtype=bool)
+        if candidate_ids is not None:
+            allowed = np.zeros(n, dtype=bool)
+            allowed[[self.positions[i] for i in candidate_ids if i in self.positions]] = True
+            mask &= allowed
+        if subreddit_filter:
+            mask &= np.isin(self.subreddits, [s.lower() for s in subreddit_filter])
+        if emotion_filter:
+            labels = [e.lower() for e in emotion_filter]
+            if intensity_score_filter is not None:
+                # Every requested emotion must reach the intensity
+                for label in labels:
+                    column = self.emotion_scores.get(label)
+                    mask &= (column >= float(intensity_score_filter)) if column is not None else False
+            else:
+                any_emotion = np.zeros(n, dtype=bool)
+                for label in labels:
+                    column = self.emotion_scores.get(label)
+                    if column is not None:
+                        any_emotion |= ~np.isnan(column)
+                mask &= any_emotion
+        if topic_filter:
+            any_topic = np.zeros(n, dtype=bool)
+            for label in topic_filter:
+                rows = self.topic_rows.get(label.lower())
+                if rows is not None:
+                    any_topic[rows] = True
+            mask &= any_topic
+        if practitioner_types_filter:
+            mask &= np.isin(self.practitioner_types, [p.lower() for p in practitioner_types_filter])
+        if time_filter:
+            window = TIME_WINDOWS.get(time_filter.lower())
+            if window is None:
+                raise ValueError(f"Invalid time filter: {time_filter}")
+            since = (datetime.now(timezone.utc) - window).timestamp()
+            mask &= self.created >= since
+        return mask
+
+    def search(self, query_embedding, match_threshold: float = 0.0, match_count: int = 10, **filters) -> List[dict]:
+        """
+        Rows most similar to the query, best first; same arguments and row shape as match_reddit_records.
+
+        Returns:
+            List[dict]: Metadata rows with a 'similarity' key, at most match_count of them
+        """
+        filters.pop('probes', None)
+        mask = self.filter_mask(**filters)
+        candidates = np.flatnonzero(mask)
+        if not len(candidates) or not match_count:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        # Unfiltered searches read the mapped matrix in place instead of copying the selected rows
+        scores = np.asarray(self.vectors @ query) if mask.all() else self.vectors[candidates] @ query
+        keep = scores >= match_threshold
+        candidates, scores = candidates[keep], scores[keep]
+        if len(scores) > match_count:
+            top = np.argpartition(-scores, match_count - 1)[:match_count]
+            candidates, scores = candidates[top], scores[top]
+        order = np.argsort(-scores)
+        return [{**self.rows[candidates[i]], 'similarity': float(scores[i])} for i in order]
+
+
+def build(path: str, rows: List[dict], vectors: np.ndarray):
+    """Write an index directory; files are swapped in only once complete."""
+    os.makedirs(path, exist_ok=True)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    vectors_tmp = os.path.join(path, VECTORS_FILE + ".tmp")
+    metadata_tmp = os.path.join(path, METADATA_FILE + ".tmp")
+    vectors.tofile(vectors_tmp)
+    with open(metadata_tmp, "w", encoding="utf-8") as f:
+        json.dump({'dim': vectors.shape[1] if vectors.ndim == 2 else EMBEDDING_DIM, 'rows': rows}, f, default=str)
+    os.replace(vectors_tmp, os.path.join(path, VECTORS_FILE))
+    os.replace(metadata_tmp, os.path.join(path, METADATA_FILE))
+    logger.info(f"✅ Local vector index with {len(rows)} rows written to {path}")
+
+
+def build_from_comments(comments: Iterable[dict], path: str = LOCAL_VECTOR_INDEX_PATH, append: bool = False,
+                        vectorise: Callable[[List[dict]], List[dict]] = None):
+    """
+    Embed analysed comments (e.g. SavedComments from a scrape) and write them as an index.
+    Unchanged bodies come from the embedding cache, so rebuilding after a scrape is cheap.
+
+    Args:
+        comments: Comment dicts with at least id and body
+        path (str): Index directory
+        append (bool): Keep the rows of an existing index whose ids are not in comments
+        vectorise: Embeds {'id', 'body'} dicts into {'id', 'embedding'} records;
+            vectorise_comment.vectorise_batch by default
+    """
+    vectorise = vectorise or vectorise_comment.vectorise_batch
+    rows, chunks, chunk = [], [], []
+
+    def embed_chunk():
+        records = {r['id']: r['embedding'] for r in vectorise(
+            [{'id': c['id'], 'body': c.get('body') or ""} for c in chunk])}
+        embedded = [c for c in chunk if c['id'] in records]
+        rows.extend(metadata_record(c) for c in embedded)
+        if embedded:
+            chunks.append(np.asarray([records[c['id']] for c in embedded], dtype=np.float32))
+        chunk.clear()
+
+    for comment in comments:
+        if comment.get('id'):
+            chunk.append(comment)
+        if len(chunk) >= BUILD_CHUNK_SIZE:
+            embed_chunk()
+    if chunk:
+        embed_chunk()
+
+    if append and os.path.exists(os.path.join(path, METADATA_FILE)):
+        existing = LocalVectorIndex(path)
+        new_ids = {r['id'] for r in rows}
+        kept = [i for i, r in enumerate(existing.rows) if r['id'] not in new_ids]
+        rows = [existing.rows[i] for i in kept] + rows
+        chunks.insert(0, np.asarray(existing.vectors[kept], dtype=np.float32))
+
+    vectors = np.concatenate(chunks) if chunks else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+    build(path, rows, vectors)
+
+
+_index = None
+_index_mtime = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> Optional[LocalVectorIndex]:
+    """The index at LOCAL_VECTOR_INDEX_PATH, reloaded when it is rebuilt; None if disabled or missing."""
+    global _index, _index_mtime
+    if not LOCAL_VECTOR_INDEX_PATH:
+        return None
+    metadata_path = os.path.join(LOCAL_VECTOR_INDEX_PATH, METADATA_FILE)
+    try:
+        mtime = os.path.getmtime(metadata_path)
+    except OSError:
+        return None
+    with _index_lock:
+        if _index is None or mtime != _index_mtime:
+            _index = LocalVectorIndex(LOCAL_VECTOR_INDEX_PATH)
+            _index_mtime = mtime
+            logger.info(f"✅ Loaded local vector index with {len(_index)} rows from {LOCAL_VECTOR_INDEX_PATH}")
+        return _index
+
+
+def self_test():
+    """
+    Build an index from synthetic comments and vectors in a temporary directory and
+    check the file round trip, the filter masks and the search order. Needs neither
+    the embedding model nor Supabase; raises AssertionError on the first mismatch.
+    """
+    import tempfile
+
+    dim = 8
+    axes = np.eye(dim, dtype=np.float32)
+    diagonal = (axes[0] + axes[1]) / np.sqrt(2)
+    vectors = {'a': axes[0], 'b': diagonal, 'c': axes[1], 'd': axes[2], 'e': axes[3]}
+
+    def vectorise(comments):
+        return [{'id': c['id'], 'embedding': vectors[c['id']].tolist()} for c in comments]
+
+    recent = (datetime.now(timezone.utc) - timedelta(hours=1)).replace(tzinfo=None).isoformat()
+    old = (datetime.now(timezone.utc) - timedelta(days=60)).replace(tzinfo=None).isoformat()
+    comments = [
+        {'id': 'a', 'body': "a", 'subreddit': "Anxiety", 'created_utc': recent,
+         'emotions': {'Fear': 0.9}, 'topics': {'sleep': 1}, 'practitioner_reference': {'practitioner_type': "Therapist"}},
+        {'id': 'b', 'body': "b", 'subreddit': "anxiety", 'created_utc': recent,
+         # Older CSVs hold the analysis columns as JSON strings
+         'emotions': '{"fear": 0.3, "joy": 0.8}', 'topics': '{"work": 1}', 'practitioner_reference': "{}"},
+        {'id': 'c', 'body': "c", 'subreddit': "depression", 'created_utc': old,
+         'emotions': {'sadness': 0.7}, 'topics': {}, 'practitioner_reference': {'practitioner_type': "psychiatrist"}},
+        {'id': 'd', 'body': "d", 'subreddit': "depression", 'created_utc': None,
+         'emotions': {}, 'topics': {'sleep': 1}, 'practitioner_reference': None},
+    ]
+
+    def ids(mask):
+        return [index.rows[i]['id'] for i in np.flatnonzero(mask)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_from_comments(comments, tmp, vectorise=vectorise)
+        index = LocalVectorIndex(tmp)
+        assert len(index) == 4 and index.dim == dim
+        for row in index.rows:
+            assert np.allclose(index.vectors[index.positions[row['id']]], vectors[row['id']])
+        assert index.rows[index.positions['b']]['emotions'] == {'fear': 0.3, 'joy': 0.8}
+
+        assert ids(index.filter_mask()) == ['a', 'b', 'c', 'd']
+        assert ids(index.filter_mask(subreddit_filter=["ANXIETY"])) == ['a', 'b']
+        assert ids(index.filter_mask(emotion_filter=["fear"])) == ['a', 'b']
+        assert ids(index.filter_mask(emotion_filter=["fear"], intensity_score_filter=0.5)) == ['a']
+        assert ids(index.filter_mask(emotion_filter=["fear", "joy"], intensity_score_filter=0.5)) == []
+        assert ids(index.filter_mask(topic_filter=["Sleep"])) == ['a', 'd']
+        assert ids(index.filter_mask(practitioner_types_filter=["therapist", "psychiatrist"])) == ['a', 'c']
+        assert ids(index.filter_mask(time_filter="past_week")) == ['a', 'b']
+        assert ids(index.filter_mask(candidate_ids={'a', 'c', 'unknown'})) == ['a', 'c']
+
+        query = axes[0]
+        assert [r['id'] for r in index.search(query, match_threshold=0.5, match_count=10)] == ['a', 'b']
+        assert [r['id'] for r in index.search(query, match_threshold=-1.0, match_count=2)] == ['a', 'b']
+        results = index.search(query, match_threshold=-1.0, match_count=10, candidate_ids={'b', 'c'})
+        assert [r['id'] for r in results] == ['b', 'c']
+        assert abs(results[0]['similarity'] - float(diagonal @ query)) < 1e-6
+        assert [r['id'] for r in index.search(query, match_count=1, candidate_ids={'b', 'c'})] == ['b']
+        assert index.search(query, subreddit_filter=["nonexistent"]) == []
+
+        # Appending replaces re-embedded ids and keeps the vectors of the others
+        build_from_comments([{**comments[0], 'subreddit': "sleep"}, {'id': 'e', 'body': "e", 'subreddit': "sleep"}],
+                            tmp, append=True, vectorise=vectorise)
+        index = LocalVectorIndex(tmp)
+        assert [r['id'] for r in index.rows] == ['b', 'c', 'd', 'a', 'e']
+        for row in index.rows:
+            assert np.allclose(index.vectors[index.positions[row['id']]], vectors[row['id']])
+        assert ids(index.filter_mask(subreddit_filter=["sleep"])) == ['a', 'e']
+        assert [r['id'] for r in index.search(axes[3], match_threshold=0.5)] == ['e']
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--self-test']:
+        self_test()
+        print('✅ Local vector index self-test passed', flush=True)
+        sys.exit(0)
+    if len(sys.argv) < 3:
+        print('Usage: python -m backend.local_vector_index OUT_DIR FILE.csv.br [FILE.csv.br ...]\n'
+              '       python -m backend.local_vector_index --self-test', file=sys.stderr)
+        sys.exit(1)
+    from .comment_sink import SavedComments
+    build_from_comments(SavedComments(sys.argv[2:], 0), sys.argv[1])
+    print(f'✅ Local vector index written to: {sys.argv[1]}', flush=True)
@@ -1,11 +1,14 @@
 import os
 import asyncio
+import json
 import logging
 import requests
 import io
 import csv
 import sys
 import brotli
+import itertools
+import uuid
 from datetime import datetime
 from pathlib import Path
 import boto3
@@ -17,7 +20,9 @@ import pandas as pd
 from .models import FilterRequest
 
 # Import filter_reddit_comments
-from .universal_filter_function import filter_reddit_comments
+from .universal_filter_function import (
+    filter_reddit_comments, normalize_null_values, prepare_filter_columns, read_csv_kwargs)
+from .scrape_checkpoint import is_valid_resume_token
 
 # --- FastAPI Imports ---
 from fastapi import FastAPI, HTTPException, Request
@@ -36,6 +41,14 @@ project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
 from . import reddit_scraper
+from . import scrape_jobs
+from . import local_vector_index
+from . import columnar_store
+from . import dataset_manifest
+from . import frame_cache
+from . import filter_results
+from . import comment_pages
+from .label_index import LabelIndex
 from . import generate_clusters
 from . import genWriteup
 
@@ -95,6 +108,19 @@ s3_client = boto3.client(
 # Define S3 config for Brotli output
 BROTLI_OUTPUT_BUCKET = os.getenv("BROTLI_OUTPUT_BUCKET")
 BROTLI_OUTPUT_PREFIX = os.getenv("BROTLI_OUTPUT_PREFIX", "reddit-comments/")
+# Index of the scraped comment files, read from S3 once and revalidated every few seconds
+MANIFEST_CACHE = dataset_manifest.ManifestCache()
+# Decoded comment files shared by the filter routes, keyed by (bucket, key, ETag)
+FRAME_CACHE = frame_cache.FrameCache()
+# Result keys of /get_filtered_cmts known to exist in S3
+FILTER_RESULTS = filter_results.FilterResultCache()
+# Sorted filter results served page by page by /comments/query, keyed like FRAME_CACHE
+RESULT_PAGES = frame_cache.FrameCache(max_bytes=comment_pages.RESULT_PAGE_CACHE_MAX_MB * 1024 ** 2)
+# Scrape job records and the one-scrape-at-a-time lock, shared by every container
+JOB_STORE = scrape_jobs.JobStore(s3_client, BROTLI_OUTPUT_BUCKET, BROTLI_OUTPUT_PREFIX)
+# Lambda function that runs scrape jobs, invoked asynchronously; this function by default.
+# Empty outside Lambda, where jobs run in the API process.
+SCRAPE_WORKER_FUNCTION = os.getenv("SCRAPE_WORKER_FUNCTION", os.getenv("AWS_LAMBDA_FUNCTION_NAME", ""))
 
 
 # helpers
@@ -144,19 +170,168 @@ def list_s3_files(bucket: str, suffix: str = ".csv.br", subreddit: Optional[str]
     return urls
 
 
+def s3_url(key: str) -> str:
+    return f"https://{BROTLI_OUTPUT_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}"
+
+
+def dataset_files(subreddits: Optional[List[str]] = None, time_filter: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    The comment files a request needs.
+
+    Files are picked from the cached dataset manifest by subreddit and time range;
+    a bucket without a manifest is listed instead.
+
+    Returns:
+        List[dict]: url and etag of each .csv.br, plus parquet_url / parquet_etag of its
+            Parquet copy and index_url of its label index (None when there is none).
+            ETags are None when not known from the manifest.
+    """
+    try:
+        files = MANIFEST_CACHE.get(s3_client, BROTLI_OUTPUT_BUCKET, BROTLI_OUTPUT_PREFIX)
+    except Exception as e:
+        logger.error(f"Error reading the dataset manifest, listing the bucket instead: {e}", exc_info=True)
+        files = None
+
+    if files is not None:
+        return [{
+            'url': s3_url(e['key']),
+            'etag': e.get('etag'),
+            'parquet_url': s3_url(e['parquet_key']) if e.get('parquet_key') else None,
+            'parquet_etag': e.get('parquet_etag'),
+            'index_url': s3_url(e['index_key']) if e.get('index_key') else None,
+        } for e in dataset_manifest.select_files(files, subreddits, time_filter)]
+
+    urls = list_s3_files(BROTLI_OUTPUT_BUCKET, suffix=".csv.br")
+    if subreddits:
+        # Check if the prefix with the particular subreddit name exists in the url
+        urls = [url for url in urls if any(f"reddit_{subreddit}_" in url for subreddit in subreddits)]
+    parquet_urls = set(list_s3_files(BROTLI_OUTPUT_BUCKET, suffix=columnar_store.PARQUET_SUFFIX)) \
+        if columnar_store.HAS_PYARROW else set()
+    return [{
+        'url': url,
+        'etag': None,
+        'parquet_url': columnar_store.parquet_name(url) if columnar_store.parquet_name(url) in parquet_urls else None,
+        'parquet_etag': None,
+        # Label indexes are built from the frames instead
+        'index_url': None,
+    } for url in urls]
+
+
 def download_and_parse_csv(url: str) -> pd.DataFrame:
     """Download CSV.BR file from S3 (assume automatically decompressed) and parse as DataFrame."""
     try:
         key = url.split(".com/")[1]
         obj = s3_client.get_object(Bucket=BROTLI_OUTPUT_BUCKET, Key=key)
-        return pd.read_csv(obj["Body"])
+        return pd.read_csv(obj["Body"], **read_csv_kwargs())
     except Exception as e:
         logger.error(f"Error downloading or parsing CSV from S3 URL {url}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to download or parse CSV from S3: {e}")
 
 
-def upload_filtered_file(df: pd.DataFrame) -> str: #Changed, added bytes
-    """Save filtered DataFrame as CSV.BR and upload to S3."""
+def read_comment_file(file: Dict[str, Any], filters: dict = None) -> pd.DataFrame:
+    """
+    Download one scraped comment file, preferring its Parquet copy when there is one.
+    From Parquet only the CSV columns are read, and rows the filters are certain to
+    reject are skipped inside the file. Null values are normalized here, once per load.
+    """
+    if columnar_store.HAS_PYARROW and file['parquet_url']:
+        try:
+            key = file['parquet_url'].split(".com/")[1]
+            data = s3_client.get_object(Bucket=BROTLI_OUTPUT_BUCKET, Key=key)["Body"].read()
+            return normalize_null_values(columnar_store.read_parquet(data, columns=CSV_FIELDS, filters=filters))
+        except Exception as e:
+            logger.warning(f"Falling back to CSV for {file['url']}; Parquet copy unreadable: {e}")
+    return normalize_null_values(download_and_parse_csv(file['url']))
+
+
+def read_label_index(file: Dict[str, Any], df: pd.DataFrame, whole_file: bool = True) -> LabelIndex:
+    """
+    The label index of a loaded comment file: the one stored next to it when it
+    matches the frame, otherwise built from the frame.
+    """
+    if whole_file and file.get('index_url'):
+        try:
+            key = file['index_url'].split(".com/")[1]
+            labels = LabelIndex.from_bytes(s3_client.get_object(Bucket=BROTLI_OUTPUT_BUCKET, Key=key)["Body"].read())
+            if labels is not None and len(labels) == len(df):
+                return labels
+            logger.warning(f"Rebuilding the label index of {file['url']}; the stored one does not match")
+        except Exception as e:
+            logger.warning(f"Rebuilding the label index of {file['url']}; stored one unreadable: {e}")
+    return LabelIndex.from_frame(df)
+
+
+def download_comments(file: Dict[str, Any], filters: dict = None):
+    """
+    Load one scraped comment file and its label index through the frame cache.
+
+    Cached frames hold the whole file, so filters are not pushed down into the read
+    while the cache is enabled; the caller must treat the frame as read-only.
+
+    Returns:
+        tuple: (pd.DataFrame, LabelIndex)
+    """
+    if not FRAME_CACHE.enabled:
+        df = read_comment_file(file, filters)
+        # Rows skipped by the pushed-down filters would misalign the stored index
+        return df, read_label_index(file, df, whole_file=not filters)
+
+    use_parquet = columnar_store.HAS_PYARROW and file['parquet_url']
+    url, etag = (file['parquet_url'], file['parquet_etag']) if use_parquet else (file['url'], file['etag'])
+    key = url.split(".com/")[1]
+    if not etag:
+        # Listed without a manifest; a HEAD is still far cheaper than the download
+        etag = s3_client.head_object(Bucket=BROTLI_OUTPUT_BUCKET, Key=key)["ETag"]
+
+    def load():
+        # The filter columns and label index are built once, before caching
+        df = prepare_filter_columns(read_comment_file(file))
+        return df, read_label_index(file, df)
+
+    return FRAME_CACHE.get_or_load((BROTLI_OUTPUT_BUCKET, key, etag), load)
+
+
+async def load_comment_frames(files: List[Dict[str, Any]], filters: dict = None):
+    """
+    Load the comment files concurrently; files that fail are logged and skipped.
+
+    Returns:
+        tuple: (list of DataFrames, LabelIndex of their concatenation in the same order)
+    """
+    loop = asyncio.get_event_loop()
+    tasks = [loop.run_in_executor(None, download_comments, file, filters) for file in files]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    frames, indexes = [], []
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Skipping URL due to download error: {result}")
+            continue
+        frames.append(result[0])
+        indexes.append(result[1])
+    if FRAME_CACHE.enabled:
+        logger.info(f"🗃️ Frame cache: {FRAME_CACHE.stats()}")
+    return frames, LabelIndex.concat(indexes)
+
+
+def cached_result_key(filters: dict, files: List[Dict[str, Any]]):
+    """
+    Deterministic result key of filters over files, and whether that result is already in S3.
+    ETags the manifest does not provide are fetched with HEAD requests.
+
+    Returns:
+        tuple: (S3 key, bool)
+    """
+    inputs = []
+    for file in files:
+        key = file['url'].split(".com/")[1]
+        inputs.append((key, file['etag'] or s3_client.head_object(Bucket=BROTLI_OUTPUT_BUCKET, Key=key)["ETag"]))
+    key = filter_results.result_key(filters, inputs)
+    return key, FILTER_RESULTS.exists(s3_client, BROTLI_OUTPUT_BUCKET, key)
+
+
+def upload_filtered_file(df: pd.DataFrame, key: Optional[str] = None) -> str: #Changed, added bytes
+    """Save filtered DataFrame as CSV.BR and upload to S3, under key or a timestamped name."""
 
     try:
         csv_buffer = io.StringIO()
@@ -172,7 +347,7 @@ def upload_filtered_file(df: pd.DataFrame) -> str: #Changed, added bytes
         compressed_bytes = brotli.compress(csv_bytes)
 
         # Upload the compressed bytes to S3
-        key = f"filtered_comments_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv.br"
+        key = key or f"filtered_comments_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv.br"
         
         # s3_client.upload_file(tmp.name, BROTLI_OUTPUT_BUCKET, key)
         s3_client.put_object(
@@ -181,7 +356,7 @@ def upload_filtered_file(df: pd.DataFrame) -> str: #Changed, added bytes
             Body=compressed_bytes,
             ContentType="application/x-brotli"
         )
-        return f"https://{BROTLI_OUTPUT_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}"
+        return s3_url(key)
     except Exception as e:
             logger.error(f"Error uploading filtered file to S3: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"Failed to upload filtered file to S3: {e}")
@@ -190,10 +365,9 @@ def upload_filtered_file(df: pd.DataFrame) -> str: #Changed, added bytes
 @app.get("/use_prev_data")
 def use_prev_data():
     """
-    Looks for all files in S3 ending with '.csv.br' and returns their URLs.
+    Returns the URLs of all scraped comment files ('.csv.br') in S3.
     """
-    suffix = ".csv.br"  # no subreddit filtering
-    urls = list_s3_files(BROTLI_OUTPUT_BUCKET, suffix)
+    urls = [file['url'] for file in dataset_files()]  # no subreddit filtering
     return {"urls": urls}
 
 
@@ -224,47 +398,29 @@ async def get_filtered_cmts(filters: FilterRequest):
         # return {"error": "S3_BUCKET_NAME not configured"}
         raise HTTPException(status_code=500, detail = "S3_BUCKET_NAME has not configured")
 
-    # 1. Get all S3 URLs without initial subreddit filtering; files must end with '.csv.br' suffix
-    all_urls = list_s3_files(bucket=BROTLI_OUTPUT_BUCKET, suffix=".csv.br", subreddit=None)
-    if not all_urls:
-        return {"urls": []}
-
-    # 2. Manually filter the urls based on the subreddits in the filter request
-    filtered_urls = []
-    if getattr(filters, 'subreddits') is not None:
-        for url in all_urls:
-            # Check if the prefix with the particular subreddit name exists in the url
-            if any(f"reddit_{subreddit}_" in url for subreddit in filters.subreddits):
-                filtered_urls.append(url)
-    else:
-        # If no subreddits are specified, return the urls of all subreddits 
-        filtered_urls = all_urls
-
-    if not filtered_urls:
+    # 1-2. Pick the files of the requested subreddits and time window from the dataset manifest
+    filtered_files = dataset_files(filters.subreddits, filters.time)
+    if not filtered_files:
         return {"urls" : []}
 
-    # 3. Download and combine all CSVs
-    combined_df = pd.DataFrame()
-    all_dfs = []
-    tasks = []
-    loop = asyncio.get_event_loop()
-
-    for url in filtered_urls:
-        # Create a task for each download and parse to run concurrently
-        task = loop.run_in_executor(None, download_and_parse_csv, url)
-        tasks.append(task)
-
-    # Wait for all tasks to complete and collect results
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    # An identical filter over the same input files was answered before: return that result
+    try:
+        result_key, result_exists = await asyncio.to_thread(
+            cached_result_key, filters.dict(exclude_none=True), filtered_files)
+    except Exception as e:
+        logger.warning(f"Filter result cache unavailable: {e}")
+        result_key, result_exists = None, False
+    if result_exists:
+        logger.info(f"♻️ Returning cached filter result {result_key}")
+        return {"urls": [s3_url(result_key)]}
 
-    # Loop through each downloaded results and check for any exceptions
-    for result in results:
-        if isinstance(result, Exception):
-            logger.error(f"Skipping URL due to download error: {result}")
-            continue
+    # 3. Load and combine all comment files (from the frame cache or S3, Parquet copies where available)
+    combined_df = pd.DataFrame()
+    all_dfs, labels = await load_comment_frames(filtered_files, filters.dict(exclude_none=True))
+    if len(all_dfs) < len(filtered_files):
+        # A partial result must not be served for the complete input set
+        result_key = None
 
-        all_dfs.append(result)
-    
     if not all_dfs:
         logger.warning("No valid data frames could be downloaded from S3.")
         return {"urls": []}
@@ -279,16 +435,110 @@ async def get_filtered_cmts(filters: FilterRequest):
         if 'subreddits' in processing_filters:
             del processing_filters['subreddits']
 
-        filtered_df = filter_reddit_comments(combined_df, filters.dict(exclude_none=True))
+        filtered_df = filter_reddit_comments(combined_df, filters.dict(exclude_none=True), labels)
 
-        #Save the filtered DataFrame directly to S3
-        new_url = upload_filtered_file(filtered_df)
+        #Save the filtered DataFrame directly to S3, under the result key so repeats can reuse it
+        new_url = upload_filtered_file(filtered_df, result_key)
+        if result_key:
+            FILTER_RESULTS.remember(result_key)
 
         return {"urls": [new_url]}
     except Exception as e:
         logger.error(f"Error during filtering process: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Filtering failed: {str(e)}")
 
+class CommentQueryRequest(FilterRequest):
+    columns: Optional[List[str]] = None  # None for every CSV column
+    limit: int = comment_pages.DEFAULT_PAGE_SIZE
+    cursor: Optional[str] = None  # next_cursor of the previous page
+
+
+def read_filtered_result(key: str) -> pd.DataFrame:
+    """Download a result stored by upload_filtered_file."""
+    body = s3_client.get_object(Bucket=BROTLI_OUTPUT_BUCKET, Key=key)["Body"].read()
+    # Uploaded without a Content-Encoding, so S3 returns the brotli stream as is
+    df = pd.read_csv(io.BytesIO(brotli.decompress(body)), **read_csv_kwargs())
+    return normalize_null_values(df)
+
+
+async def filtered_result_pages(filters: dict, files: List[Dict[str, Any]]):
+    """
+    The filter result over files, sorted for paging.
+
+    Served from RESULT_PAGES, else from the result /get_filtered_cmts stored in S3,
+    else filtered here and stored the same way, so either route reuses the other's work.
+
+    Returns:
+        comment_pages.PagedResult, or None when no comment file could be loaded
+    """
+    try:
+        result_key, result_exists = await asyncio.to_thread(cached_result_key, filters, files)
+    except Exception as e:
+        logger.warning(f"Filter result cache unavailable: {e}")
+        result_key, result_exists = None, False
+
+    cache_key = (BROTLI_OUTPUT_BUCKET, result_key, "")
+    if result_key and RESULT_PAGES.enabled:
+        pages = RESULT_PAGES.get(cache_key)
+        if pages is not None:
+            return pages
+
+    filtered_df = None
+    if result_exists:
+        try:
+            filtered_df = await asyncio.to_thread(read_filtered_result, result_key)
+            logger.info(f"♻️ Paging cached filter result {result_key}")
+        except Exception as e:
+            logger.warning(f"Re-filtering; cached filter result {result_key} unreadable: {e}")
+
+    if filtered_df is None:
+        all_dfs, labels = await load_comment_frames(files, filters)
+        if not all_dfs:
+            return None
+        if len(all_dfs) < len(files):
+            # A partial result must not be cached for the complete input set
+            result_key = None
+        filtered_df = filter_reddit_comments(pd.concat(all_dfs, ignore_index=True), filters, labels)
+        if result_key:
+            await asyncio.to_thread(upload_filtered_file, filtered_df, result_key)
+            FILTER_RESULTS.remember(result_key)
+
+    pages = await asyncio.to_thread(comment_pages.PagedResult, filtered_df)
+    if result_key and RESULT_PAGES.enabled:
+        RESULT_PAGES.put(cache_key, pages)
+    return pages
+
+
+@app.post("/comments/query")
+async def query_comments(request: CommentQueryRequest):
+    """
+    One page of filtered comments as JSON, newest first, for tables that show a page at a time.
+
+    Pass next_cursor back as cursor for the following page; it is None on the last one.
+    Only the requested columns are returned.
+    """
+    if not BROTLI_OUTPUT_BUCKET:
+        raise HTTPException(status_code=500, detail="S3_BUCKET_NAME has not configured")
+
+    filters = request.dict(exclude_none=True, exclude={'columns', 'limit', 'cursor'})
+    filtered_files = dataset_files(request.subreddits, request.time)
+    if not filtered_files:
+        return {"total": 0, "rows": [], "next_cursor": None, "columns": request.columns or []}
+
+    try:
+        pages = await filtered_result_pages(filters, filtered_files)
+    except Exception as e:
+        logger.error(f"Error during filtering process: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Filtering failed: {str(e)}")
+    if pages is None:
+        logger.warning("No valid data frames could be downloaded from S3.")
+        return {"total": 0, "rows": [], "next_cursor": None, "columns": request.columns or []}
+
+    try:
+        return pages.page(request.cursor, request.limit, request.columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 CSV_FIELDS = [
     'id', 'post_id', 'subreddit', 'author', 'body', 'created_utc', 'score', 'parent_id',
     'sentiment', 'sentiment_score', 'desire_and_wish', 'trigger_phrase', 'metaphors', 'question',
@@ -412,13 +662,16 @@ def save_to_supabase(scraped_data):
     if scraped_data['comments']:
         batch_size = 500  # Reduced batch size for better reliability
         total_inserted = 0
-        comments_to_insert = scraped_data['comments']
-        total_comments = len(comments_to_insert)
+        # Read lazily from the saved comment files, so only one batch is in memory at a time
+        comments_to_insert = iter(scraped_data['comments'])
+        total_comments = len(scraped_data['comments'])
         
         print(f"📝 Inserting {total_comments} comments in batches of {batch_size}")
         
         for i in range(0, total_comments, batch_size):
-            batch = comments_to_insert[i:i + batch_size]
+            batch = list(itertools.islice(comments_to_insert, batch_size))
+            if not batch:
+                break
 
             # avoid 400 - {"code":"PGRST102","message":"All object keys must match"}
             for row in batch:
@@ -489,23 +742,165 @@ def save_to_supabase(scraped_data):
     except Exception as e:
         print(f"⚠️ Error verifying comment count: {e}")
 
+def summarise_scrape(scraped_data):
+    """Build the response summary of a finished scrape."""
+    total_comments_scraped = len(scraped_data.get('comments', []))
+    successful_subreddits = list(scraped_data.get('subreddits', []))
+
+    return {
+        "success": True,
+        "resume_token": scraped_data.get('resume_token'),
+        "message": f"Successfully scraped and saved {total_comments_scraped} comments from {len(successful_subreddits)} subreddit(s)",
+        "subreddits_processed": successful_subreddits,
+        "successful_subreddits": successful_subreddits,
+        "total_comments_saved": total_comments_scraped,
+        "total_posts_processed": len(scraped_data.get('posts', {})),
+        "total_authors_found": len(scraped_data.get('authors', set())),
+        "embedding_cache": scraped_data.get('embedding_cache'),
+        "results_summary": {
+            "subreddits": len(scraped_data.get('subreddits', [])),
+            "posts": len(scraped_data.get('posts', {})),
+            "authors": len(scraped_data.get('authors', set())),
+            "comments": len(scraped_data.get('comments', []))
+        }
+    }
+
+
+async def run_scrape_job(job, subreddits, post_limit, incremental, resume_token, resuming):
+    """
+    Run a scrape in the background, recording its phase and counters on job.progress.
+    Blocking steps run in threads so /jobs/{job_id} keeps answering while the job runs.
+    The job record is saved to JOB_STORE every JOB_SAVE_INTERVAL seconds and once more
+    when the job ends, which also releases the run lock.
+    """
+    progress = job.progress
+    saver = asyncio.create_task(save_job_periodically(job))
+    try:
+        # Clear database before starting a full scraping session; incremental and resumed runs upsert into it
+        if not incremental and not resuming:
+            progress.set_phase("clearing")
+            await asyncio.to_thread(clear_database)
+
+        scraped_data = await reddit_scraper.scrape_comments_async(
+            subreddits, post_limit, incremental=incremental, resume_token=resume_token, progress=progress)
+
+        # Debug: Print scraped data summary
+        print(f"\n🔍 DEBUG: Scraped data summary:")
+        print(f"  - Subreddits: {len(scraped_data.get('subreddits', []))}")
+        print(f"  - Authors: {len(scraped_data.get('authors', set()))}")  
+        print(f"  - Posts: {len(scraped_data.get('posts', {}))}")
+        print(f"  - Comments: {len(scraped_data.get('comments', []))}")
+
+        # Print breakdown by subreddit
+        for subreddit, count in scraped_data.get('comment_counts', {}).items():
+            print(f"    - r/{subreddit}: {count} comments")
+
+        # Save all results to database
+        progress.set_phase("storing")
+        await asyncio.to_thread(save_to_supabase, scraped_data)
+        if local_vector_index.LOCAL_VECTOR_INDEX_PATH:
+            # Incremental runs only hold new comments, so they extend the existing index
+            try:
+                await asyncio.to_thread(local_vector_index.build_from_comments, scraped_data['comments'],
+                                        local_vector_index.LOCAL_VECTOR_INDEX_PATH, incremental)
+            except Exception as e:
+                print(f"❌ Error building local vector index: {str(e)}")
+
+        job.result = summarise_scrape(scraped_data)
+        # The scrape added files to the manifest; don't wait for the TTL to see them
+        MANIFEST_CACHE.invalidate()
+        job.result["urls"] = [file['url'] for file in await asyncio.to_thread(dataset_files)]
+        progress.set_phase("done")
+    except Exception as e:
+        print(f"❌ Scrape job {job.id} failed: {str(e)}")
+        progress.fail(str(e) if isinstance(e, ValueError) else "Failed to scrape comments")
+    finally:
+        saver.cancel()
+        await asyncio.to_thread(JOB_STORE.save, job)
+        await asyncio.to_thread(JOB_STORE.release, job)
+
+async def save_job_periodically(job):
+    """Save the job record every JOB_SAVE_INTERVAL seconds, so polls on other containers see progress."""
+    while True:
+        await asyncio.to_thread(JOB_STORE.save, job)
+        await asyncio.sleep(scrape_jobs.JOB_SAVE_INTERVAL)
+
+def dispatch_scrape_job(job, subreddits, post_limit, incremental, resume_token, resuming):
+    """Start the job in an asynchronous invocation of SCRAPE_WORKER_FUNCTION (see handler)."""
+    payload = {'scrape_job': {
+        'job_id': job.id,
+        'subreddits': subreddits,
+        'post_limit': post_limit,
+        'incremental': incremental,
+        'resume_token': resume_token,
+        'resuming': resuming,
+    }}
+    boto3.client("lambda", region_name=AWS_REGION).invoke(
+        FunctionName=SCRAPE_WORKER_FUNCTION,
+        InvocationType="Event",
+        Payload=json.dumps(payload).encode("utf-8"),
+    )
+    print(f"🚀 Scrape job {job.id} dispatched to {SCRAPE_WORKER_FUNCTION}")
+
+def run_dispatched_scrape_job(params: dict) -> dict:
+    """Run a job sent by dispatch_scrape_job to completion in this invocation."""
+    # Lambda redelivers an event whose invocation timed out; the job already started then, and
+    # running it again could clear the tables. The caller resumes it with its resume_token instead.
+    # The stored phase, so a job that waited long in the async queue is not mistaken for a stale one
+    record = JOB_STORE.load(params['job_id'], raw=True)
+    if record is not None and record['phase'] != "queued":
+        print(f"⏭️ Scrape job {params['job_id']} already ran ({record['phase']}); ignoring the redelivery")
+        return record
+    # Past SCRAPE_JOB_QUEUE_TIMEOUT_SECONDS it was reported as failed and another scrape may hold the lock
+    record = JOB_STORE.load(params['job_id'])
+    if record is not None and record['phase'] == scrape_jobs.FAILED:
+        print(f"⏭️ Scrape job {params['job_id']} timed out in the queue; not starting it")
+        return record
+    job = scrape_jobs.ScrapeJob(params['subreddits'], params['post_limit'], job_id=params['job_id'])
+    scrape_jobs.register_job(job)
+    asyncio.run(run_scrape_job(job, params['subreddits'], params['post_limit'], params['incremental'],
+                               params['resume_token'], params['resuming']))
+    return job.to_dict()
+
 # Syed has stored the old version of scrape_comments_route in case it is needed
 
-@app.post("/scrape_comments")
+@app.post("/scrape_comments", status_code=202)
 async def scrape_comments_route(request: Request):
     """
-    Scrape comments from Reddit subreddits and save to database.
+    Start a background scrape of Reddit subreddits and return its job id straight away.
     
     Expected JSON body:
     {
         "subreddits": ["subreddit1", "subreddit2"],
-        "post_limit": 100
+        "post_limit": 100,
+        "incremental": false,
+        "resume_token": "optional-client-chosen-token"
     }
+
+    Poll GET /jobs/{job_id} for the phase, counters, ETA and, once done, the results.
+
+    With "incremental": true the existing tables, vectors and S3 files are kept and
+    only comments newer than each subreddit's stored watermark are scraped and upserted.
+
+    Every run is checkpointed under its resume_token, which the response returns. If a
+    run dies part-way, sending the same resume_token again continues the interrupted run
+    with its original subreddits, post_limit and mode instead of starting over.
     """
     try:
         data = await request.json()
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid JSON in request body")
+
+    resume_token = data.get("resume_token")
+    if resume_token is not None and not is_valid_resume_token(resume_token):
+        raise HTTPException(status_code=400, detail="resume_token must be 8-64 letters, digits, '-' or '_'")
+
+    checkpoint = reddit_scraper.find_checkpoint(resume_token) if resume_token else None
+    if checkpoint:
+        # The checkpoint decides what the resumed run scrapes
+        print(f"📍 Resuming scrape {resume_token}")
+        data = {**data, "subreddits": checkpoint.subreddits, "post_limit": checkpoint.post_limit,
+                "incremental": checkpoint.incremental}
     
     # Extract and validate subreddits
     subreddits = data.get("subreddits", [])
@@ -520,56 +915,67 @@ async def scrape_comments_route(request: Request):
     if not isinstance(post_limit, int) or post_limit < 1 or post_limit > 1000:
         raise HTTPException(status_code=400, detail="post_limit must be an integer between 1 and 1000")
 
-    print(f"📥 Subreddits received: {subreddits}")
-    print(f"📊 Post limit: {post_limit}")
+    incremental = data.get("incremental", False)
+    if not isinstance(incremental, bool):
+        raise HTTPException(status_code=400, detail="incremental must be a boolean")
 
-    # Clear database before starting new scraping session
-    clear_database()
+    # A second scrape would clear the tables the running one is writing to, whichever container runs it
+    job = scrape_jobs.ScrapeJob(subreddits, post_limit)
+    active_job_id = await asyncio.to_thread(JOB_STORE.claim, job)
+    if active_job_id:
+        raise HTTPException(status_code=409, detail=f"Scrape job {active_job_id} is still running")
 
-    try:
-        scraped_data = await reddit_scraper.scrape_comments_async(subreddits, post_limit)
-    except ValueError as ve:
-        print(f"❌ Validation error: {str(ve)}")
-        raise HTTPException(status_code=400, detail=str(ve))
-    except Exception as e:
-        print(f"❌ Async scraping failed: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to scrape comments")
-
-    # Debug: Print scraped data summary
-    print(f"\n🔍 DEBUG: Scraped data summary:")
-    print(f"  - Subreddits: {len(scraped_data.get('subreddits', []))}")
-    print(f"  - Authors: {len(scraped_data.get('authors', set()))}")  
-    print(f"  - Posts: {len(scraped_data.get('posts', {}))}")
-    print(f"  - Comments: {len(scraped_data.get('comments', []))}")
-    
-    # Print breakdown by subreddit
-    for subreddit in scraped_data.get('subreddits', []):
-        subreddit_comments = [c for c in scraped_data.get('comments', []) if c['subreddit'] == subreddit]
-        print(f"    - r/{subreddit}: {len(subreddit_comments)} comments")
-
-    # Save all results to database
-    save_to_supabase(scraped_data)
+    print(f"📥 Subreddits received: {subreddits}")
+    print(f"📊 Post limit: {post_limit}")
+    print(f"💧 Incremental: {incremental}")
 
-    # Calculate totals for response
-    total_comments_scraped = len(scraped_data.get('comments', []))
-    successful_subreddits = list(scraped_data.get('subreddits', []))
+    # Fix the token now so the caller can resume this run even if it never finishes
+    resume_token = resume_token or uuid.uuid4().hex
+    await asyncio.to_thread(JOB_STORE.save, job)
+    if SCRAPE_WORKER_FUNCTION:
+        # A Lambda container freezes once the response is sent, so the job runs in its own invocation
+        try:
+            await asyncio.to_thread(dispatch_scrape_job, job, subreddits, post_limit, incremental,
+                                    resume_token, checkpoint is not None)
+        except Exception as e:
+            print(f"❌ Could not dispatch scrape job {job.id}: {str(e)}")
+            job.progress.fail("Failed to start the scrape worker")
+            await asyncio.to_thread(JOB_STORE.save, job)
+            await asyncio.to_thread(JOB_STORE.release, job)
+            raise HTTPException(status_code=500, detail="Failed to start the scrape worker")
+    else:
+        if BROTLI_OUTPUT_BUCKET:
+            # Without a bucket JOB_STORE.claim registered it already
+            scrape_jobs.register_job(job)
+        job.task = asyncio.create_task(run_scrape_job(
+            job, subreddits, post_limit, incremental, resume_token, resuming=checkpoint is not None))
 
     return {
         "success": True,
-        "message": f"Successfully scraped and saved {total_comments_scraped} comments from {len(successful_subreddits)} subreddit(s)",
-        "subreddits_processed": successful_subreddits,
-        "successful_subreddits": successful_subreddits,
-        "total_comments_saved": total_comments_scraped,
-        "total_posts_processed": len(scraped_data.get('posts', {})),
-        "total_authors_found": len(scraped_data.get('authors', set())),
-        "results_summary": {
-            "subreddits": len(scraped_data.get('subreddits', [])),
-            "posts": len(scraped_data.get('posts', {})),
-            "authors": len(scraped_data.get('authors', set())),
-            "comments": len(scraped_data.get('comments', []))
-        }
+        "job_id": job.id,
+        "resume_token": resume_token,
+        "status_url": f"/jobs/{job.id}",
     }
 
+
+@app.get("/jobs/{job_id}")
+async def get_scrape_job(job_id: str):
+    """
+    Report the progress of a background scrape: phase, posts done, comments
+    analysed, vectors inserted, ETA, and the results summary once it is done.
+    """
+    # A job run by this process is read live; others from the record their worker saves
+    job = scrape_jobs.get_job(job_id)
+    if job is not None:
+        return job.to_dict()
+    # Job ids end up in S3 keys and share the resume token alphabet
+    if not is_valid_resume_token(job_id):
+        raise HTTPException(status_code=404, detail=f"Unknown job id: {job_id}")
+    record = await asyncio.to_thread(JOB_STORE.load, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job id: {job_id}")
+    return record
+
 #NEW ROUTES
 # --- Add these Pydantic models near your other models (e.g., near FilterRequest) ---
 class Message(BaseModel):
@@ -669,29 +1075,14 @@ async def export_data(filters: ExportRequest):  # ← Change to ExportRequest
         if not BROTLI_OUTPUT_BUCKET:
             raise HTTPException(status_code=500, detail="S3_BUCKET_NAME not configured")
 
-        all_urls = list_s3_files(bucket=BROTLI_OUTPUT_BUCKET, suffix=".csv.br", subreddit=None)
-        if not all_urls:
-            return {"error": "No data files found"}
-
-        # Filter URLs based on subreddits
-        filtered_urls = []
-        if filters.subreddits:
-            for url in all_urls:
-                if any(f"reddit_{subreddit}_" in url for subreddit in filters.subreddits):
-                    filtered_urls.append(url)
-        else:
-            filtered_urls = all_urls
-
-        if not filtered_urls:
+        # Pick the files of the requested subreddits and time window
+        filtered_files = dataset_files(filters.subreddits, filters.time)
+        if not filtered_files:
             return {"error": "No matching data files found"}
 
-        # Download and combine CSVs
+        # Load and combine comment files (from the frame cache or S3, Parquet copies where available)
         combined_df = pd.DataFrame()
-        loop = asyncio.get_event_loop()
-        tasks = [loop.run_in_executor(None, download_and_parse_csv, url) for url in filtered_urls]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        valid_dfs = [result for result in results if not isinstance(result, Exception)]
+        valid_dfs, labels = await load_comment_frames(filtered_files, filters.dict(exclude_none=True))
         
         if not valid_dfs:
             return {"error": "Failed to download data files"}
@@ -703,7 +1094,7 @@ async def export_data(filters: ExportRequest):  # ← Change to ExportRequest
             del processing_filters['subreddits']
 
         # Apply filters
-        filtered_df = filter_reddit_comments(combined_df, filters.dict(exclude_none=True))
+        filtered_df = filter_reddit_comments(combined_df, filters.dict(exclude_none=True), labels)
         
         # Convert to CSV
         csv_data = filtered_df.to_csv(index=False)
@@ -728,28 +1119,13 @@ async def export_insights(filters: ExportRequest):  # ← Change to ExportReques
         if not BROTLI_OUTPUT_BUCKET:
             raise HTTPException(status_code=500, detail="S3_BUCKET_NAME not configured")
 
-        all_urls = list_s3_files(bucket=BROTLI_OUTPUT_BUCKET, suffix=".csv.br", subreddit=None)
-        if not all_urls:
-            return {"error": "No data files found"}
-
-        filtered_urls = []
-        if filters.subreddits:
-            for url in all_urls:
-                if any(f"reddit_{subreddit}_" in url for subreddit in filters.subreddits):
-                    filtered_urls.append(url)
-        else:
-            filtered_urls = all_urls
-
-        if not filtered_urls:
+        filtered_files = dataset_files(filters.subreddits, filters.time)
+        if not filtered_files:
             return {"error": "No matching data files found"}
 
-        # Download and combine CSVs
+        # Load and combine comment files (from the frame cache or S3, Parquet copies where available)
         combined_df = pd.DataFrame()
-        loop = asyncio.get_event_loop()
-        tasks = [loop.run_in_executor(None, download_and_parse_csv, url) for url in filtered_urls]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        valid_dfs = [result for result in results if not isinstance(result, Exception)]
+        valid_dfs, labels = await load_comment_frames(filtered_files, filters.dict(exclude_none=True))
         
         if not valid_dfs:
             return {"error": "Failed to download data files"}
@@ -764,7 +1140,7 @@ async def export_insights(filters: ExportRequest):  # ← Change to ExportReques
             del processing_filters['subreddits']
 
         # Apply filters
-        filtered_df = filter_reddit_comments(combined_df, filters.dict(exclude_none=True))
+        filtered_df = filter_reddit_comments(combined_df, filters.dict(exclude_none=True), labels)
         
         # Generate insights text
         insights_text = generate_insights_text(filtered_df)
@@ -928,11 +1304,18 @@ async def get_ai_insights(request: AIChatRequest):
 @app.get("/health")
 def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "message": "Reddit scraper API is running"}
+    return {"status": "healthy", "message": "Reddit scraper API is running", "frame_cache": FRAME_CACHE.stats(),
+            "result_page_cache": RESULT_PAGES.stats()}
 
 # --- AWS Lambda Handler using Mangum ---
 # This is the single entry point for AWS Lambda.
-handler = Mangum(app)
+http_handler = Mangum(app)
+
+def handler(event, context):
+    """Run scrape jobs dispatched by /scrape_comments; pass every other event to the API."""
+    if isinstance(event, dict) and 'scrape_job' in event:
+        return run_dispatched_scrape_job(event['scrape_job'])
+    return http_handler(event, context)
 
 
 
@@ -1,9 +1,13 @@
 import os
-import torch
-import torch.nn.functional as F
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from transformers import AutoTokenizer, AutoModel
 from . import category_config
+from . import embedding_service
+from . import expansion_embeddings
+from . import local_vector_index
+from .embedding_cache import normalise_text
 from .models import FilterRequest # NEW: Import FilterRequest from models.py
 import logging # Import logging
 from supabase import create_client, Client # Added create_client, Client
@@ -30,96 +34,63 @@ if not key:
 
 supabase: Client = create_client(url, key) if url and key else None # Initialize client only if credentials exist
 
+# Distinct search queries whose embeddings are kept in memory
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+# match_reddit_records calls in flight at once for one fetch_by_feature
+FEATURE_SEARCH_CONCURRENCY = int(os.getenv("FEATURE_SEARCH_CONCURRENCY", "8"))
 
-# Load embedding model
-MODEL_ID = "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
-
-# Define the explicit local path where the model was downloaded in the Dockerfile
-# This path should match 'multi-qa-MiniLM-L6-cos-v1-local' inside HF_HOME
-# HF_HOME_DIR = os.getenv("HF_HOME", "/app/hf_cache") # Get HF_HOME, default to /app/hf_cache
-# LOCAL_MODEL_PATH = os.path.join(HF_HOME_DIR, 'multi-qa-MiniLM-L6-cos-v1-local')
-
-# === SOILA: TROUBLESHOOTING MODEL ISSUE === #
-LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", os.path.expanduser("~/models/m"))
-
-# --- DIAGNOSTIC PRINTS (CRITICAL FOR DEBUGGING THIS ISSUE) ---
-# These logs will show us where the system is looking for the model and what it finds.
-logger.info(f"HF_HOME environment variable: {os.getenv('HF_HOME')}")
-logger.info(f"TRANSFORMERS_OFFLINE environment variable: {os.getenv('TRANSFORMERS_OFFLINE')}")
-logger.info(f"Attempting to load model from LOCAL_MODEL_PATH: {LOCAL_MODEL_PATH}")
-
-# Check if the LOCAL_MODEL_PATH exists
-# if not os.path.isdir(LOCAL_MODEL_PATH):
-#     logger.error(f"LOCAL_MODEL_PATH does NOT exist: {LOCAL_MODEL_PATH}")
-#     # Attempt to list contents of the parent directory to see if there's a typo or incorrect structure
-#     if os.path.isdir(HF_HOME_DIR):
-#         logger.error(f"Listing contents of {HF_HOME_DIR}: {os.listdir(HF_HOME_DIR)}")
-#     else:
-#         logger.error(f"HF_HOME_DIR also does NOT exist: {HF_HOME_DIR}")
-# else:
-#     logger.info(f"LOCAL_MODEL_PATH exists: {LOCAL_MODEL_PATH}")
-    
-# Check for config.json specifically, as it's a critical file for model loading
-config_path = os.path.join(LOCAL_MODEL_PATH, 'config.json')
-logger.info(f"Checking for config.json at: {config_path}")
-if os.path.exists(config_path):
-    logger.info("config.json FOUND at specified local path!")
-else:
-    logger.error("config.json NOT FOUND at specified local path.")
-    # Only try to list contents if the directory actually exists
-    if os.path.isdir(LOCAL_MODEL_PATH):
-        logger.error("Listing contents of LOCAL_MODEL_PATH:")
-        # List all files and directories recursively to aid debugging the file structure
-        for root, dirs, files in os.walk(LOCAL_MODEL_PATH):
-            logger.error(f"  Dir: {root}, Files: {files}, Dirs: {dirs}")
-# --- END DIAGNOSTIC PRINTS ---
-
-# Load the tokenizer and model directly from the local path
-# local_files_only=True is now appropriate as we are pointing to a known local directory
-# These should only be initialized once.
-try:
-    tokenizer = AutoTokenizer.from_pretrained(LOCAL_MODEL_PATH, local_files_only=True)
-    model = AutoModel.from_pretrained(LOCAL_MODEL_PATH, local_files_only=True)
-    logger.info("✅ Model loaded successfully")
-except Exception as e:
-    logger.error(f"❌ Failed to load model: {e}. Vector search will be disabled.")
-    logger.info("⚠️  To fix this, run: python backend/download_model.py")
-    tokenizer = None
-    model = None
-
-
-# Mean Pooling - Take average of all tokens
-def mean_pooling(model_output, attention_mask):
-    token_embeddings = model_output[0] # First element of model_output contains all token embeddings
-    input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
-    return torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
+# Normalised query -> embedding, least recently used first
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
 
-def embed_target(target: str):
-    try:
 
-        # Tokenize target query
-        encoded_input = tokenizer(
-            [target],
-            return_tensors="pt",
-            padding=True,
-            truncation=True,
-            max_length=128
-        )
-
-        # Compute vector embedding for target
-        with torch.no_grad():
-            model_output = model(**encoded_input)
-
-        # Perform pooling
-        target_embedding = mean_pooling(model_output, encoded_input['attention_mask'])
-
-        # Normalize embeddings
-        target_embedding = F.normalize(target_embedding, p=2, dim=1)
-        return target_embedding[0].tolist()
-    
+def _cached_query(target: str):
+    with _query_cache_lock:
+        embedding = _query_cache.get(target)
+        if embedding is not None:
+            _query_cache.move_to_end(target)
+        return embedding
+
+
+def _cache_query(target: str, embedding):
+    with _query_cache_lock:
+        _query_cache[target] = embedding
+        _query_cache.move_to_end(target)
+        while len(_query_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+
+
+def embed_targets(targets: list):
+    """
+    Embed several search queries, running the model once for all that are not cached.
+    CFG expansions come from the precomputed expansion embeddings, recent queries from an LRU cache.
+
+    Returns:
+        list: One embedding per target, None where it could not be computed
+    """
+    targets = [normalise_text(t) for t in targets]
+    try:
+        precomputed = expansion_embeddings.get()
+        embeddings = [precomputed.get(t) or _cached_query(t) for t in targets]
+        missing = list(dict.fromkeys(t for t, e in zip(targets, embeddings) if e is None))
+        if missing:
+            # Shared, lazily loaded model; None if it could not be loaded
+            computed = embedding_service.embed_batch(missing)
+            if computed is not None:
+                computed = dict(zip(missing, computed))
+                for t, embedding in computed.items():
+                    _cache_query(t, embedding)
+                embeddings = [e if e is not None else computed[t] for t, e in zip(targets, embeddings)]
+        # Copies, so callers cannot change a cached vector
+        return [list(e) if e is not None else None for e in embeddings]
     except Exception as e:
             logger.error(f"Embedding error: {e}", exc_info=True)
-            return None
+            return [None] * len(targets)
+
+
+def embed_target(target: str):
+    """Embed one search query; None if it could not be computed (see embed_targets)."""
+    return embed_targets([target])[0]
 
 def get_max_similarity_by_id(rows):
     best = {}
@@ -132,7 +103,8 @@ def get_max_similarity_by_id(rows):
             best[rid] = r
     return best
 
-def similarity_search(target: str, top_k: int, threshold:float, filters: FilterRequest):
+def _match_params(target_embed, top_k: int, threshold: float, filters: FilterRequest) -> dict:
+    """Arguments of the match_reddit_records RPC for one query embedding."""
 
     # Ensure FilterRequest is properly handled, even if empty
     if not isinstance(filters, FilterRequest):
@@ -154,11 +126,6 @@ def similarity_search(target: str, top_k: int, threshold:float, filters: FilterR
     # painpointsxfrustrations_filter = None
     # failed_solutions_filter = None
 
-    target_embed = embed_target(target)
-    if target_embed is None:
-        logger.error("Failed to generate embedding for target query.")
-        return []
-
     # Extracting the filter criteria from FilterRequest
     if filters.subreddits is not None:
         subreddit_filter = filters.subreddits
@@ -194,32 +161,44 @@ def similarity_search(target: str, top_k: int, threshold:float, filters: FilterR
     # if filters.failed_solutions is not None:
     #     failed_solutions_filter = filters.failed_solutions
 
-    if not supabase:
-        logger.error("Supabase client is not initialized, cannot perform RPC call.")
-        return []
-    
+    return {
+        "query_embedding": target_embed,
+        "match_threshold": threshold,
+        "match_count": top_k,
+        "probes": 20,
+        "subreddit_filter": subreddit_filter,
+        "emotion_filter": emotion_filter,
+        "intensity_score_filter": intensity_score_filter,
+        "topic_filter": topic_filter,
+        "practitioner_types_filter": practitioner_types_filter, # Corrected key
+        "time_filter": time_filter
+
+        # ==== Soila -> Remove filters that are not used as metadata in the vector db ==== #
+        # "desire_and_wish_filter": desire_and_wish_filter,
+        # "trigger_phrase_filter": trigger_phrase_filter,
+        # "metaphors_filter": metaphors_filter,
+        # "question_filter": question_filter,
+        # "practitioner_reference_filter": practitioner_reference_filter,
+        # "painpointsxfrustrations_filter": painpointsxfrustrations_filter,
+        # "failed_solutions_filter": failed_solutions_filter
+    }
+
+
+def _search_available() -> bool:
+    if supabase or local_vector_index.get_index() is not None:
+        return True
+    logger.error("Supabase client is not initialized, cannot perform RPC call.")
+    return False
+
+
+def _match_reddit_records(params: dict):
+    # The local index, when configured and built, answers without a Supabase round trip
+    index = local_vector_index.get_index()
+    if index is not None:
+        return index.search(**params)
+
     try:
-        res = supabase.rpc("match_reddit_records", {
-            "query_embedding": target_embed,
-            "match_threshold": threshold,
-            "match_count": top_k,
-            "probes": 20,
-            "subreddit_filter": subreddit_filter,
-            "emotion_filter": emotion_filter,
-            "intensity_score_filter": intensity_score_filter,
-            "topic_filter": topic_filter,
-            "practitioner_types_filter": practitioner_types_filter, # Corrected key
-            "time_filter": time_filter
-
-            # ==== Soila -> Remove filters that are not used as metadata in the vector db ==== #
-            # "desire_and_wish_filter": desire_and_wish_filter,
-            # "trigger_phrase_filter": trigger_phrase_filter,
-            # "metaphors_filter": metaphors_filter,
-            # "question_filter": question_filter,
-            # "practitioner_reference_filter": practitioner_reference_filter,
-            # "painpointsxfrustrations_filter": painpointsxfrustrations_filter,
-            # "failed_solutions_filter": failed_solutions_filter
-        }).execute()
+        res = supabase.rpc("match_reddit_records", params).execute()
 
         if getattr(res, "error", None):
             logger.error(f"Supabase RPC error: {res.error.get('message', 'Unknown error')}", exc_info=True)
@@ -230,6 +209,91 @@ def similarity_search(target: str, top_k: int, threshold:float, filters: FilterR
         logger.error(f"Error in similarity_search RPC call: {e}", exc_info=True)
         raise
 
+
+def _match_reddit_records_in(params: dict, candidate_ids: list):
+    """
+    Exact top match_count of the candidates, ranked inside Postgres by the
+    match_reddit_records_in RPC (backend/sql/match_reddit_records_in.sql).
+    """
+    try:
+        res = supabase.rpc("match_reddit_records_in", {
+            "query_embedding": params["query_embedding"],
+            "match_threshold": params["match_threshold"],
+            "match_count": params["match_count"],
+            "id_filter": candidate_ids,
+        }).execute()
+
+        if getattr(res, "error", None):
+            logger.error(f"Supabase RPC error: {res.error.get('message', 'Unknown error')}", exc_info=True)
+            raise RuntimeError(res.error.get("message", "Supabase RPC error"))
+
+        return res.data or []
+    except Exception as e:
+        logger.error(f"Error in similarity_search RPC call: {e}", exc_info=True)
+        raise
+
+
+def similarity_search(target: str, top_k: int, threshold:float, filters: FilterRequest, candidate_ids: list = None):
+    """
+    Comments most similar to target, best first.
+
+    Args:
+        target (str): Search query
+        top_k (int): Maximum number of rows returned
+        threshold (float): Minimum similarity
+        filters (FilterRequest): Metadata filters applied by the search
+        candidate_ids (list): If given, only these comment ids are ranked, so the result is the
+            real top_k of an already filtered set instead of the global top_k intersected with it;
+            the candidates are assumed to satisfy filters already
+
+    Returns:
+        list: match_reddit_records rows (id and similarity at least)
+    """
+    target_embed = embed_target(target)
+    if target_embed is None:
+        logger.error("Failed to generate embedding for target query.")
+        return []
+
+    if not _search_available():
+        return []
+
+    params = _match_params(target_embed, top_k, threshold, filters)
+    if candidate_ids is None:
+        return _match_reddit_records(params)
+
+    candidate_ids = list(dict.fromkeys(candidate_ids))
+    if not candidate_ids:
+        return []
+    index = local_vector_index.get_index()
+    if index is not None:
+        return index.search(**params, candidate_ids=candidate_ids)
+    return _match_reddit_records_in(params, candidate_ids)
+
+
+def multi_similarity_search(targets: list, top_k: int, threshold: float, filters: FilterRequest):
+    """
+    Run similarity_search for several queries at once: one embedding pass for all of
+    them, then up to FEATURE_SEARCH_CONCURRENCY concurrent RPCs.
+
+    Returns:
+        list: The rows of every query concatenated, in the order of targets
+    """
+    if not _search_available():
+        return []
+
+    params = []
+    for target, target_embed in zip(targets, embed_targets(targets)):
+        if target_embed is None:
+            logger.error(f"Failed to generate embedding for target query: {target}")
+            continue
+        params.append(_match_params(target_embed, top_k, threshold, filters))
+    if not params:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(FEATURE_SEARCH_CONCURRENCY, len(params))) as executor:
+        results = list(executor.map(_match_reddit_records, params))
+    return [row for rows in results for row in (rows or [])]
+
 def fetch_by_feature(feature: str, k_per: int, threshold: float, max_out: int):
 
     # Get the category for filtering
@@ -238,12 +302,9 @@ def fetch_by_feature(feature: str, k_per: int, threshold: float, max_out: int):
         logger.error(f"Feature '{feature}' not found in category_config.CFG")
         return []
 
-    # 1) Loop through each expansion and return relevant comments to the category
-    pool = []                                           
-    for q in cfg["expansions"]:
-        # Filters parameter in similarity_search should be a FilterRequest instance
-        # If feature-specific filters are needed, create a FilterRequest here.
-        pool.extend(similarity_search(q, top_k=k_per, threshold=threshold, filters=FilterRequest()) or []) # Passed empty FilterRequest
+    # 1) Search with every expansion at once and return relevant comments to the category
+    # If feature-specific filters are needed, create a FilterRequest here.
+    pool = multi_similarity_search(cfg["expansions"], top_k=k_per, threshold=threshold, filters=FilterRequest()) # Passed empty FilterRequest
     
     # 2) Merge by max similarity: fetch max similarity for each comment
     best = get_max_similarity_by_id(pool)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("reddit-scraper-lambda")
+
+# Reddit allows roughly this many calls per rolling window for an OAuth client
+DEFAULT_LIMIT = 950
+DEFAULT_PERIOD = 600  # seconds
+# Requests kept in reserve when Reddit reports how much of its budget is left
+SERVER_RESERVE = 5
+
+
+class RedditRateLimiter:
+    """
+    Async token bucket for Reddit API calls.
+
+    Tokens refill continuously at limit/period per second, so calls are spread
+    across the window instead of bursting through it and then stalling. The
+    bucket also follows the X-Ratelimit-Remaining / X-Ratelimit-Reset values
+    that asyncpraw records from Reddit's responses. A single instance can be
+    shared by every scrape task of a session: acquire() holds an asyncio lock,
+    so concurrent callers queue up in order and no update is lost.
+    """
+
+    def __init__(self, limit: int = DEFAULT_LIMIT, period: float = DEFAULT_PERIOD, burst: int = 10):
+        self.rate = limit / period
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.total_calls = 0
+        self.reddit = None
+        self._lock = None
+
+    def attach(self, reddit):
+        """Read server-side rate-limit state from this asyncpraw client on every acquire."""
+        self.reddit = reddit
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _server_wait(self, calls: int) -> float:
+        """Seconds to wait according to the last X-Ratelimit headers Reddit sent, if any."""
+        # asyncprawcore keeps the parsed headers on its private rate limiter
+        core = getattr(self.reddit, "_core", None)
+        server = getattr(core, "_rate_limiter", None)
+        remaining = getattr(server, "remaining", None)
+        reset_timestamp = getattr(server, "reset_timestamp", None)
+        if remaining is None or reset_timestamp is None:
+            return 0.0
+
+        # Never hand out more tokens than Reddit says are left
+        self.tokens = min(self.tokens, float(remaining))
+        if remaining - calls >= SERVER_RESERVE:
+            return 0.0
+        return max(0.0, reset_timestamp - time.time())
+
+    async def acquire(self, calls: int = 1, context: str = None):
+        """
+        Wait until `calls` requests may be made, then consume them.
+
+        Args:
+            calls (int): Number of API calls about to be made
+            context (str): Description used in the log line when throttled
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            self._refill()
+            wait = self._server_wait(calls)
+            deficit = calls - self.tokens
+            if deficit > 0:
+                wait = max(wait, deficit / self.rate)
+
+            if wait > 0:
+                where = f" while {context}" if context else ""
+                if wait >= 1:
+                    logger.info(f"⏸️ API rate limit reached{where}. Sleeping for {wait:.1f}s...")
+                await asyncio.sleep(wait)
+                self._refill()
+                # Guard against float drift so the caller's tokens are always available
+                self.tokens = max(self.tokens, min(self.capacity, float(calls)))
+
+            self.tokens -= calls
+            self.total_calls += calls
@@ -2,26 +2,26 @@ import sys
 import os
 import asyncio
 import time
-import psutil
-import csv
 import asyncpraw
 import json
 import logging
-import statistics
-import shutil # Added for directory operations
-from .brotli_compression import BrotliFileCompressor
 from datetime import datetime
-from collections import deque
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from . import vectorise_comment
 from supabase import create_client, Client
-from transformers import AutoTokenizer, AutoModel
 from .filter_comment import is_useless_comment
 from .analyzer_worker import start_workers
+from .rate_limiter import RedditRateLimiter
+from . import scrape_watermarks
+from .scrape_checkpoint import ScrapeCheckpoint
+from .scrape_jobs import ScrapeProgress
+from . import comment_sink
+from . import columnar_store
+from . import dataset_manifest
+from . import label_index
+from .resource_monitor import ResourceMonitor
 
 import boto3
-import torch
-import torch.nn.functional as F
 
 # --- AWS Configuration ---
 AWS_REGION = "ca-central-1"
@@ -54,67 +54,25 @@ except OSError as e:
 
 # Constants
 REDDIT_API_LIMIT = 950
-COOLDOWN = 600
+COOLDOWN = 600  # length of Reddit's rate-limit window in seconds
 REPLACE_MORE_LIMIT = 100
-
-# Global counters
-global_api_call_count = 0
-reddit_call_count = 0
-reddit_window_start = time.time()
-
-# Define paths for the model
-# The model will be downloaded to /tmp for read/write access
-# HF_MODEL_ID = os.getenv("HF_MODEL_ID", "sentence-transformers/multi-qa-MiniLM-L6-cos-v1")
-# LOCAL_MODEL_PATH = Path("/tmp") / HF_MODEL_ID.split('/')[-1]
-LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", os.path.expanduser("~/models/m"))
-
-# Global Initialization of Tokenizer and Model
-tokenizer = None
-model = None
-
-# --- NEW FUNCTION TO ENSURE MODEL AVAILABILITY ---
-# This function checks if the model exists in /tmp and, if not,
-# copies it from the build-time cache location /app/hf_cache.
-# def ensure_model_is_available():
-#     """Ensures the Hugging Face model is available in the writable /tmp directory."""
-#     logger.info("Checking for model files in /tmp...")
-#     if not LOCAL_MODEL_PATH.is_dir():
-#         logger.warning(f"Model directory not found at {LOCAL_MODEL_PATH}. Attempting to copy from cache...")
-#         # Path to the model where it was cached during the Docker build
-#         HF_HOME_DIR = os.getenv("HF_HOME", "/app/hf_cache")
-#         source_path = Path(HF_HOME_DIR) / HF_MODEL_ID.split('/')[-1]
-        
-#         if source_path.is_dir():
-#             try:
-#                 # Use dirs_exist_ok=True to prevent an error if /tmp/model_name already exists.
-#                 shutil.copytree(source_path, LOCAL_MODEL_PATH, dirs_exist_ok=True)
-#                 logger.info(f"✅ Successfully copied model from {source_path} to {LOCAL_MODEL_PATH}")
-#             except Exception as e:
-#                 logger.error(f"❌ Error copying model directory: {e}", exc_info=True)
-#                 sys.exit(1) # Exit if essential model components cannot be copied
-#         else:
-#             logger.error(f"❌ Source model directory does not exist at {source_path}. Aborting.")
-#             sys.exit(1) # Exit if source is not found
-
-try:
-    # ensure_model_is_available()
-    logger.info(f"Loading tokenizer from local path: {LOCAL_MODEL_PATH}")
-    tokenizer = AutoTokenizer.from_pretrained(LOCAL_MODEL_PATH, local_files_only=True)
-    logger.info(f"Loading model from local path: {LOCAL_MODEL_PATH}")
-    model = AutoModel.from_pretrained(LOCAL_MODEL_PATH, local_files_only=True)
-    logger.info("✅ Successfully loaded tokenizer and model from local path.")
-except Exception as e:
-    logger.error(f"❌ Error loading tokenizer or model locally from {LOCAL_MODEL_PATH}: {e}", exc_info=True)
-    # If model loading fails, the application might not function correctly.
-    # Consider raising an error here if model is absolutely critical.
-    sys.exit(1) # Exit if essential model components cannot be loaded
-
-# Define S3 configuration for ONNX model (variables kept, but loading commented out)
-ONNX_S3_BUCKET_NAME = os.getenv("ONNX_MODEL_BUCKET")
-ONNX_S3_KEY = os.getenv("ONNX_MODEL_KEY")
-ONNX_LOCAL_PATH = Path("/tmp/model-quant.onnx")
-
-# Initialize S3 client for downloading ONNX model and uploading Brotli file
+# Number of submissions whose comment trees are fetched at the same time
+FETCH_CONCURRENCY = int(os.getenv("REDDIT_FETCH_CONCURRENCY", "8"))
+# Analysis worker threads shared by every subreddit of a scraping session
+NUM_ANALYSIS_WORKERS = 3
+# Seconds between "[MEMORY MONITOR]" log lines; sampling itself uses RESOURCE_MONITOR_INTERVAL
+MEMORY_LOG_INTERVAL = 10
+# Seconds between resumable checkpoints of a running scrape
+CHECKPOINT_INTERVAL = int(os.getenv("SCRAPE_CHECKPOINT_INTERVAL", "60"))
+
+# The embedding model (torch or quantized ONNX) is loaded lazily and shared through embedding_service
+# Embedding runs on its own thread so forward passes never block the event loop; inference is
+# serialised inside embedding_service anyway, so one thread serves every subreddit of a session
+EMBED_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedder")
+# Max posts waiting for the embedder; when full, processing fetched posts waits (backpressure)
+EMBED_QUEUE_SIZE = int(os.getenv("EMBED_QUEUE_SIZE", "32"))
+
+# Initialize S3 client for uploading Brotli files
 s3_client = boto3.client("s3", region_name=AWS_REGION)
 
 # Define S3 config for Brotli output
@@ -129,34 +87,6 @@ COMMENT_SCHEMA_KEYS = [
     'failed_solutions'
 ]
 
-# Code Credit: Daky
-# Background task to log memory usage every 10 seconds, add sample memory usage every 0.0001 second
-# === Memory monitor globals ===
-async def log_and_sample_memory_usage(proc, stop_event):
-    memory_samples = []
-    sample_interval = 0.0001
-    log_interval = 1
-    elapsed = 0
-
-    while not stop_event.is_set():
-        try:
-            mem_mb = proc.memory_info().rss / (1024 ** 2)
-            memory_samples.append(mem_mb)
-            elapsed += sample_interval
-
-            if elapsed >= log_interval:
-                logger.info(f"[MEMORY MONITOR] Current memory: {mem_mb:.2f} MB")
-                elapsed = 0
-        except psutil.NoSuchProcess:
-            logger.warning("[MEMORY MONITOR] Process not found, stopping.")
-            break
-        except Exception as e:
-            logger.error(f"[MEMORY MONITOR] Error: {e}")
-
-        await asyncio.sleep(sample_interval)
-
-    return memory_samples
-
 # Function to create a comment with all keys
 def create_comment(**kwargs):
     comment = {key: None for key in COMMENT_SCHEMA_KEYS}
@@ -190,77 +120,213 @@ def utc_to_iso(utc_ts):
     """Convert UTC timestamp to ISO format string."""
     return datetime.utcfromtimestamp(utc_ts).isoformat() + "+00:00"
 
-async def async_guard_reddit(calls=1, context=None):
+async def async_guard_reddit(rate_limiter, calls=1, context=None):
     """
     Rate limiting guard for Reddit API calls.
-    Ensures we don't exceed REDDIT_API_LIMIT calls per 10-minute window.
+    Waits on the session's shared RedditRateLimiter before `calls` requests are made.
     """
-    global reddit_call_count, reddit_window_start, global_api_call_count
-
-    now = time.time()
-    elapsed = now - reddit_window_start
-
-    # Reset window if 10 minutes have passed
-    if elapsed >= COOLDOWN:
-        reddit_window_start = now
-        reddit_call_count = 0
-        elapsed = 0
-
-    # Check if we would exceed the limit
-    if reddit_call_count + calls > REDDIT_API_LIMIT:
-        sleep_time = COOLDOWN - elapsed
-        if context:
-            logger.info(f"⏸️ API rate limit reached while {context}. Sleeping for {sleep_time:.1f}s...")
-        else:
-            logger.info(f"⏸️ API rate limit reached. Sleeping for {sleep_time:.1f}s...")
-        await asyncio.sleep(sleep_time)
-        logger.info(f"▶️ Resuming after cooldown period")
-        reddit_window_start = time.time()
-        reddit_call_count = 0
-
-    reddit_call_count += calls
-    global_api_call_count += calls
-
-# Mean Pooling - Take average of all tokens
-def mean_pooling(model_output, attention_mask):
-    token_embeddings = model_output[0] # First element of model_output contains all token embeddings
-    input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
-    return torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
-
-# Added embed_text function to be used within scraper for consistency
-def embed_text(texts: list[str]):
-    global tokenizer, model
-    if tokenizer is None or model is None:
-        logger.error("Tokenizer or model not loaded. Cannot embed text.")
-        return [None] * len(texts)
-    try:
-        encoded_input = tokenizer(
-            texts,
-            padding=True,
-            truncation=True,
-            return_tensors="pt"
-        )
-        with torch.no_grad():
-            model_output = model(**encoded_input)
-        sentence_embeddings = mean_pooling(model_output, encoded_input['attention_mask'])
-        return F.normalize(sentence_embeddings, p=2, dim=1).tolist()
-    except Exception as e:
-        logger.error(f"Error embedding text in reddit_scraper: {e}", exc_info=True)
-        return [None] * len(texts) # Return list of Nones for failure
+    await rate_limiter.acquire(calls, context=context)
 
-
-async def scrape_comments(subreddit_name, post_limit):
+async def fetch_submission_comments(submission, semaphore, rate_limiter, monitor):
     """
-    Scrape comments from a specific subreddit with complete data for database storage.
+    Fetch the full comment list of a submission, holding a slot of the shared semaphore.
 
     Args:
-        subreddit_name (str): Name of the subreddit to scrape
-        post_limit (int): Number of posts to process
+        submission: asyncpraw Submission to fetch comments for
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight submissions
+        rate_limiter (RedditRateLimiter): Rate limiter shared by the scraping session
+        monitor (ResourceMonitor): Session monitor; the fetch is tagged as the "fetch" stage
 
     Returns:
-        dict: Dictionary containing posts, authors, and comments data
+        tuple: (submission, comment list), or (submission, None) if the fetch failed
+    """
+    async with semaphore:
+        # Guard before fetching comments
+        await async_guard_reddit(rate_limiter, context="fetching comments for submission")
+
+        try:
+            # Fetch comments with timeout handling
+            with monitor.stage("fetch"):
+                comments_obj = await asyncio.wait_for(submission.comments(), timeout=30)
+                await asyncio.wait_for(comments_obj.replace_more(limit=REPLACE_MORE_LIMIT), timeout=60)
+                return submission, comments_obj.list()
+        except asyncio.TimeoutError:
+            logger.warning(f"⏰ Timeout fetching comments for {submission.id}; skipping...")
+        except Exception as e:
+            logger.error(f"❌ Error fetching comments for {submission.id}: {e}", exc_info=True)
+
+    return submission, None
+
+async def process_fetched_submission(submission, comment_list, scraped_data, analyze_queue, stats, monitor):
     """
+    Filter the fetched comments of one submission and queue them for analysis and embedding.
 
+    Args:
+        submission: asyncpraw Submission the comments belong to
+        comment_list (list): Flattened comment list returned by fetch_submission_comments
+        scraped_data (dict): Per-subreddit results being collected
+        analyze_queue (queue.Queue): Queue consumed by the analysis workers
+        stats (dict): Running counters for the scrape summary
+        monitor (ResourceMonitor): Session monitor; filtering is tagged as the filter stage
+    """
+    # Process comments with proper rate limiting
+    comments_processed_for_this_post = 0
+    filtered_comments = []
+    comments_to_vectorise = [] # new list to hold comments for batch vectorization
+
+    # Comments stored by an earlier scrape are skipped (empty set on full scrapes)
+    watermark = scraped_data['watermark']
+    seen_ids = scrape_watermarks.seen_comment_ids(watermark, submission.id)
+    fetched_ids = []
+    last_created_utc = 0.0
+
+    filtering_time = 0
+    with monitor.stage("filter"):
+        for comment in comment_list:
+            time_before_filter = time.time()
+            if comment is None or not hasattr(comment, 'body') or not comment.body:
+                logger.warning(f"⚠️ Received None or empty body for comment in post {submission.id}; skipping...")
+                continue
+            fetched_ids.append(comment.id)
+            last_created_utc = max(last_created_utc, comment.created_utc)
+            if comment.id in seen_ids:
+                stats['comments_already_seen'] += 1
+                continue
+            reason = is_useless_comment(comment.body)
+            filtering_time += time.time() - time_before_filter
+            if reason:
+                filtered_comments.append({
+                    "comment_id": comment.id,
+                    "author": str(comment.author) if comment.author else "deleted",
+                    "body": comment.body,
+                    "reason": reason
+                })
+                continue
+
+            # Get comment author
+            comment_author = str(comment.author) if comment.author else "deleted"
+            scraped_data['authors'].add(comment_author)
+
+            # Clean the comment body for database storage
+            clean_body = comment.body.replace('\n', ' ').replace('\r', ' ').strip()
+
+            comment_data = create_comment(
+                id=comment.id,
+                post_id=submission.id,
+                subreddit=submission.subreddit.display_name.lower(),
+                author=str(comment.author) if comment.author else None,
+                body=comment.body,
+                created_utc=datetime.utcfromtimestamp(comment.created_utc).isoformat(),
+                score=comment.score,
+                parent_id=comment.parent_id
+            )
+
+            # Held only until the analysis workers write it to the subreddit's comment sink
+            scraped_data['pending'][comment.id] = comment_data
+            analyze_queue.put(comment_data)
+
+            # Add comment to the list for batch vectorization, unless a resumed run already embedded it
+            if comment.id not in scraped_data['vectorised_ids'] and comment.id not in scraped_data['unvectorised']:
+                comments_to_vectorise.append({
+                    "id": comment.id,
+                    "body": clean_body
+                })
+
+            comments_processed_for_this_post += 1
+
+    # --- BATCH VECTORIZATION LOGIC ADDED HERE --- #
+    # Handed to the subreddit's embedding pipeline; waits here only if the pipeline is full
+    logger.info(f"[VECTORISE] Queueing {len(comments_to_vectorise)} comments for vectorization...")
+    if comments_to_vectorise:
+        await queue_for_embedding(scraped_data, comments_to_vectorise)
+
+    scrape_watermarks.record_post(watermark, submission.id, submission.num_comments, fetched_ids, last_created_utc)
+    scraped_data['processed_post_ids'].add(submission.id)
+
+    stats['comments_collected'] += comments_processed_for_this_post
+    scraped_data['progress'].add(comments_collected=comments_processed_for_this_post)
+    logger.info(f"📝 Collected {comments_processed_for_this_post} comments from post {submission.id} (Total: {stats['comments_collected']})")
+
+    # print filtering info
+    logger.info(f"⏱️ Filtering time: {filtering_time:.8f} seconds")
+    logger.info(f"🚫 Filtered out {len(filtered_comments)} comments")
+
+async def queue_for_embedding(scraped_data, comments):
+    """Hand comments to the embedding pipeline; they count as unvectorised until inserted."""
+    for comment in comments:
+        scraped_data['unvectorised'][comment['id']] = comment
+    await scraped_data['embed_queue'].put(comments)
+
+def start_vector_pipeline(scraped_data, monitor):
+    """
+    Start the embed and insert stages of a subreddit, connected by asyncio queues.
+
+    Fetched comments go into scraped_data['embed_queue']; the embed stage batches them
+    on EMBED_EXECUTOR and the insert stage upserts the records off the event loop, so
+    fetching, embedding and inserting overlap. Stop it with finish_vector_pipeline().
+    """
+    scraped_data['embed_queue'] = asyncio.Queue(maxsize=EMBED_QUEUE_SIZE)
+    insert_queue = asyncio.Queue(maxsize=2)
+    scraped_data['vector_tasks'] = [
+        asyncio.create_task(embed_stage(scraped_data, insert_queue, monitor)),
+        asyncio.create_task(insert_stage(scraped_data, insert_queue, monitor)),
+    ]
+
+async def finish_vector_pipeline(scraped_data):
+    """Embed and insert whatever is still queued, then stop both stages."""
+    await scraped_data['embed_queue'].put(None)
+    await asyncio.gather(*scraped_data['vector_tasks'])
+    scraped_data['stats']['embedding_cache_hits'] = scraped_data['embedder'].cache_hits
+    scraped_data['stats']['embedding_cache_misses'] = scraped_data['embedder'].cache_misses
+
+async def embed_stage(scraped_data, insert_queue, monitor):
+    """Feed queued comments to the subreddit's EmbeddingBatcher on the embedding thread."""
+    loop = asyncio.get_running_loop()
+    embedder = scraped_data['embedder']
+
+    def embed(comments):
+        with monitor.stage("embed"):
+            # None flushes the batcher at the end of the subreddit
+            return embedder.flush() if comments is None else embedder.add(comments)
+
+    while True:
+        comments = await scraped_data['embed_queue'].get()
+        try:
+            vector_batch = await loop.run_in_executor(EMBED_EXECUTOR, embed, comments)
+            if vector_batch:
+                await insert_queue.put(vector_batch)
+        except Exception as e:
+            logger.error("[VECTORISE] Exception during batch vectorisation", exc_info=True)
+        if comments is None:
+            await insert_queue.put(None)
+            return
+
+async def insert_stage(scraped_data, insert_queue, monitor):
+    """Upsert embedded records into Supabase in chunks and mark their comments as vectorised."""
+    stats = scraped_data['stats']
+    while True:
+        vector_batch = await insert_queue.get()
+        if vector_batch is None:
+            return
+        # Split into smaller chunks for insertion to avoid timeouts
+        for i, chunk in enumerate(_chunks(vector_batch, vectorise_comment.BATCH_SIZE)):
+            logger.info(f"🛰️ Inserting vector batch {i+1} of {len(chunk)} comments into Supabase...")
+            try:
+                with monitor.stage("insert"):
+                    await asyncio.to_thread(supabase.table('reddit_records').upsert(chunk).execute)
+            except Exception as e:
+                logger.error("[VECTORISE] Exception during vector insertion", exc_info=True)
+                continue
+            # Bookkeeping stays on the event loop, where checkpoints read it
+            for record in chunk:
+                scraped_data['unvectorised'].pop(record['id'], None)
+            scraped_data['vectorised_ids'].update(record['id'] for record in chunk)
+            scraped_data['progress'].add(vectors_inserted=len(chunk))
+            stats['comments_vectorised'] += len(chunk)
+            current_memory_mb = monitor.current_mb()
+            logger.info(f"[VECTORISE] ✅ Vectorised and inserted {stats['comments_vectorised']} comments | Memory: {current_memory_mb:.2f} MB")
+
+def set_ca_bundle():
     # --- SSL CERTIFICATE FIX ---
     # Set the environment variable to point to the CA certificate bundle.
     # This must be done before the PRAW client is initialized.
@@ -271,386 +337,611 @@ async def scrape_comments(subreddit_name, post_limit):
         logger.info(f"REQUESTS_CA_BUNDLE environment variable set to: {cert_path}")
     except Exception as e:
         logger.error(f"Error setting REQUESTS_CA_BUNDLE: {e}")
-    
-    # Clear vector db before scraping comments
-    # This remains the same, but it should be called once at the start of the entire scraping run,
-    # not at the beginning of each subreddit. This is handled correctly in scrape_comments_async.
-    vectorise_comment.clear_vector_db(supabase)
+
+def create_reddit_client():
+    """Create the asyncpraw client shared by every subreddit of a scraping session."""
+    return asyncpraw.Reddit(
+        client_id=os.getenv("REDDIT_CLIENT_ID"),
+        client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
+        user_agent=os.getenv("REDDIT_USER_AGENT"),
+        requestor_kwargs={'timeout': 30}
+    )
+
+async def scrape_subreddit(session, subreddit_name, post_limit):
+    """
+    Fetch posts and comments of one subreddit using a shared Reddit session and analysis pool.
+
+    Args:
+        session (dict): Shared session state built by run_scrape_session
+            (reddit client, rate limiter, analysis queue, comment lookup, process,
+            incremental flag, checkpoint, progress)
+        subreddit_name (str): Name of the subreddit to scrape
+        post_limit (int): Number of posts to process
+
+    Returns:
+        dict: Dictionary containing posts, authors, the open comment sink and scrape stats
+    """
+    reddit = session['reddit']
+    rate_limiter = session['rate_limiter']
+    analyze_queue = session['analyze_queue']
+    monitor = session['monitor']
 
     subreddit_name = subreddit_name.lower()
     scraped_data = {
         'subreddit_info': {'name': subreddit_name},
         'posts': {},
         'authors': set(),
-        'comments': [],
-        'comments_by_id': {},
+        'pending': {},
+        'sink': None,
+        'progress': session['progress'],
+        'processed_post_ids': set(),
+        'vectorised_ids': set(),
+        'embedder': vectorise_comment.EmbeddingBatcher(),
+        # Comments queued for embedding but not inserted yet, by id; checkpointed as the embedding backlog
+        'unvectorised': {},
+        'embed_queue': None,
+        'vector_tasks': [],
+        'watermark': (
+            scrape_watermarks.load_watermark(s3_client, BROTLI_OUTPUT_BUCKET, BROTLI_OUTPUT_PREFIX, subreddit_name)
+            if session['incremental'] else scrape_watermarks.new_watermark(subreddit_name)
+        ),
+        'stats': {
+            'posts_processed': 0,
+            'posts_unchanged': 0,
+            'posts_resumed': 0,
+            'comments_collected': 0,
+            'comments_already_seen': 0,
+            'comments_vectorised': 0,
+            'embedding_cache_hits': 0,
+            'embedding_cache_misses': 0,
+            'elapsed': 0.0,
+        },
     }
+    stats = scraped_data['stats']
+    start_time = time.time()
 
-    posts_processed = 0
-    total_comments_collected = 0
-    total_comments_vectorised = 0
+    # Pick up the work a previous, interrupted run of this session already did
+    checkpoint = session['checkpoint']
+    saved_state = checkpoint.state_for(subreddit_name) if checkpoint else None
+    try:
+        if saved_state:
+            open_comment_sink(session, scraped_data, resume_from=checkpoint.fetch_part(subreddit_name),
+                              rows_written=saved_state['rows_written'])
+            restore_checkpoint_state(scraped_data, saved_state, analyze_queue)
+        else:
+            open_comment_sink(session, scraped_data)
+        start_vector_pipeline(scraped_data, monitor)
+        if saved_state:
+            # Comments the interrupted run had queued for embedding but not inserted yet
+            await queue_for_embedding(scraped_data, saved_state.get('embedding_backlog', []))
+        session['scraped'][subreddit_name] = scraped_data
+    except Exception:
+        await abandon_subreddit_scrape(session, scraped_data)
+        raise
 
-    num_workers = 3
+    logger.info(f"📥 Fetching top {post_limit} hot posts from r/{subreddit_name}...")
 
-    # Start analysis worker task
-    analyze_queue, worker_threads = start_workers(num_workers, scraped_data)
+    # Comment trees are fetched concurrently; at most FETCH_CONCURRENCY submissions are in flight
+    fetch_semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    pending_fetches = set()
 
-    # Get process for memory monitoring
-    proc = psutil.Process()
+    async def drain_fetches(return_when):
+        # Process fetched submissions in completion order, not listing order
+        nonlocal pending_fetches
+        done, pending_fetches = await asyncio.wait(pending_fetches, return_when=return_when)
+        for task in done:
+            submission, comment_list = task.result()
+            session['progress'].add(posts_done=1)
+            if comment_list is not None:
+                await process_fetched_submission(submission, comment_list, scraped_data, analyze_queue, stats, monitor)
 
-    stop_event = asyncio.Event()
-    tracking_task = asyncio.create_task(log_and_sample_memory_usage(proc, stop_event))
+    try:
+        subreddit = await reddit.subreddit(subreddit_name)
+        await async_guard_reddit(rate_limiter, context="fetching subreddit info")
+
+        async for submission in subreddit.hot(limit=post_limit):
+            # Check rate limit before processing each post
+            await async_guard_reddit(rate_limiter, context="fetching submission")
+
+            if stats['posts_processed'] >= post_limit:
+                logger.info(f"✅ Reached post limit of {post_limit} for r/{subreddit_name}")
+                break
+
+            stats['posts_processed'] += 1
+            logger.info(f"🔄 [r/{subreddit_name}] Processing post {stats['posts_processed']}/{post_limit}: {submission.id} - {submission.title[:50]}...")
+
+            # Store post information
+            post_author = str(submission.author) if submission.author else "deleted"
+            scraped_data['authors'].add(post_author)
+            scraped_data['posts'][submission.id] = {
+                'id': submission.id,
+                'subreddit': subreddit_name,
+                'author': post_author,
+                'title': submission.title,
+                'selftext': submission.selftext or "",
+                'created_utc': utc_to_iso(submission.created_utc),
+                'score': submission.score,
+                'num_comments': submission.num_comments,
+                'permalink': submission.permalink
+            }
+
+            # Posts finished before the checkpoint are neither re-fetched nor re-embedded
+            if submission.id in scraped_data['processed_post_ids']:
+                stats['posts_resumed'] += 1
+                session['progress'].add(posts_done=1)
+                continue
+
+            # Incremental runs skip posts whose comment count has not moved since the last scrape
+            if session['incremental'] and not scrape_watermarks.has_new_comments(
+                    scraped_data['watermark'], submission.id, submission.num_comments):
+                stats['posts_unchanged'] += 1
+                scraped_data['processed_post_ids'].add(submission.id)
+                session['progress'].add(posts_done=1)
+                continue
+
+            # Wait for a free slot before queueing another fetch, handling whatever finished meanwhile
+            if len(pending_fetches) >= FETCH_CONCURRENCY:
+                await drain_fetches(asyncio.FIRST_COMPLETED)
+            pending_fetches.add(asyncio.create_task(fetch_submission_comments(submission, fetch_semaphore, rate_limiter, monitor)))
+
+        while pending_fetches:
+            await drain_fetches(asyncio.FIRST_COMPLETED)
 
-    mem_before = proc.memory_info().rss / (1024 ** 2)
-    logger.info(f"[VECTORISE] Initial memory usage: {mem_before:.2f} MB")
-    start_time = time.time()
+    except Exception as e:
+        logger.error(f"❌ Error accessing subreddit r/{subreddit_name}: {e}", exc_info=True)
+        for task in pending_fetches:
+            task.cancel()
 
-    # Create reddit instance
-    async with asyncpraw.Reddit(
-        client_id=os.getenv("REDDIT_CLIENT_ID"),
-        client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
-        user_agent=os.getenv("REDDIT_USER_AGENT"),
-        requestor_kwargs={'timeout': 30}
-    ) as reddit:
+    try:
+        await finish_vector_pipeline(scraped_data)
+    except Exception:
+        await abandon_subreddit_scrape(session, scraped_data)
+        raise
 
-        logger.info(f"📥 Fetching top {post_limit} hot posts from r/{subreddit_name}...")
+    stats['elapsed'] = time.time() - start_time
+    return scraped_data
 
+def update_vector_metadata(rows):
+    """Attach analysis metadata to existing vector records; relies on id being their PK."""
+    supabase.rpc('update_reddit_records_attr', {"payload": rows}).execute()
+    logger.info(f"[VECTORISE] 🛰️ Updated metadata for {len(rows)} records")
+
+def open_comment_sink(session, scraped_data, resume_from=None, rows_written=0):
+    """Create the subreddit's streaming .csv.br sink and register it for the analysis workers."""
+    subreddit_name = scraped_data['subreddit_info']['name']
+    filename = f"reddit_{subreddit_name}_comments_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv.br"
+    scraped_data['sink'] = comment_sink.CommentCsvSink(
+        comment_sink.LOCAL_OUTPUT_DIR / filename,
+        COMMENT_SCHEMA_KEYS,
+        scraped_data['pending'],
+        scraped_data['vectorised_ids'],
+        update_metadata=update_vector_metadata if supabase else None,
+        resume_from=resume_from,
+        rows_written=rows_written,
+    )
+    session['sinks'][subreddit_name] = scraped_data['sink']
+
+def discard_comment_sink(scraped_data):
+    """Close and delete the sink of a scrape whose results are not kept."""
+    sink = scraped_data['sink']
+    sink.close()
+    sink.path.unlink(missing_ok=True)
+
+async def abandon_subreddit_scrape(session, scraped_data):
+    """
+    Clean up an attempt that failed part-way: stop its vector pipeline, discard its
+    sink and unregister it, so a retry starts from a clean session.
+    """
+    subreddit_name = scraped_data['subreddit_info']['name']
+    for task in scraped_data['vector_tasks']:
+        task.cancel()
+    await asyncio.gather(*scraped_data['vector_tasks'], return_exceptions=True)
+    if scraped_data['sink'] is not None:
+        discard_comment_sink(scraped_data)
+        if session['sinks'].get(subreddit_name) is scraped_data['sink']:
+            del session['sinks'][subreddit_name]
+    if session['scraped'].get(subreddit_name) is scraped_data:
+        del session['scraped'][subreddit_name]
+
+def restore_checkpoint_state(scraped_data, saved_state, analyze_queue):
+    """
+    Load a subreddit's checkpointed state into fresh scraped_data.
+    Analysed rows were replayed into the sink already; pending comments are queued for analysis again.
+    """
+    stats = scraped_data['stats']
+    scraped_data['processed_post_ids'].update(saved_state['processed_post_ids'])
+    scraped_data['posts'].update(saved_state['posts'])
+    scraped_data['authors'].update(saved_state['authors'])
+    scraped_data['vectorised_ids'].update(saved_state['vectorised_ids'])
+    scraped_data['watermark'] = saved_state['watermark']
+
+    rows_written = saved_state['rows_written']
+    pending_comments = saved_state['pending_comments']
+    scraped_data['progress'].add(
+        comments_collected=rows_written + len(pending_comments),
+        comments_analysed=rows_written,
+        vectors_inserted=len(saved_state['vectorised_ids']),
+    )
+    for comment_data in pending_comments:
+        scraped_data['pending'][comment_data['id']] = comment_data
+        analyze_queue.put(comment_data)
+
+    stats['comments_collected'] += rows_written + len(pending_comments)
+    stats['comments_vectorised'] += len(saved_state['vectorised_ids'])
+    logger.info(f"📍 Restored r/{scraped_data['subreddit_info']['name']} from checkpoint: "
+                f"{len(saved_state['processed_post_ids'])} posts, {rows_written} analysed and "
+                f"{len(pending_comments)} pending comments, {len(saved_state['vectorised_ids'])} vectors")
+
+async def write_checkpoint(session):
+    """Snapshot the session on the event loop, then upload it off the loop."""
+    checkpoint = session['checkpoint']
+    body = checkpoint.snapshot(session['scraped'], COMMENT_SCHEMA_KEYS)
+    await asyncio.to_thread(checkpoint.save, body)
+
+async def checkpoint_periodically(session, stop_event):
+    """Write a checkpoint every CHECKPOINT_INTERVAL seconds until the scrape stops."""
+    while not stop_event.is_set():
         try:
-            subreddit = await reddit.subreddit(subreddit_name)
-            await async_guard_reddit(context="fetching subreddit info")
-
-            async for submission in subreddit.hot(limit=post_limit):
-                # Check rate limit before processing each post
-                await async_guard_reddit(context="fetching submission")
-
-                if posts_processed >= post_limit:
-                    logger.info(f"✅ Reached post limit of {post_limit} for r/{subreddit_name}")
-                    break
-
-                posts_processed += 1
-                logger.info(f"🔄 Processing post {posts_processed}/{post_limit}: {submission.id} - {submission.title[:50]}...")
-
-                # Store post information
-                post_author = str(submission.author) if submission.author else "deleted"
-                scraped_data['authors'].add(post_author)
-                scraped_data['posts'][submission.id] = {
-                    'id': submission.id,
-                    'subreddit': subreddit_name,
-                    'author': post_author,
-                    'title': submission.title,
-                    'selftext': submission.selftext or "",
-                    'created_utc': utc_to_iso(submission.created_utc),
-                    'score': submission.score,
-                    'num_comments': submission.num_comments,
-                    'permalink': submission.permalink
-                }
-
-                # Guard before fetching comments
-                await async_guard_reddit(context="fetching comments for submission")
-
-                try:
-                    # Fetch comments with timeout handling
-                    comments_task = asyncio.create_task(submission.comments())
-                    comments_obj = await asyncio.wait_for(comments_task, timeout=30)
-
-                    replace_more_task = asyncio.create_task(comments_obj.replace_more(limit=REPLACE_MORE_LIMIT))
-                    await asyncio.wait_for(replace_more_task, timeout=60)
-
-                    comment_list = comments_obj.list()
-                except asyncio.TimeoutError:
-                    logger.warning(f"⏰ Timeout fetching comments for {submission.id}; skipping...")
-                    continue
-                except Exception as e:
-                    logger.error(f"❌ Error fetching comments for {submission.id}: {e}", exc_info=True)
-                    continue
-
-                # Process comments with proper rate limiting
-                comments_processed_for_this_post = 0
-                filtered_comments = []
-                comments_to_vectorise = [] # new list to hold comments for batch vectorization
-                
-                filtering_time = 0
-                for i, comment in enumerate(comment_list):
-                    if i % 1000 == 0 and i != 0:
-                        await asyncio.sleep(0.1)
-                    time_before_filter = time.time()
-                    if comment is None or not hasattr(comment, 'body') or not comment.body:
-                        logger.warning(f"⚠️ Received None or empty body for comment in post {submission.id}; skipping...")
-                        continue
-                    reason = is_useless_comment(comment.body)
-                    filtering_time += time.time() - time_before_filter
-                    if reason:
-                        filtered_comments.append({
-                            "comment_id": comment.id,
-                            "author": str(comment.author) if comment.author else "deleted",
-                            "body": comment.body,
-                            "reason": reason
-                        })
-                        continue
-
-                    # Get comment author
-                    comment_author = str(comment.author) if comment.author else "deleted"
-                    scraped_data['authors'].add(comment_author)
-
-                    # Clean the comment body for database storage
-                    clean_body = comment.body.replace('\n', ' ').replace('\r', ' ').strip()
-
-                    # Get parent ID - could be another comment or the post itself
-                    parent_id = None
-                    if hasattr(comment, 'parent_id') and comment.parent_id:
-                        parent_id = comment.parent_id.split('_')[1] if '_' in comment.parent_id else comment.parent_id
-
-                    comment_data = create_comment(
-                        id=comment.id,
-                        post_id=submission.id,
-                        subreddit=submission.subreddit.display_name.lower(),
-                        author=str(comment.author) if comment.author else None,
-                        body=comment.body,
-                        created_utc=datetime.utcfromtimestamp(comment.created_utc).isoformat(),
-                        score=comment.score,
-                        parent_id=comment.parent_id
-                    )
-
-                    scraped_data['comments'].append(comment_data)
-                    scraped_data['comments_by_id'][comment.id] = comment_data
-
-                    # Also enqueue for AI attribute analysis
-                    analyze_queue.put(comment_data)
-                    
-                    # Add comment to the list for batch vectorization
-                    comments_to_vectorise.append({
-                        "id": comment.id,
-                        "body": clean_body
-                    })
-
-                    comments_processed_for_this_post += 1
-
-                # --- BATCH VECTORIZATION LOGIC ADDED HERE --- #
-                logger.info(f"[VECTORISE] Batching {len(comments_to_vectorise)} comments for vectorization...")
-                if comments_to_vectorise:
-                    try:
-                        # vector_batch = brotli_compression.vectorise_batch(comments_to_vectorise)
-                        vector_batch = vectorise_comment.vectorise_batch(comments_to_vectorise)
-                        if vector_batch:
-                            # Split into smaller chunks for insertion to avoid timeouts
-                            for i, chunk in enumerate(_chunks(vector_batch, 500)):
-                                logger.info(f"🛰️ Inserting vector batch {i+1} of {len(chunk)} comments into Supabase...")
-                                supabase.table('reddit_records').insert(chunk).execute()
-                                total_comments_vectorised += len(chunk)
-                                current_memory_mb = proc.memory_info().rss / (1024 ** 2)
-                                logger.info(f"[VECTORISE] ✅ Vectorised and inserted {total_comments_vectorised} comments | Memory: {current_memory_mb:.2f} MB")
-                    except Exception as e:
-                        logger.error("[VECTORISE] Exception during batch vectorisation or insertion", exc_info=True)
-
-                total_comments_collected += comments_processed_for_this_post
-                logger.info(f"📝 Collected {comments_processed_for_this_post} comments from post {submission.id} (Total: {total_comments_collected})")
-
-                # print filtering info
-                logger.info(f"⏱️ Filtering time: {filtering_time:.8f} seconds")
-                logger.info(f"🚫 Filtered out {len(filtered_comments)} comments")
-                #logger.info("🧹 Filtered Comments:")
-                #for fc in filtered_comments:
-                #    logger.info(json.dumps(fc, ensure_ascii=False, indent=2))
+            await asyncio.wait_for(stop_event.wait(), timeout=CHECKPOINT_INTERVAL)
+        except asyncio.TimeoutError:
+            await write_checkpoint(session)
 
-        except Exception as e:
-            logger.error(f"❌ Error accessing subreddit r/{subreddit_name}: {e}", exc_info=True)
-            return scraped_data
+async def scrape_subreddit_with_retry(session, subreddit_name, post_limit):
+    """
+    Scrape a subreddit, retrying once if the first attempt fails or collects no comments.
 
-    # The rest of the function remains the same, as it deals with post-scraping tasks
-    stop_event.set()
-    end_time = time.time()
+    Returns:
+        dict or None: The scraped data, or None after a final failure
+    """
+    for attempt in range(2):
+        if attempt > 0:
+            logger.warning(f"⚠️ Retry attempt for r/{subreddit_name}")
+        try:
+            scraped_data = await scrape_subreddit(session, subreddit_name, post_limit)
+            comments_collected = scraped_data['stats']['comments_collected']
+            if comments_collected:
+                logger.info(f"✅ Successfully scraped r/{subreddit_name}: {comments_collected} comments")
+                return scraped_data
+            # Nothing new is a valid outcome for an incremental refresh
+            if session['incremental'] and scraped_data['stats']['posts_processed']:
+                logger.info(f"✅ No new comments for r/{subreddit_name} since the last scrape")
+                return scraped_data
+            logger.warning(f"⚠️ No comments collected for r/{subreddit_name}")
+            discard_comment_sink(scraped_data)
+        except Exception as e:
+            logger.error(f"❌ Error scraping r/{subreddit_name}: {e}", exc_info=True)
 
-    memory_samples = await tracking_task
-    avg_mem_usage = statistics.mean(memory_samples) if memory_samples else 0
-    peak_mem_usage = max(memory_samples) if memory_samples else 0
+    logger.error(f"❌ Final failure for r/{subreddit_name} after retry")
+    return None
 
-    elapsed = end_time - start_time
-    mem_after = proc.memory_info().rss
+def save_scraped_subreddit(scraped_data):
+    """
+    Finish the subreddit's streamed .csv.br and upload it to S3.
+    Must only be called once the analysis workers have finished; the sink pushes
+    the remaining analysis metadata to the vector database as it closes.
 
-    # Finish scraping
-    logger.info("[scraper] Sending None flag to analysis workers")
-    # Send shutdown signals (one None per worker)
-    for _ in range(num_workers):
-        analyze_queue.put(None)
+    Args:
+        scraped_data (dict): Result of scrape_subreddit; gains a 'comments' entry
+            (SavedComments) that reads the saved rows back lazily
 
-    # Wait for all threads to finish
-    for t in worker_threads:
-        t.join()
-    logger.info("All analysis workers finished.")
-    ai_wait_time = time.time() - end_time
+    Returns:
+        bool: False when the .csv.br could not be uploaded; the run's checkpoint must then be kept
+    """
+    sink = scraped_data['sink']
+    sink.close()
+    scraped_data['comments'] = comment_sink.SavedComments([sink.path], sink.rows_written)
 
-    # Insert the metadata into our vector database with corresponding comment id
-    rows_to_update = []
-    batch_size_db_update = 500
-
-    for c in scraped_data['comments']:
-        cid = c['id']
-        src = scraped_data['comments_by_id'][cid]
-
-        row = {
-            'id': cid,
-            'subreddit': src.get('subreddit'),
-            'emotions': src.get('emotions'),
-            'topics': src.get('topics'),
-            'practitioner_reference': src.get('practitioner_reference'),
-            'created_at': src.get('created_utc')
-        }
+    compressed_size = sink.path.stat().st_size
+    logger.info(f"💾 {sink.rows_written} comments streamed and Brotli-compressed to: {sink.path} "
+                f"(ratio={sink.raw_bytes / compressed_size if compressed_size else 0:.2f}:1)")
 
-        # Filter out None values before sending to Supabase RPC, ensure JSON string for dict/list types
-        cleaned_row = {
-            k: v if k not in row else (v if v is not None else {})  # default to empty dict if None
-            for k, v in row.items()
-            if v is not None or k in row
-        } 
-        rows_to_update.append(cleaned_row)
+    # Upload in its own block so a failure still lets the summary be logged
+    output_s3_key = parquet_s3_key = index_s3_key = None
+    try:
+        if BROTLI_OUTPUT_BUCKET:
+            output_s3_key = f"{BROTLI_OUTPUT_PREFIX}{sink.path.name}"
+            logger.info(f"☁️ Uploading Brotli file to s3://{BROTLI_OUTPUT_BUCKET}/{output_s3_key} ...")
+            s3_client.upload_file(str(sink.path), BROTLI_OUTPUT_BUCKET, output_s3_key)
+            logger.info("✅ Brotli file uploaded to S3 successfully.")
+    except Exception as e:
+        output_s3_key = None
+        logger.error(f"❌ Error during S3 upload: {e}", exc_info=True)
+        # The file stays in /tmp until the next session starts.
 
-    # bulk upsert; relies on id being the PK of the vector database (must be unique)
-    if supabase:
+    # Typed columnar copy for the API's read path; the .csv.br stays the source of truth
+    if columnar_store.HAS_PYARROW:
         try:
-            for i, chunk in enumerate(_chunks(rows_to_update, batch_size_db_update)):
-                supabase.rpc('update_reddit_records_attr', {"payload" : chunk}).execute()
-                logger.info(f"[VECTORISE] 🛰️ Updated metadata for batch {i+1}")
+            parquet_path = sink.path.with_name(columnar_store.parquet_name(sink.path.name))
+            rows = columnar_store.write_parquet(scraped_data['comments'], parquet_path, COMMENT_SCHEMA_KEYS)
+            logger.info(f"🧱 {rows} comments written to Parquet: {parquet_path} "
+                        f"({bytes_to_mb(parquet_path.stat().st_size):.2f} MB)")
+            if BROTLI_OUTPUT_BUCKET:
+                s3_client.upload_file(str(parquet_path), BROTLI_OUTPUT_BUCKET, f"{BROTLI_OUTPUT_PREFIX}{parquet_path.name}")
+                # Only recorded in the manifest once the upload succeeded
+                parquet_s3_key = f"{BROTLI_OUTPUT_PREFIX}{parquet_path.name}"
+                logger.info("✅ Parquet file uploaded to S3 successfully.")
         except Exception as e:
-            logger.error(f"Error updating Supabase records metadata: {e}", exc_info=True)
-
-
-    # Save comments to CSV file (keeping the original functionality)
-    csv_filename_base = f"reddit_{subreddit_name}_comments_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    csv_filename_path = Path("/tmp") / csv_filename_base # Use /tmp for writable storage
-    temp_br_filename_path = Path("/tmp") / f"{csv_filename_base}.br"
-    
-    # ==== Soila -> Create the parent directory if it doesn't exist ==== #
-    csv_filename_path.parent.mkdir(parents=True, exist_ok=True)
+            logger.error(f"❌ Error writing Parquet copy: {e}", exc_info=True)
 
+    # Inverted label index, so the API filters by emotion, topic and practitioner type without parsing JSON
     try:
-        # Step 1: Write to CSV file (this section is safe as-is)
-        with open(csv_filename_path, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=COMMENT_SCHEMA_KEYS)
-            writer.writeheader()
-            for comment in scraped_data['comments']:
-                row = {}
-                for key in COMMENT_SCHEMA_KEYS:
-                    val = comment.get(key)
-                    if isinstance(val, (dict, list)):
-                        val = json.dumps(val, ensure_ascii=False)
-                    row[key] = val
-                writer.writerow(row)
-        logger.info(f"✅ Comments written to CSV: {csv_filename_path}")
-
-        # Step 2: Attempt to compress the file in its own logical block.
-        # This will prevent dependent operations from being called on failure.
-        try:
-            compressor = BrotliFileCompressor(compression_level=11)
-            stats = compressor.compress_file(str(csv_filename_path), str(temp_br_filename_path))
-            
-            # These lines only run if compression was successful
-            os.remove(csv_filename_path)
-            logger.info(f"💾 Comments saved and Brotli-compressed to: {temp_br_filename_path} "
-                        f"(ratio={stats['compression_ratio']:.2f}:1, "
-                        f"saved={stats['space_saved_percent']:.1f}%)")
-            
-            # Step 3: Attempt to upload the file to S3 in its own logical block.
-            if BROTLI_OUTPUT_BUCKET:
-                output_s3_key = f"{BROTLI_OUTPUT_PREFIX}{temp_br_filename_path.name}"
-                logger.info(f"☁️ Uploading Brotli file to s3://{BROTLI_OUTPUT_BUCKET}/{output_s3_key} ...")
-                s3_client.upload_file(str(temp_br_filename_path), BROTLI_OUTPUT_BUCKET, output_s3_key)
-                logger.info("✅ Brotli file uploaded to S3 successfully.")
-                
-            os.remove(temp_br_filename_path)
+        index_path = sink.path.with_name(label_index.index_name(sink.path.name))
+        labels = label_index.LabelIndex.from_comments(scraped_data['comments'])
+        labels.save(index_path)
+        logger.info(f"🏷️ Label index of {len(labels)} comments written to: {index_path} "
+                    f"({bytes_to_mb(index_path.stat().st_size):.2f} MB)")
+        if BROTLI_OUTPUT_BUCKET:
+            s3_client.upload_file(str(index_path), BROTLI_OUTPUT_BUCKET, f"{BROTLI_OUTPUT_PREFIX}{index_path.name}")
+            index_s3_key = f"{BROTLI_OUTPUT_PREFIX}{index_path.name}"
+            logger.info("✅ Label index uploaded to S3 successfully.")
+    except Exception as e:
+        logger.error(f"❌ Error writing label index: {e}", exc_info=True)
 
+    # Register the uploaded file so the API finds it without listing the bucket
+    if output_s3_key:
+        try:
+            head = s3_client.head_object(Bucket=BROTLI_OUTPUT_BUCKET, Key=output_s3_key)
+            parquet_etag = (s3_client.head_object(Bucket=BROTLI_OUTPUT_BUCKET, Key=parquet_s3_key)["ETag"]
+                            if parquet_s3_key else None)
+            index_etag = (s3_client.head_object(Bucket=BROTLI_OUTPUT_BUCKET, Key=index_s3_key)["ETag"]
+                          if index_s3_key else None)
+            entry = dataset_manifest.file_entry(
+                output_s3_key, scraped_data['subreddit_info']['name'], scraped_data['comments'],
+                etag=head["ETag"], size=head["ContentLength"], parquet_key=parquet_s3_key, parquet_etag=parquet_etag,
+                index_key=index_s3_key, index_etag=index_etag)
+            dataset_manifest.add_files(s3_client, BROTLI_OUTPUT_BUCKET, BROTLI_OUTPUT_PREFIX, [entry])
         except Exception as e:
-            logger.error(f"❌ Error during compression or S3 upload: {e}", exc_info=True)
-            # We don't raise here, so the script can continue to log the summary.
-            # The original CSV file will remain in /tmp for debugging.
+            logger.error(f"❌ Error updating the dataset manifest: {e}", exc_info=True)
 
-    except Exception as e:
-        logger.error(f"❌ Error during initial file writing: {e}", exc_info=True)
-        # This catch is for a fundamental failure to write the initial CSV
-        raise
+    # Without a bucket the local file is the output
+    return output_s3_key is not None or not BROTLI_OUTPUT_BUCKET
+
+def log_subreddit_summary(scraped_data):
+    """Log the scraping summary of a single subreddit."""
+    subreddit_name = scraped_data['subreddit_info']['name']
+    stats = scraped_data['stats']
 
-    # Log summary for this subreddit
     logger.info(f"\n--- r/{subreddit_name} Scraping Summary ---")
-    logger.info(f"📄 Posts processed: {posts_processed}")
-    logger.info(f"💬 Total comments collected: {total_comments_collected}")
+    logger.info(f"📄 Posts processed: {stats['posts_processed']}")
+    logger.info(f"💬 Total comments collected: {stats['comments_collected']}")
+    if stats['posts_resumed']:
+        logger.info(f"📍 Posts restored from checkpoint: {stats['posts_resumed']}")
+    if stats['posts_unchanged'] or stats['comments_already_seen']:
+        logger.info(f"💧 Posts unchanged since last scrape: {stats['posts_unchanged']}")
+        logger.info(f"💧 Comments already stored: {stats['comments_already_seen']}")
     logger.info(f"👥 Unique authors found: {len(scraped_data['authors'])}")
-    logger.info(f"⏱️ Scraping time: {format_time(elapsed)}")
-    logger.info(f"⏱️ Extra time waiting for attribute update: {format_time(ai_wait_time)}")
-    if posts_processed > 0:
-        avg_time_per_post = elapsed / posts_processed
+    logger.info(f"⏱️ Scraping time: {format_time(stats['elapsed'])}")
+    if stats['posts_processed'] > 0:
+        avg_time_per_post = stats['elapsed'] / stats['posts_processed']
         logger.info(f"📊 Average time per post: {avg_time_per_post:.2f}s")
+    logger.info(f"💬 Total # of vectorised comments: {stats['comments_vectorised']}")
+    cache_lookups = stats['embedding_cache_hits'] + stats['embedding_cache_misses']
+    if cache_lookups:
+        logger.info(f"♻️ Embedding cache hit rate: {stats['embedding_cache_hits'] / cache_lookups:.1%} "
+                    f"({stats['embedding_cache_hits']}/{cache_lookups})")
+
+async def run_scrape_session(subreddit_names, post_limit, retry_failed=True, rate_limiter=None, incremental=False,
+                             checkpoint=None, progress=None):
+    """
+    Scrape several subreddits concurrently in a single Reddit session.
 
-    logger.info(f"🖥️ Memory usage: {bytes_to_mb(mem_after - mem_before):.1f} MB")
-    logger.info(f"🔄 API calls made: {global_api_call_count}")
+    All subreddits share the asyncpraw client, the Reddit rate-limit budget,
+    one pool of analysis workers and one memory monitor. The workers stream
+    analysed comments into each subreddit's .csv.br sink; the files are
+    finished and uploaded once every worker has drained the queue.
 
-    logger.info("\n==== 🧠 Memory Usage (Vectorisation Edition) ====")
-    logger.info(f"🔥 Average Memory Usage: {avg_mem_usage:.2f} MB")
-    logger.info(f"💥 Peak Memory Usage: {peak_mem_usage:.2f} MB")
-    logger.info(f"💬 Total # of vectorised comments: {total_comments_vectorised}")
+    Args:
+        subreddit_names (list[str]): Subreddits to scrape
+        post_limit (int): Number of posts to process per subreddit
+        retry_failed (bool): Retry a subreddit once if it fails or yields no comments
+        rate_limiter (RedditRateLimiter): Limiter to draw Reddit calls from; a fresh one is created if omitted
+        incremental (bool): Only fetch, analyse and embed comments newer than the stored watermarks
+        checkpoint (ScrapeCheckpoint): Written every CHECKPOINT_INTERVAL seconds and used to
+            skip work a previous run already finished; None disables checkpointing
+        progress (ScrapeProgress): Updated with the phase and counters as the session runs
 
-    return scraped_data
+    Returns:
+        dict: Mapping of subreddit name to its scraped data (None for final failures)
+    """
+    set_ca_bundle()
+    comment_sink.clear_output_dir()
+
+    if progress is None:
+        progress = ScrapeProgress(subreddit_names, post_limit)
+    progress.set_phase("scraping")
+
+    # One analysis pool for the whole session, writing to the sink of each comment's subreddit
+    sinks = {}
+    analyze_queue, worker_threads = start_workers(NUM_ANALYSIS_WORKERS, {'sinks': sinks, 'progress': progress})
+
+    # Memory is sampled on a background thread for the whole session, tagged by stage
+    monitor = ResourceMonitor(log_interval=MEMORY_LOG_INTERVAL).start()
+    stop_event = asyncio.Event()
+
+    mem_before = monitor.current_mb()
+    logger.info(f"[VECTORISE] Initial memory usage: {mem_before:.2f} MB")
+    start_time = time.time()
 
-async def scrape_comments_async(subreddit_list, post_limit=1000):
+    if rate_limiter is None:
+        rate_limiter = RedditRateLimiter(limit=REDDIT_API_LIMIT, period=COOLDOWN)
+
+    scrape = scrape_subreddit_with_retry if retry_failed else scrape_subreddit
+    async with create_reddit_client() as reddit:
+        rate_limiter.attach(reddit)
+        session = {
+            'reddit': reddit,
+            'rate_limiter': rate_limiter,
+            'analyze_queue': analyze_queue,
+            'sinks': sinks,
+            'monitor': monitor,
+            'incremental': incremental,
+            'checkpoint': checkpoint,
+            'progress': progress,
+            'scraped': {},
+        }
+        checkpoint_task = asyncio.create_task(checkpoint_periodically(session, stop_event)) if checkpoint else None
+        results = await asyncio.gather(*(
+            scrape(session, name, post_limit)
+            for name in subreddit_names
+        ))
+
+    stop_event.set()
+    end_time = time.time()
+
+    if checkpoint_task:
+        await checkpoint_task
+    mem_after = monitor.current_mb()
+
+    # Finish scraping
+    progress.set_phase("analysing")
+    logger.info("[scraper] Sending None flag to analysis workers")
+    # Send shutdown signals (one None per worker)
+    for _ in range(NUM_ANALYSIS_WORKERS):
+        analyze_queue.put(None)
+
+    # Wait for all threads to finish, off the event loop so progress polls keep being answered
+    with monitor.stage("analyse"):
+        for t in worker_threads:
+            await asyncio.to_thread(t.join)
+    logger.info("All analysis workers finished.")
+    ai_wait_time = time.time() - end_time
+
+    # Everything is analysed now; a crash while saving can resume straight to the save step
+    if checkpoint:
+        await write_checkpoint(session)
+
+    progress.set_phase("saving")
+    all_saved = True
+    for scraped_data in results:
+        saved = True
+        if scraped_data and scraped_data['stats']['comments_collected']:
+            with monitor.stage("save"):
+                saved = await asyncio.to_thread(save_scraped_subreddit, scraped_data)
+            all_saved &= saved
+        elif scraped_data:
+            discard_comment_sink(scraped_data)
+        if scraped_data:
+            # Watermarks move only after the comments they cover have been saved
+            if saved:
+                scrape_watermarks.save_watermark(s3_client, BROTLI_OUTPUT_BUCKET, BROTLI_OUTPUT_PREFIX, scraped_data['watermark'])
+            log_subreddit_summary(scraped_data)
+
+    if checkpoint and all_saved:
+        checkpoint.delete()
+    elif checkpoint:
+        logger.warning(f"📍 Keeping checkpoint {checkpoint.token}: not every file was uploaded. "
+                       f"Resume with the same resume_token to save them again.")
+    monitor.stop()
+
+    logger.info(f"⏱️ Session scraping time: {format_time(end_time - start_time)}")
+    logger.info(f"⏱️ Extra time waiting for attribute update: {format_time(ai_wait_time)}")
+    logger.info(f"🖥️ Memory usage: {mem_after - mem_before:.1f} MB")
+    logger.info(f"🔄 API calls made: {rate_limiter.total_calls}")
+
+    monitor.log_summary("Memory Usage (Vectorisation Edition)")
+
+    return dict(zip(subreddit_names, results))
+
+async def scrape_comments(subreddit_name, post_limit):
     """
-    Scrape comments from multiple subreddits sequentially.
+    Scrape comments from a specific subreddit with complete data for database storage.
+
+    Args:
+        subreddit_name (str): Name of the subreddit to scrape
+        post_limit (int): Number of posts to process
+
+    Returns:
+        dict: Dictionary containing posts, authors, and comments data
+    """
+    # Clear vector db before scraping comments
+    # Standalone runs clear here; multi-subreddit runs clear once in scrape_comments_async.
+    vectorise_comment.clear_vector_db(supabase)
+
+    subreddit_name = subreddit_name.lower()
+    results = await run_scrape_session([subreddit_name], post_limit, retry_failed=False)
+    return results[subreddit_name]
+
+def find_checkpoint(resume_token):
+    """Return the checkpoint stored under resume_token, or None if there is none."""
+    return ScrapeCheckpoint.load(s3_client, BROTLI_OUTPUT_BUCKET, BROTLI_OUTPUT_PREFIX, resume_token)
+
+async def scrape_comments_async(subreddit_list, post_limit=1000, rate_limiter=None, incremental=False,
+                                resume_token=None, progress=None):
+    """
+    Scrape comments from multiple subreddits concurrently in one Reddit session.
+    All subreddits draw from the same rate limiter; pass one in to share it across runs.
+
+    With incremental=True the vector database is kept and only comments newer than
+    each subreddit's watermark are fetched, analysed, embedded and saved.
+
+    If a checkpoint exists for resume_token the run continues from it, reusing its
+    subreddits, post limit and mode; otherwise a new run is checkpointed under that
+    token (or a generated one). The token is returned as 'resume_token'.
     """
-    global reddit_call_count, reddit_window_start, global_api_call_count
     global supabase
 
+    checkpoint = find_checkpoint(resume_token) if resume_token else None
+    if checkpoint:
+        logger.info(f"📍 Resuming scrape {resume_token}")
+        subreddit_list = checkpoint.subreddits
+        post_limit = checkpoint.post_limit
+        incremental = checkpoint.incremental
+
+    if not isinstance(subreddit_list, list) or len(subreddit_list) == 0:
+        raise ValueError("subreddit_list must be a non-empty list of strings.")
+    if not isinstance(post_limit, int) or post_limit < 1 or post_limit > 1000:
+        raise ValueError("post_limit must be an integer between 1 and 1000.")
+
     # Re-initialize Supabase client if it's None (can happen if env vars aren't ready at global init)
     if supabase is None:
         url: str = os.getenv("VECTORDB_URL")
         key: str = os.getenv("VECTORDB_API_KEY")
         supabase = create_client(url, key)
 
-    if supabase:
+    # A resumed run keeps the vectors its earlier attempt inserted
+    if supabase and not incremental and checkpoint is None:
         try:
-            vectorise_comment.clear_vector_db(supabase)
+            await asyncio.to_thread(vectorise_comment.clear_vector_db, supabase)
             logger.info("✅ Vector database cleared at start of scraping run.")
         except Exception as e:
             logger.error(f"Error clearing vector DB at start of async run: {e}", exc_info=True)
 
-
-    if not isinstance(subreddit_list, list) or len(subreddit_list) == 0:
-        raise ValueError("subreddit_list must be a non-empty list of strings.")
-    if not isinstance(post_limit, int) or post_limit < 1 or post_limit > 1000:
-        raise ValueError("post_limit must be an integer between 1 and 1000.")
-
-    subreddit_queue = deque([sub.lower().strip() for sub in subreddit_list])
-    aggregated_results = { 'subreddits': set(), 'authors': set(), 'posts': {}, 'comments': [] }
-    failed_subreddits = {}
+    # Drop duplicates while keeping the requested order
+    subreddit_names = list(dict.fromkeys(sub.lower().strip() for sub in subreddit_list))
+    aggregated_results = { 'subreddits': set(), 'authors': set(), 'posts': {}, 'comments': [], 'comment_counts': {},
+                           'embedding_cache': {'hits': 0, 'misses': 0, 'hit_rate': 0.0} }
     
-    logger.info(f"🚀 Starting scrape for {len(subreddit_queue)} subreddit(s): {list(subreddit_queue)}")
+    logger.info(f"🚀 Starting scrape for {len(subreddit_names)} subreddit(s): {subreddit_names}")
     logger.info(f"📊 Post limit per subreddit: {post_limit}")
     overall_start_time = time.time()
 
-    while subreddit_queue:
-        current_subreddit = subreddit_queue.popleft()
-        logger.info(f"\n🎯 Now scraping: r/{current_subreddit}")
-        try:
-            if current_subreddit in failed_subreddits: logger.warning(f"⚠️ Retry attempt for r/{current_subreddit}")
-            scraped_data = await scrape_comments(current_subreddit, post_limit)
-            if scraped_data and scraped_data.get('comments'):
-                aggregated_results['subreddits'].add(current_subreddit)
-                aggregated_results['authors'].update(scraped_data['authors'])
-                aggregated_results['posts'].update(scraped_data['posts'])
-                aggregated_results['comments'].extend(scraped_data['comments'])
-                logger.info(f"✅ Successfully scraped r/{current_subreddit}: {len(scraped_data['comments'])} comments")
-                failed_subreddits.pop(current_subreddit, None)
-            else:
-                logger.warning(f"⚠️ No comments collected for r/{current_subreddit}")
-                if current_subreddit not in failed_subreddits:
-                    failed_subreddits[current_subreddit] = 1
-                    subreddit_queue.append(current_subreddit)
-                    logger.info(f"🔄 Added r/{current_subreddit} back to queue for retry")
-                else: logger.error(f"❌ Final failure for r/{current_subreddit} after retry")
-        except Exception as e:
-            logger.error(f"❌ Error scraping r/{current_subreddit}: {e}", exc_info=True)
-            if current_subreddit not in failed_subreddits:
-                failed_subreddits[current_subreddit] = 1
-                subreddit_queue.append(current_subreddit)
-                logger.info(f"🔄 Added r/{current_subreddit} back to queue for retry")
-            else: logger.error(f"❌ Final failure for r/{current_subreddit} after retry")
-        logger.info(f"✅ Finished processing r/{current_subreddit}")
+    if checkpoint is None:
+        checkpoint = ScrapeCheckpoint(s3_client, BROTLI_OUTPUT_BUCKET, BROTLI_OUTPUT_PREFIX,
+                                      subreddit_names, post_limit, incremental, token=resume_token)
+    aggregated_results['resume_token'] = checkpoint.token
+
+    if rate_limiter is None:
+        rate_limiter = RedditRateLimiter(limit=REDDIT_API_LIMIT, period=COOLDOWN)
+    results = await run_scrape_session(subreddit_names, post_limit, rate_limiter=rate_limiter,
+                                       incremental=incremental, checkpoint=checkpoint, progress=progress)
+
+    # Comments stay in the saved files; 'comments' reads them back one row at a time
+    saved_paths = []
+    embedding_cache = aggregated_results['embedding_cache']
+    for current_subreddit, scraped_data in results.items():
+        if scraped_data:
+            embedding_cache['hits'] += scraped_data['stats']['embedding_cache_hits']
+            embedding_cache['misses'] += scraped_data['stats']['embedding_cache_misses']
+        if scraped_data and scraped_data.get('comments'):
+            aggregated_results['subreddits'].add(current_subreddit)
+            aggregated_results['authors'].update(scraped_data['authors'])
+            aggregated_results['posts'].update(scraped_data['posts'])
+            aggregated_results['comment_counts'][current_subreddit] = len(scraped_data['comments'])
+            saved_paths.extend(scraped_data['comments'].paths)
+    aggregated_results['comments'] = comment_sink.SavedComments(
+        saved_paths, sum(aggregated_results['comment_counts'].values()))
+    cache_lookups = embedding_cache['hits'] + embedding_cache['misses']
+    embedding_cache['hit_rate'] = embedding_cache['hits'] / cache_lookups if cache_lookups else 0.0
 
     overall_end_time = time.time()
     total_elapsed = overall_end_time - overall_start_time
@@ -662,11 +953,12 @@ async def scrape_comments_async(subreddit_list, post_limit=1000):
     logger.info(f"👥 Total unique authors: {len(aggregated_results['authors'])}")
     logger.info(f"📄 Total posts processed: {len(aggregated_results['posts'])}")
     logger.info(f"⏱️ Total scraping time: {format_time(total_elapsed)}")
-    logger.info(f"🔄 Total API calls made: {global_api_call_count}")
+    logger.info(f"🔄 Total API calls made: {rate_limiter.total_calls}")
+    logger.info(f"♻️ Embedding cache hit rate: {embedding_cache['hit_rate']:.1%} "
+                f"({embedding_cache['hits']} hits, {embedding_cache['misses']} misses)")
 
-    for subreddit in aggregated_results['subreddits']:
-        subreddit_comments = [c for c in aggregated_results['comments'] if c['subreddit'] == subreddit]
-        logger.info(f"  📂 r/{subreddit}: {len(subreddit_comments)} comments")
+    for subreddit, count in aggregated_results['comment_counts'].items():
+        logger.info(f"  📂 r/{subreddit}: {count} comments")
 
     return aggregated_results
 
@@ -694,15 +986,18 @@ def lambda_handler(event, context):
         body = json.loads(event['body'])
         subreddits = body.get('subreddits', [])
         post_limit = body.get('post_limit', 100)
+        incremental = bool(body.get('incremental', False))
+        resume_token = body.get('resume_token')
         
         # Call the main scraping logic
-        aggregated_results = asyncio.run(scrape_comments_async(subreddits, post_limit))
+        aggregated_results = asyncio.run(scrape_comments_async(
+            subreddits, post_limit, incremental=incremental, resume_token=resume_token))
         
-        # Prepare the response for API Gateway
+        # Prepare the response for API Gateway; the comments themselves are in the S3 files
         response_body = {
             "status": "success",
             "message": "Scraping completed successfully",
-            "data": aggregated_results
+            "data": {**aggregated_results, "comments": len(aggregated_results['comments'])}
         }
         
         return {
@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+import psutil
+
+logger = logging.getLogger("reddit-scraper-lambda")
+
+# Seconds between RSS samples; psutil.memory_info() is a syscall, so keep this coarse
+DEFAULT_INTERVAL = float(os.getenv("RESOURCE_MONITOR_INTERVAL", "0.5"))
+# Raw samples kept for inspection; older ones only survive in the aggregates
+DEFAULT_HISTORY = int(os.getenv("RESOURCE_MONITOR_HISTORY", "600"))
+
+
+class StreamingStats:
+    """Constant-memory min/avg/max of a stream of values."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self) -> dict:
+        return {'samples': self.count, 'min': self.min or 0.0, 'avg': self.avg, 'max': self.max or 0.0}
+
+
+class ResourceMonitor:
+    """
+    Samples the process RSS (MB) on a background thread at a fixed interval.
+
+    Memory use is bounded: the last `history` samples go into a ring buffer and
+    everything else only updates streaming min/avg/max aggregates, overall and
+    per stage. Code marks what it is doing with `with monitor.stage("embed"):`;
+    each sample is attributed to every stage active at that moment, so
+    overlapping async work (fetching one post while embedding another) is
+    counted under both. Usable as a context manager around sync or async code.
+
+    Args:
+        interval (float): Seconds between samples
+        history (int): Size of the raw sample ring buffer
+        log_interval (float): Log the current RSS this often; None disables it
+        stage (str): Stage active for the monitor's whole lifetime, if any
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, history: int = DEFAULT_HISTORY,
+                 log_interval: float = None, stage: str = None, proc=None):
+        self.interval = interval
+        self.log_interval = log_interval
+        self.proc = proc or psutil.Process()
+        self.samples = deque(maxlen=history)
+        self.overall = StreamingStats()
+        self.stages = {}
+        self._active = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._base_stage = stage
+
+    def current_mb(self) -> float:
+        return self.proc.memory_info().rss / (1024 ** 2)
+
+    def sample(self) -> float:
+        """Take one sample now and fold it into the aggregates."""
+        mem_mb = self.current_mb()
+        with self._lock:
+            active = tuple(name for name, n in self._active.items() if n > 0)
+            self.samples.append((time.time(), mem_mb, active))
+            self.overall.add(mem_mb)
+            for name in active:
+                self.stages.setdefault(name, StreamingStats()).add(mem_mb)
+        return mem_mb
+
+    @contextmanager
+    def stage(self, name: str):
+        """Tag the samples taken while the block runs with `name`."""
+        with self._lock:
+            self._active[name] += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._active[name] -= 1
+
+    def _run(self):
+        last_log = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                mem_mb = self.sample()
+            except psutil.NoSuchProcess:
+                logger.warning("[MEMORY MONITOR] Process not found, stopping.")
+                break
+            except Exception as e:
+                logger.error(f"[MEMORY MONITOR] Error: {e}")
+            else:
+                if self.log_interval and time.monotonic() - last_log >= self.log_interval:
+                    logger.info(f"[MEMORY MONITOR] Current memory: {mem_mb:.2f} MB")
+                    last_log = time.monotonic()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._base_stage:
+            with self._lock:
+                self._active[self._base_stage] += 1
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="resource-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling; one last sample makes sure short runs are never empty."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.sample()
+        except Exception:
+            pass
+        if self._base_stage:
+            with self._lock:
+                self._active[self._base_stage] -= 1
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                'overall': self.overall.to_dict(),
+                'stages': {name: stats.to_dict() for name, stats in self.stages.items()},
+            }
+
+    def log_summary(self, title: str = "Memory Usage"):
+        summary = self.summary()
+        overall = summary['overall']
+        logger.info(f"\n==== 🧠 {title} ====")
+        logger.info(f"🔥 Average Memory Usage: {overall['avg']:.2f} MB")
+        logger.info(f"💥 Peak Memory Usage: {overall['max']:.2f} MB")
+        for name, stats in sorted(summary['stages'].items()):
+            logger.info(f"  🏷️ {name}: avg {stats['avg']:.2f} MB, peak {stats['max']:.2f} MB "
+                        f"({stats['samples']} samples)")
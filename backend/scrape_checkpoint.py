@@ -0,0 +1,160 @@
+import json
+import logging
+import re
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger("reddit-scraper-lambda")
+
+# Local copies live next to the other scraper artefacts in /tmp
+LOCAL_CHECKPOINT_DIR = Path("/tmp") / "checkpoints"
+
+# Tokens end up in file names and S3 keys, so keep them to a safe alphabet
+RESUME_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+def is_valid_resume_token(token) -> bool:
+    return isinstance(token, str) and bool(RESUME_TOKEN_RE.match(token))
+
+
+class ScrapeCheckpoint:
+    """
+    Periodic snapshot of a scraping session so a timed-out run can pick up where it stopped.
+
+    For every subreddit the checkpoint keeps the processed post ids, the posts and
+    authors, the comments still waiting for analysis, the ids of comments that were
+    already vectorised, the comments queued for embedding but not inserted, and the
+    incremental watermark. The analysed comments are not in the JSON: a copy of
+    the partially written .csv.br is stored next to it.
+    Everything is written to /tmp and, when a bucket is configured, to S3 under
+    {prefix}checkpoints/{token}.json and {prefix}checkpoints/{token}/{subreddit}.csv.br.
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str, subreddits: list, post_limit: int,
+                 incremental: bool = False, token: str = None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.token = token or uuid.uuid4().hex
+        self.subreddits = subreddits
+        self.post_limit = post_limit
+        self.incremental = incremental
+        self.subreddit_state = {}
+
+    @property
+    def key(self) -> str:
+        return f"{self.prefix}checkpoints/{self.token}.json"
+
+    @property
+    def local_path(self) -> Path:
+        return LOCAL_CHECKPOINT_DIR / f"{self.token}.json"
+
+    def part_key(self, subreddit: str) -> str:
+        return f"{self.prefix}checkpoints/{self.token}/{subreddit}.csv.br"
+
+    def part_path(self, subreddit: str) -> Path:
+        return LOCAL_CHECKPOINT_DIR / f"{self.token}_{subreddit}.csv.br"
+
+    @classmethod
+    def load(cls, s3_client, bucket: str, prefix: str, token: str):
+        """
+        Load the checkpoint stored under a resume token.
+
+        Returns:
+            ScrapeCheckpoint or None: None when no checkpoint exists for the token
+        """
+        checkpoint = cls(s3_client, bucket, prefix, [], 0, token=token)
+        try:
+            if checkpoint.local_path.exists():
+                # A warm container still has its own copy; skip the S3 round trip
+                data = json.loads(checkpoint.local_path.read_text(encoding="utf-8"))
+            elif bucket:
+                obj = s3_client.get_object(Bucket=bucket, Key=checkpoint.key)
+                data = json.loads(obj["Body"].read())
+            else:
+                return None
+        except s3_client.exceptions.NoSuchKey:
+            return None
+
+        checkpoint.subreddits = data['subreddits']
+        checkpoint.post_limit = data['post_limit']
+        checkpoint.incremental = data.get('incremental', False)
+        checkpoint.subreddit_state = data.get('subreddit_state', {})
+        logger.info(f"📍 Loaded checkpoint {token} for {checkpoint.subreddits}")
+        return checkpoint
+
+    def state_for(self, subreddit: str):
+        """Saved state of a subreddit, or None if the checkpoint has nothing for it."""
+        return self.subreddit_state.get(subreddit)
+
+    def fetch_part(self, subreddit: str) -> Path:
+        """Local path of the subreddit's partial .csv.br, downloading it from S3 if needed."""
+        path = self.part_path(subreddit)
+        if not path.exists() and self.bucket:
+            LOCAL_CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
+            self.s3_client.download_file(self.bucket, self.part_key(subreddit), str(path))
+        return path
+
+    def snapshot(self, scraped_by_subreddit: dict, comment_keys: list) -> str:
+        """
+        Serialise the current session state.
+
+        Runs on the event loop so the scrape tasks cannot change the collections
+        mid-way; the comment sink is paused while its file is copied, and only the
+        fixed `comment_keys` are read from pending comments.
+        """
+        LOCAL_CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
+        for name, scraped_data in scraped_by_subreddit.items():
+            rows_written, pending = scraped_data['sink'].checkpoint(self.part_path(name), comment_keys)
+            self.subreddit_state[name] = {
+                'processed_post_ids': list(scraped_data['processed_post_ids']),
+                'posts': dict(scraped_data['posts']),
+                'authors': list(scraped_data['authors']),
+                'rows_written': rows_written,
+                'pending_comments': pending,
+                'vectorised_ids': list(scraped_data['vectorised_ids']),
+                'embedding_backlog': list(scraped_data['unvectorised'].values()),
+                'watermark': scraped_data['watermark'],
+            }
+
+        return json.dumps({
+            'resume_token': self.token,
+            'subreddits': self.subreddits,
+            'post_limit': self.post_limit,
+            'incremental': self.incremental,
+            'updated_at': datetime.utcnow().isoformat() + "+00:00",
+            'subreddit_state': self.subreddit_state,
+        }, default=str)
+
+    def save(self, body: str):
+        """Write a snapshot produced by snapshot() to /tmp and S3. Safe to call from a thread."""
+        try:
+            LOCAL_CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
+            self.local_path.write_text(body, encoding="utf-8")
+            if self.bucket:
+                # Upload the CSV parts first so the JSON never points at missing rows
+                for subreddit in self.subreddit_state:
+                    self.s3_client.upload_file(str(self.part_path(subreddit)), self.bucket, self.part_key(subreddit))
+                self.s3_client.put_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Body=body.encode("utf-8"),
+                    ContentType="application/json"
+                )
+            logger.info(f"📍 Checkpoint {self.token} saved ({len(body) / 1024:.1f} KB)")
+        except Exception as e:
+            logger.error(f"Error saving checkpoint {self.token}: {e}", exc_info=True)
+
+    def delete(self):
+        """Remove the checkpoint once the run it covers has been fully saved."""
+        try:
+            self.local_path.unlink(missing_ok=True)
+            for subreddit in self.subreddit_state:
+                self.part_path(subreddit).unlink(missing_ok=True)
+            if self.bucket:
+                self.s3_client.delete_object(Bucket=self.bucket, Key=self.key)
+                for subreddit in self.subreddit_state:
+                    self.s3_client.delete_object(Bucket=self.bucket, Key=self.part_key(subreddit))
+        except Exception as e:
+            logger.error(f"Error deleting checkpoint {self.token}: {e}", exc_info=True)
@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger("reddit-scraper-lambda")
+
+# Finished jobs kept around for polling before the oldest ones are dropped
+MAX_FINISHED_JOBS = 50
+# Seconds between saves of a running job's record; the saves double as its heartbeat
+JOB_SAVE_INTERVAL = float(os.getenv("SCRAPE_JOB_SAVE_INTERVAL_SECONDS", "5"))
+# A running job whose record has not been saved for this long is reported as failed
+JOB_STALE_SECONDS = float(os.getenv("SCRAPE_JOB_STALE_SECONDS", "120"))
+# How long a dispatched job may wait for its worker; Lambda's async queue can hold events for minutes
+JOB_QUEUE_TIMEOUT_SECONDS = float(os.getenv("SCRAPE_JOB_QUEUE_TIMEOUT_SECONDS", "900"))
+
+# Job phases, in the order a scrape goes through them
+PHASES = ["queued", "clearing", "scraping", "analysing", "saving", "storing", "done"]
+FAILED = "failed"
+
+
+class ScrapeProgress:
+    """
+    Live progress of one scraping run.
+
+    The scraper, the analysis worker threads and the API route all update the
+    same instance, so counters are changed under a lock. `snapshot()` returns a
+    JSON-ready dict including an ETA extrapolated from the post rate so far.
+    """
+
+    def __init__(self, subreddits: list = None, post_limit: int = 0):
+        self._lock = threading.Lock()
+        self.phase = "queued"
+        self.subreddits = list(subreddits or [])
+        self.posts_total = post_limit * len(self.subreddits)
+        self.posts_done = 0
+        self.comments_collected = 0
+        self.comments_analysed = 0
+        self.vectors_inserted = 0
+        self.started_at = time.time()
+        self.scraping_started_at = None
+        self.finished_at = None
+        self.error = None
+
+    def set_phase(self, phase: str):
+        with self._lock:
+            self.phase = phase
+            if phase == "scraping" and self.scraping_started_at is None:
+                self.scraping_started_at = time.time()
+            if phase in ("done", FAILED):
+                self.finished_at = time.time()
+        logger.info(f"🚦 Scrape phase: {phase}")
+
+    def add(self, **counts):
+        """Increment counters, e.g. add(posts_done=1, comments_collected=12)."""
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def fail(self, error: str):
+        with self._lock:
+            self.error = error
+        self.set_phase(FAILED)
+
+    def eta_seconds(self):
+        """Seconds left for the scraping phase, or None until there is a rate to go by."""
+        if self.phase in ("done", FAILED):
+            return 0
+        if not self.scraping_started_at or not self.posts_done or self.phase != "scraping":
+            return None
+        elapsed = time.time() - self.scraping_started_at
+        remaining_posts = max(self.posts_total - self.posts_done, 0)
+        return round(elapsed / self.posts_done * remaining_posts)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'phase': self.phase,
+                'subreddits': self.subreddits,
+                'posts_total': self.posts_total,
+                'posts_done': self.posts_done,
+                'comments_collected': self.comments_collected,
+                'comments_analysed': self.comments_analysed,
+                'vectors_inserted': self.vectors_inserted,
+                'elapsed_seconds': round((self.finished_at or time.time()) - self.started_at),
+                'eta_seconds': self.eta_seconds(),
+                'error': self.error,
+            }
+
+
+class ScrapeJob:
+    """A scrape running in the background, in this process or in a worker invocation."""
+
+    def __init__(self, subreddits: list, post_limit: int, job_id: str = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.progress = ScrapeProgress(subreddits, post_limit)
+        self.result = None
+        self.task = None
+
+    @property
+    def finished(self) -> bool:
+        return self.progress.phase in ("done", FAILED)
+
+    def to_dict(self) -> dict:
+        return {'job_id': self.id, **self.progress.snapshot(), 'result': self.result}
+
+
+# job id -> ScrapeJob run by this process, oldest first
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def register_job(job: ScrapeJob) -> Optional[str]:
+    """
+    Register a job run by this process, dropping the oldest finished ones beyond MAX_FINISHED_JOBS.
+
+    Returns:
+        str or None: Id of the job still running in this process, in which case job is not registered
+    """
+    with _jobs_lock:
+        active = running_job()
+        if active is not None:
+            return active.id
+        _jobs[job.id] = job
+        finished = [job_id for job_id, j in _jobs.items() if j.finished]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del _jobs[job_id]
+    return None
+
+
+def get_job(job_id: str):
+    return _jobs.get(job_id)
+
+
+def running_job():
+    """The job of this process that is still in progress, if any."""
+    return next((job for job in _jobs.values() if not job.finished), None)
+
+
+def _error_code(e: ClientError) -> str:
+    return str(e.response.get('Error', {}).get('Code'))
+
+
+class JobStore:
+    """
+    Job records shared by every container of the API.
+
+    Each job's snapshot is kept in S3 under {prefix}scrape_jobs/{job_id}.json, so
+    /jobs/{job_id} can be answered wherever the poll lands, and
+    {prefix}scrape_jobs/active.json names the one job allowed to run at a time.
+    A record that stops being saved while running belongs to a worker that died;
+    it is reported as failed and no longer holds the lock. Without a bucket only
+    the jobs of this process are known.
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, job_id: str) -> str:
+        return f"{self.prefix}scrape_jobs/{job_id}.json"
+
+    @property
+    def active_key(self) -> str:
+        return f"{self.prefix}scrape_jobs/active.json"
+
+    def save(self, job: ScrapeJob):
+        """Write the job's snapshot. Errors are logged; the job keeps running."""
+        if not self.bucket:
+            return
+        try:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self.key(job.id),
+                Body=json.dumps({**job.to_dict(), 'updated_at': time.time()}, default=str).encode("utf-8"),
+                ContentType="application/json",
+            )
+        except Exception as e:
+            logger.error(f"Could not save scrape job {job.id}: {e}", exc_info=True)
+
+    def load(self, job_id: str, raw: bool = False) -> Optional[dict]:
+        """
+        The job's last snapshot, or None when there is no such job.
+
+        Args:
+            job_id (str): Id of the job
+            raw (bool): Return the phase as stored, without reporting a stale job as failed
+        """
+        if not self.bucket:
+            return None
+        try:
+            obj = self.s3_client.get_object(Bucket=self.bucket, Key=self.key(job_id))
+        except ClientError as e:
+            if _error_code(e) in ('NoSuchKey', '404'):
+                return None
+            raise
+        record = json.loads(obj["Body"].read())
+        updated_at = record.pop('updated_at', 0)
+        if raw or record['phase'] in ("done", FAILED):
+            return record
+        # A queued job has no worker saving it yet, only the dispatch
+        queued = record['phase'] == "queued"
+        if time.time() - updated_at > (JOB_QUEUE_TIMEOUT_SECONDS if queued else JOB_STALE_SECONDS):
+            record.update(phase=FAILED, eta_seconds=0,
+                          error=("The scrape worker never started" if queued else "The scrape worker stopped")
+                          + "; send the same resume_token to continue")
+        return record
+
+    def claim(self, job: ScrapeJob) -> Optional[str]:
+        """
+        Take the run lock for job with conditional writes, unless another job holds it.
+
+        Returns:
+            str or None: Id of the job still running, in which case job did not get the lock
+        """
+        if not self.bucket:
+            return register_job(job)
+        body = json.dumps({'job_id': job.id}).encode("utf-8")
+        holder = None
+        for _ in range(3):
+            try:
+                self.s3_client.put_object(Bucket=self.bucket, Key=self.active_key, Body=body, IfNoneMatch='*')
+                return None
+            except ClientError as e:
+                if _error_code(e) not in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                    raise
+            try:
+                obj = self.s3_client.get_object(Bucket=self.bucket, Key=self.active_key)
+            except ClientError as e:
+                if _error_code(e) in ('NoSuchKey', '404'):
+                    continue
+                raise
+            holder = json.loads(obj["Body"].read())['job_id']
+            record = self.load(holder)
+            if record is not None and record['phase'] not in ("done", FAILED):
+                return holder
+            # The holder finished or died without releasing the lock
+            try:
+                self.s3_client.put_object(Bucket=self.bucket, Key=self.active_key, Body=body, IfMatch=obj["ETag"])
+                return None
+            except ClientError as e:
+                if _error_code(e) not in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                    raise
+        return holder
+
+    def release(self, job: ScrapeJob):
+        """Drop the run lock if job still holds it. Errors are logged; a stale lock is taken over later."""
+        if not self.bucket:
+            return
+        try:
+            obj = self.s3_client.get_object(Bucket=self.bucket, Key=self.active_key)
+            if json.loads(obj["Body"].read()).get('job_id') == job.id:
+                self.s3_client.delete_object(Bucket=self.bucket, Key=self.active_key)
+        except ClientError as e:
+            if _error_code(e) not in ('NoSuchKey', '404'):
+                logger.error(f"Could not release the scrape lock of job {job.id}: {e}", exc_info=True)
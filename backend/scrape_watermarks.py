@@ -0,0 +1,88 @@
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger("reddit-scraper-lambda")
+
+# Local copies live next to the other scraper artefacts in /tmp
+LOCAL_WATERMARK_DIR = Path("/tmp") / "watermarks"
+
+
+def watermark_key(prefix: str, subreddit: str) -> str:
+    """S3 key of the watermark object for a subreddit."""
+    return f"{prefix}watermarks/{subreddit}.json"
+
+
+def new_watermark(subreddit: str) -> dict:
+    """Return an empty watermark; every post and comment counts as new."""
+    return {
+        'subreddit': subreddit,
+        'last_created_utc': 0.0,
+        'updated_at': None,
+        'posts': {},
+    }
+
+
+def load_watermark(s3_client, bucket: str, prefix: str, subreddit: str) -> dict:
+    """
+    Load the high-water mark of the previous scrape of a subreddit.
+
+    Reads the S3 copy when a bucket is configured, otherwise the /tmp copy.
+    Falls back to an empty watermark when neither exists.
+    """
+    try:
+        if bucket:
+            obj = s3_client.get_object(Bucket=bucket, Key=watermark_key(prefix, subreddit))
+            return json.loads(obj["Body"].read())
+        local_path = LOCAL_WATERMARK_DIR / f"{subreddit}.json"
+        if local_path.exists():
+            return json.loads(local_path.read_text(encoding="utf-8"))
+    except s3_client.exceptions.NoSuchKey:
+        logger.info(f"No watermark found for r/{subreddit}; scraping everything.")
+    except Exception as e:
+        logger.error(f"Error loading watermark for r/{subreddit}: {e}", exc_info=True)
+    return new_watermark(subreddit)
+
+
+def save_watermark(s3_client, bucket: str, prefix: str, watermark: dict):
+    """Persist a watermark to /tmp and, when a bucket is configured, to S3."""
+    subreddit = watermark['subreddit']
+    watermark['updated_at'] = datetime.utcnow().isoformat() + "+00:00"
+    body = json.dumps(watermark)
+
+    try:
+        LOCAL_WATERMARK_DIR.mkdir(parents=True, exist_ok=True)
+        (LOCAL_WATERMARK_DIR / f"{subreddit}.json").write_text(body, encoding="utf-8")
+        if bucket:
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=watermark_key(prefix, subreddit),
+                Body=body.encode("utf-8"),
+                ContentType="application/json"
+            )
+        logger.info(f"💧 Saved watermark for r/{subreddit} ({len(watermark['posts'])} posts)")
+    except Exception as e:
+        logger.error(f"Error saving watermark for r/{subreddit}: {e}", exc_info=True)
+
+
+def has_new_comments(watermark: dict, post_id: str, num_comments: int) -> bool:
+    """A post needs fetching unless it was seen before with the same comment count."""
+    post = watermark['posts'].get(post_id)
+    return post is None or post.get('num_comments') != num_comments
+
+
+def seen_comment_ids(watermark: dict, post_id: str) -> set:
+    """Ids of the comments of a post that earlier scrapes already stored."""
+    post = watermark['posts'].get(post_id)
+    return set(post['comment_ids']) if post else set()
+
+
+def record_post(watermark: dict, post_id: str, num_comments: int, comment_ids: list, last_created_utc: float):
+    """Merge the comments fetched for a post into the watermark."""
+    post = watermark['posts'].setdefault(post_id, {'comment_ids': [], 'last_created_utc': 0.0})
+    known = set(post['comment_ids'])
+    post['comment_ids'].extend(cid for cid in comment_ids if cid not in known)
+    post['num_comments'] = num_comments
+    post['last_created_utc'] = max(post['last_created_utc'], last_created_utc)
+    watermark['last_created_utc'] = max(watermark['last_created_utc'], last_created_utc)
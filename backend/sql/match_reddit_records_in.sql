@@ -0,0 +1,30 @@
+-- Exact top match_count of a given set of comments by cosine similarity.
+--
+-- Variant of match_reddit_records for query_db.similarity_search(candidate_ids=...):
+-- the ids have already passed every metadata filter, so the only restriction is
+-- id = any(id_filter), applied before the ORDER BY / LIMIT. The candidates are
+-- materialized first so the planner cannot answer the ORDER BY from the ivfflat
+-- index and drop candidates outside the probed lists; the ranking is exact.
+--
+-- Apply in the Supabase SQL editor (or with psql) next to match_reddit_records.
+
+create or replace function match_reddit_records_in(
+  query_embedding vector(384),
+  match_threshold float,
+  match_count int,
+  id_filter text[]
+)
+returns table (id text, similarity float)
+language sql stable
+as $$
+  with candidates as materialized (
+    select r.id, r.embedding
+    from reddit_records r
+    where r.id = any(id_filter)
+  )
+  select c.id, 1 - (c.embedding <=> query_embedding) as similarity
+  from candidates c
+  where 1 - (c.embedding <=> query_embedding) >= match_threshold
+  order by c.embedding <=> query_embedding
+  limit match_count;
+$$;
@@ -1,11 +1,12 @@
-import brotli
+import numpy as np
 import pandas as pd
-import json
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Dict, List, Any
+from pydantic import BaseModel
 from . import brotli_compression 
 from . import query_db
 from .models import FilterRequest
+from .label_index import LabelIndex, SOURCE_COLUMNS
     
 # Define constants for vectorisation
 TOP_N = 200           # return the top N comments matching target query
@@ -47,9 +48,17 @@ def load_compressed_txt_(br_file_path: str, output_file_path):
     except Exception as e:
         print(f"Error occured during decompression: {e}")
 
+# String representations of a missing value
+NULL_VALUES = ['', 'null', 'NULL', 'None', 'NaN', 'nan']
+
+
 def normalize_null_values(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Normalize various null representations to proper None/NaN values.
+    Normalize various null representations to NaN, in place.
+
+    Runs once when a file is loaded, not per filter request: read_csv already maps
+    NULL_VALUES while parsing (see read_csv_kwargs), so this only has to catch
+    whitespace-only strings and values that did not come from a CSV.
 
     Args:
         df (pd.DataFrame): Input DataFrame
@@ -57,243 +66,205 @@ def normalize_null_values(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: DataFrame with normalized null values
     """
-    # Replace various null representations with None
-    null_values = ['', 'null', 'NULL', 'None', 'NaN', 'nan']
+    # Text columns are object on pandas 2 and the str / StringDtype dtype on pandas 3
+    text_columns = [col for col, dtype in df.dtypes.items()
+                    if pd.api.types.is_object_dtype(dtype) or isinstance(dtype, pd.StringDtype)]
+    for col in text_columns:
+        values = df[col]
+        null = values.isin(NULL_VALUES)
+        try:
+            # Non-strings and missing values strip to NA, which does not count as blank
+            null |= values.str.strip().eq('').to_numpy(dtype=bool, na_value=False)
+        except AttributeError:
+            # .str refuses object columns that hold no strings at all
+            pass
+        if null.any():
+            df[col] = values.mask(null)
 
-    for col in df.columns:
-        # Replace string representations of null with actual None
-        df[col] = df[col].replace(null_values, None)
+    return df
 
-        # Convert empty strings to None for string columns
-        if df[col].dtype == 'object':
-            df[col] = df[col].apply(
-                lambda x: None if pd.isna(x) or (isinstance(x, str) and x.strip() == '') else x)
 
-    return df
+def read_csv_kwargs() -> dict:
+    """pd.read_csv arguments that turn exactly NULL_VALUES into NaN while parsing."""
+    return {'na_values': NULL_VALUES, 'keep_default_na': False}
+
+# ---- Vectorised filtering ----
+# Label filters (emotions, topics, practitioner types) run on a label_index.LabelIndex
+# of the frame's rows. The time filter runs on a parsed timestamp column named
+# CREATED_AT, which travels with the frame (through the frame cache and pd.concat)
+# and is dropped from the filter output. Each filter is a boolean mask over the rows.
+DERIVED_PREFIX = "_filter."
+CREATED_AT = DERIVED_PREFIX + "created_at"
+
+FEATURE_PAGES = [
+    'desire_and_wish',
+    'trigger_phrase',
+    'metaphors',
+    'question',
+    'practitioner_reference',
+    'painpointsxfrustrations',
+    'failed_solutions'
+]
+
+TIME_BOUNDS = {
+    "past_day": timedelta(days=1),
+    "past_week": timedelta(weeks=1),
+    "past_month": timedelta(days=30),
+    "past_year": timedelta(days=365)
+}
+
+
+def prepare_filter_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the typed columns the filters run on; a no-op for frames that already have them.
+    Call it when a file is loaded so cached frames are parsed only once.
 
-def _check_emotion_filter(df_row, filter_criteria):
+    Args:
+        df (pd.DataFrame): Comments with the scraped CSV columns
 
-    try:
-        # Access the values of the row
-        raw = df_row.get('emotions', '{}')
+    Returns:
+        pd.DataFrame: The comments plus the DERIVED_PREFIX columns
+    """
+    if CREATED_AT in df.columns:
+        return df
+    created = df['created_utc'] if 'created_utc' in df.columns else pd.Series([None] * len(df), index=df.index)
+    # Scraped timestamps carry +00:00; naive ones are taken as UTC
+    derived = pd.DataFrame({
+        CREATED_AT: pd.to_datetime(created, errors='coerce', utc=True, format='ISO8601'),
+    }, index=df.index)
+    return pd.concat([df, derived], axis=1)
 
-        try:
-            # Access the value associated with the 'emotions' column in the row
-            emotions_dict = json.loads(raw) if isinstance(raw, str) else (raw or {})
-        except(json.JSONDecodeError) as e:
-            print(f"Error occurred when parsing {raw}: {e}")
-            return False
-
-        # Normalize the keys and values in  'emotions' dictionary
-        normalized_dict = {k.lower(): float(v) for k, v in emotions_dict.items() if v is not None}
-
-        # Case 1: List of the emotion labels e.g. ["sad", "anger", "frustration"]
-        if isinstance(filter_criteria, list):
-            return any(e.lower() in normalized_dict for e in filter_criteria)
-        
-        # Case 2: Dictionary of List of emotions labels, assigned to key 'emotions'
-        # and the threshold score, assigned to the key 'intensity score'
-        # E.g. { "emotions": ["sad", "anger", "frustration"], intensity_score: 0.7 }
-        elif isinstance(filter_criteria, dict):
-            emotion_targets = [e.lower() for e in filter_criteria.get('emotions', [])] 
-            min_thr = float(filter_criteria.get('min_intensity', 0.0))
-            return all((e in normalized_dict) and (normalized_dict[e] >= min_thr) for e in emotion_targets)            
-    except (json.JSONDecodeError, ValueError, TypeError) as e:
-        print(f"Error occured when filtering row {df_row} by emotion: {e}")
-        return False
-    
-def _check_topic_filter(df_row, filter_criteria):
 
-    try:
+def _emotion_mask(labels: LabelIndex, emotions: List[str], min_intensity=None) -> np.ndarray:
+    """
+    Without min_intensity: rows with any of the emotions. With it: rows where every
+    emotion reaches min_intensity. Rows whose emotions do not parse never match.
+    """
+    if min_intensity is None:
+        return labels.any_mask('emotions', emotions)
+    return labels.all_at_least_mask(emotions, float(min_intensity))
 
-        # Access the raw data in the 'topics' colum of the df_row
-        raw = df_row.get('topics', '{}')
 
-        try:
-            # Access the value associated with the 'topics' column in the row
-            topics_dict = json.loads(raw) if isinstance(raw, str) else (raw or {})
-        except(json.JSONDecodeError) as e:
-            raise Exception(f"Error occured when parsing {raw}: {e}")
-        
-        # Normalize the keys and values in the topics_dict
-        normalized_dict = {k.lower() : float(v) for k,v, in topics_dict.items() if v is not None}
-
-        # If filter_criteria is a List of the topic labels e.g. "["health", "technology", "finance"]", check if that topic exists in the 
-        # topics dictionary returned
-        if isinstance(filter_criteria, list):
-            return any(t.lower() in normalized_dict for t in filter_criteria)
-    except (json.JSONDecodeError, ValueError, TypeError) as e:
-        raise Exception(f"Error occured when filtering row {df_row} by topic: {e}")
-
-def _check_time_filter(df_row, filter_criteria):
+def _time_mask(df: pd.DataFrame, time_filter: str) -> np.ndarray:
+    """Rows created inside the window; rows without a valid timestamp never match."""
+    since = pd.Timestamp.now(tz='UTC') - TIME_BOUNDS[time_filter]
+    return (df[CREATED_AT] >= since).to_numpy(dtype=bool, copy=True)
 
-    try:
-        # Get and validate the creation date from the row 
-        created_str = df_row.get('created_utc')
-        if not created_str:
-            return False
-
-        creation_date = pd.to_datetime(created_str, errors='coerce')
-        if pd.isna(creation_date):
-            return False
-
-        # get the current time and define a time_bounds dictionary for mapping
-        now = datetime.utcnow()
-        time_bounds = {
-            "past_day" : now - timedelta(days=1),
-            "past_week" : now - timedelta(weeks=1),
-            "past_month" : now - timedelta(days=30),
-            "past_year" : now - timedelta(days=365)
-        }
 
-        # guard clause in case of invalid filter_criteria
-        if filter_criteria not in time_bounds:
-            raise ValueError(f"Invalid time filter: {filter_criteria}")
+def _practitioner_type_mask(labels: LabelIndex, practitioner_types) -> np.ndarray:
+    """Rows whose practitioner type is one of practitioner_types (case-insensitive)."""
+    if not isinstance(practitioner_types, list):
+        return np.zeros(len(labels), dtype=bool)
+    return labels.any_mask('practitioner_types', practitioner_types)
 
-        return creation_date >= time_bounds[filter_criteria]
-    except Exception as e:
-        raise Exception(f"Error occured when filtering by time: {e}")
 
-def _check_practitioner_type_filter(df_row, filter_criteria):
-    # Reference: {"practitioner_type": "doctor", "practitioner_reference": "Doctors are leaving Canada for a reason"}
+def _raise_if_unparsed(df: pd.DataFrame, labels: LabelIndex, mask: np.ndarray, kind: str):
+    # Topic and practitioner JSON that cannot be parsed fails the request rather than the row
+    bad = mask & labels.invalid_mask(kind)
+    if bad.any():
+        source_column = SOURCE_COLUMNS[kind]
+        first = df[source_column].iloc[int(np.flatnonzero(bad)[0])]
+        raise ValueError(f"Could not parse {source_column} of {int(bad.sum())} comment(s), e.g. {first!r}")
 
-    try:
-        # normalise filter criteria into a lowercase list
-        if isinstance(filter_criteria, list):
-            criteria_set = [t.lower() for t in filter_criteria]
-
-            # parse the JSON safely
-            raw = df_row.get('practitioner_reference', '{}')
-
-            try:
-                practitioners_dict = json.loads(raw) if isinstance(raw, str) else (raw or {})
-            except(json.JSONDecodeError) as e:
-                raise Exception(f"Error occured when parsing row {raw}: {e}")
-
-            # Get practitioner_type 
-            practitioner_type = practitioners_dict.get("practitioner_type", "")
-            if not practitioner_type:
-                return False
-            
-            return practitioner_type.lower() in criteria_set
-        else:
-            return False
-    except (json.JSONDecodeError, ValueError, TypeError) as e:
-        raise Exception(f"Error occured when filtering row {df_row} by {filter_criteria}: {e}")
+
+def _as_filter_request(filters) -> FilterRequest:
+    """Accept a FilterRequest, another pydantic model with its fields, or a dict of them."""
+    if isinstance(filters, FilterRequest):
+        return filters
+    if isinstance(filters, BaseModel):
+        filters = filters.dict()
+    # Extra keys such as ExportRequest.data_type are ignored
+    return FilterRequest(**(filters or {}))
 
 def _check_keyword_search_filter(df_filtered, search_criteria, filters):
 
     try:
-        # fetch comment ids relevant to the feature page 
+        # fetch comment ids relevant to the feature page and the other filters
         _by_feature_ids = df_filtered['id'].tolist()
+        if not _by_feature_ids:
+            return df_filtered
 
-        # fetch comments relevant to the search criteria and extract the comment ids
-        comments_by_search = query_db.similarity_search(search_criteria, TOP_N, THRESHOLD, filters)
-        _by_search_ids = [res.get('id') for res in comments_by_search]
-        print(f"# of comments ids returned based on search criteria: {len(_by_search_ids)}")
-
-        # find the intersection of both lists (preferred approach, no results)
-        relevant_ids = list(set(_by_feature_ids) & set(_by_search_ids))
+        # rank only those comments against the search criteria, so the top N are all relevant
+        comments_by_search = query_db.similarity_search(search_criteria, TOP_N, THRESHOLD, filters,
+                                                        candidate_ids=_by_feature_ids)
+        relevant_ids = [res.get('id') for res in comments_by_search]
         print(f"# of relevant comments: {len(relevant_ids)}")
 
         # filter the rows that match the search criteria
-        df_filtered = df_filtered[df_filtered['id'].isin(relevant_ids)]
+        return df_filtered[df_filtered['id'].isin(relevant_ids)]
 
     except Exception as e:
         raise Exception(f"Error when filtering by search criteria: {e}")
 
 
-# Update filter_reddit_comments to work with the passed FilterRequest data
-def filter_reddit_comments(combined_df: pd.DataFrame, filters: FilterRequest) -> bytes:
+def filter_reddit_comments(combined_df: pd.DataFrame, filters, labels: LabelIndex = None) -> pd.DataFrame:
     """
-    Filter Reddit comments and return compressed brotli file of CSV data.
-    
+    Filter Reddit comments by feature page, emotions, topics, time, practitioner types and keyword.
+
+    Every filter is a boolean mask over the rows, from the label index or the typed
+    columns (see prepare_filter_columns); the masks are combined and applied to the
+    frame once.
+
     Args:
-        combined_df: DataFrame containing Reddit comments
-        filters: FilterRequest object with filtering criteria
-        
+        combined_df: DataFrame containing Reddit comments, with null values normalized
+            (see normalize_null_values); it is not modified
+        filters: FilterRequest, or a dict of its fields, with the filtering criteria
+        labels: LabelIndex of combined_df's rows in order; built from the frame when omitted
+
     Returns:
-        bytes: Compressed brotli data of the filtered CSV
+        pd.DataFrame: The matching comments, with the columns of combined_df
     """
     try:
-        # Make a copy of the passed dataframe and normalize null values
-        combined_df = normalize_null_values(combined_df.copy())
-        df_filtered = pd.DataFrame()  # Initialize empty DataFrame
-        
-        activeFeature = None
-        feature_pages = [
-            'desire_and_wish',
-            'trigger_phrase',
-            'metaphors',
-            'question', 
-            'practitioner_reference',
-            'painpointsxfrustrations',
-            'failed_solutions'
-        ]
+        filters = _as_filter_request(filters)
+        output_columns = [c for c in combined_df.columns if not str(c).startswith(DERIVED_PREFIX)]
+
+        # Null values were normalized when the files were loaded, and nothing here
+        # modifies the frame, so no copy is needed; parse the analysis columns unless
+        # the loader already did
+        combined_df = prepare_filter_columns(combined_df)
+        if labels is None or len(labels) != len(combined_df):
+            labels = LabelIndex.from_frame(combined_df)
 
         # Get the feature page from the FilterRequest class
-        for feature in feature_pages:
-            # Get the boolean value associated with the feature page
-            bool_value = getattr(filters, feature, None)
-
-            # Update activeFeature variable and break out of loop
-            if bool_value:
-                activeFeature = feature
-                break
-
-        if activeFeature is None: 
-            raise ValueError(f"Unknown feature_page: {feature}. "
-                                    f"Valid options: {feature_pages}")
-        
+        activeFeature = next((feature for feature in FEATURE_PAGES if getattr(filters, feature, None)), None)
+        if activeFeature is None:
+            raise ValueError(f"No feature page selected. Valid options: {FEATURE_PAGES}")
+
         feature_column = activeFeature
-            
         if feature_column not in combined_df.columns:
             raise KeyError(f"Feature column '{feature_column}' not found in DataFrame.")
-        
+
+        time_filter = filters.time.lower() if filters.time is not None else None
+        if time_filter is not None and time_filter not in TIME_BOUNDS:
+            raise ValueError(f"Invalid time filter: {time_filter}")
+
         # Filter out rows where the feature column is null/None - Filter by Feature page
-        df_filtered = combined_df[combined_df[feature_column].notna() & (combined_df[feature_column] != '')]
-
-        # Filter by Emotions
-        if getattr(filters, 'emotions') is not None:
-            # Filter by intensity score (related to emotions)
-            if getattr(filters, 'min_intensity') is not None:
-                emotions_filter = {
-                    "emotions": filters.emotions,
-                    "min_intensity": filters.min_intensity
-                }
-            else:
-                emotions_filter = filters.emotions
-
-            df_filtered = df_filtered[df_filtered.apply(
-                lambda row: _check_emotion_filter(row, emotions_filter), axis=1
-            )]
-
-        # Filter by Topics
-        if getattr(filters, 'topics') is not None:
-            topics_filter = filters.topics
-            df_filtered = df_filtered[df_filtered.apply(
-                lambda row: _check_topic_filter(row, topics_filter), axis=1
-            )]
+        feature_values = combined_df[feature_column]
+        # A copy: under copy-on-write to_numpy() can return a read-only view, and the filters below AND into it
+        mask = (feature_values.notna() & (feature_values != '')).to_numpy(dtype=bool, copy=True)
+
+        # Filter by Emotions, with the intensity score when one is given
+        if filters.emotions is not None:
+            mask &= _emotion_mask(labels, filters.emotions, filters.min_intensity)
+
+        # Filter by Topics: rows with any of them
+        if filters.topics is not None:
+            _raise_if_unparsed(combined_df, labels, mask, 'topics')
+            mask &= labels.any_mask('topics', filters.topics)
 
         # Filter by Time
-        if getattr(filters, 'time') is not None:
-            time_filter = filters.time.lower()
-            if time_filter in ["past_day", "past_week", "past_month", "past_year"]:
-                df_filtered = df_filtered[df_filtered.apply(
-                    lambda row: _check_time_filter(row, time_filter), axis=1
-                )]
-            else:
-                raise ValueError(f"Invalid time filter: {time_filter}")
-        
+        if time_filter is not None:
+            mask &= _time_mask(combined_df, time_filter)
+
         # Filter by Practitioner types
-        if getattr(filters, 'practitioner_types') is not None:
-            practitioners_filter = filters.practitioner_types
-            df_filtered = df_filtered[df_filtered.apply(
-                lambda row: _check_practitioner_type_filter(row, practitioners_filter), axis=1
-            )]
+        if filters.practitioner_types is not None:
+            _raise_if_unparsed(combined_df, labels, mask, 'practitioner_types')
+            mask &= _practitioner_type_mask(labels, filters.practitioner_types)
+
+        df_filtered = combined_df.loc[mask, output_columns]
 
         # Filter by keyword search
-        if getattr(filters, 'keyword') is not None:
+        if filters.keyword is not None:
 
             # normalize keyword search
             search_criteria = filters.keyword.lower()
@@ -301,20 +272,8 @@ def filter_reddit_comments(combined_df: pd.DataFrame, filters: FilterRequest) ->
             # pass search criteria to function
             df_filtered = _check_keyword_search_filter(df_filtered, search_criteria, filters)
 
-        # If no filters were applied, return empty df to indicate no matches found with provided filters
-        if df_filtered.empty:
-            df_filtered = combined_df.iloc[0:0]
-
-        # Convert DataFrame to CSV in memory
-        csv_data = df_filtered.to_csv(index=False).encode('utf-8')
-        
-        # Compress the CSV data using Brotli
-        compressed_data = brotli.compress(csv_data, quality=6)
-        
-        print(f"✅ Filtering complete. Compressed {len(csv_data)} bytes to {len(compressed_data)} bytes "
-                f"(compression ratio: {len(csv_data)/len(compressed_data):.2f}:1)")
-        
-        return compressed_data
+        print(f"✅ Filtering complete. {len(df_filtered)} of {len(combined_df)} comments matched.")
+        return df_filtered
 
     except Exception as e:
         raise Exception(f"Error in filter_reddit_comments: {str(e)}")
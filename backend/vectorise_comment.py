@@ -1,33 +1,15 @@
 import os
-import torch
-import torch.nn.functional as F
 import numpy as np
 from dotenv import load_dotenv
-from transformers import AutoModel, AutoTokenizer
 from typing import List
+from . import embedding_service
+from . import embedding_cache
 
 load_dotenv()
 
-MODEL_ID = "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
-# Use environment variable for flexibility, default to ~/models/m for local development
-LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", os.path.expanduser("~/models/m"))
-
-try:
-    tokenizer = AutoTokenizer.from_pretrained(LOCAL_MODEL_PATH, local_files_only=True)
-    model = AutoModel.from_pretrained(LOCAL_MODEL_PATH, local_files_only=True)
-except Exception as e:
-    print(f"❌ Error loading model: {e}")
-    tokenizer, model = None, None
-
 # Initialiase a constant specifying the batch size to feed to the vector database
 BATCH_SIZE = 500
 
-# Mean Pooling - Take average of all tokens
-def mean_pooling(model_output, attention_mask):
-    token_embeddings = model_output[0] # First element of model_output contains all token embeddings
-    input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
-    return torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
-
 def clear_vector_db(supabase):
 
     # Define the table to clear 
@@ -41,46 +23,129 @@ def clear_vector_db(supabase):
     except Exception as e:
         print(f"❌ Error clearing {table_to_clear}: {e}")
 
-# Corrected function with proper syntax
-def vectorise_batch(comments: List[dict]):
+# Comments are buffered across posts until this many tokens are waiting, so the length
+# buckets are well filled and batches do not depend on how many comments one post had
+FLUSH_TOKENS = int(os.getenv("EMBEDDING_FLUSH_TOKENS", str(4 * embedding_service.MAX_BATCH_TOKENS)))
+
+def lookup_cached(comments: List[dict]):
     """
-    Vectorizes a list of comments in a single batch.
-    
-    Args:
-        comments (List[dict]): A list of comment dictionaries, each with at least an 'id' and 'body'.
+    Split comments into cache hits and misses.
 
     Returns:
-        List[dict]: A list of vector records ready for insertion into Supabase.
+        tuple: (vector records for the hits, comments that still need embedding)
     """
-    if not tokenizer or not model:
-        print("❌ Model not loaded, skipping vectorization.")
+    cache = embedding_cache.get_cache()
+    if cache is None or not comments:
+        return [], list(comments)
+    try:
+        hits = cache.get_many([c.get("body", "") for c in comments])
+    except Exception as e:
+        print(f"Embedding cache error: {e}")
+        return [], list(comments)
+    records = [{"id": comments[i].get("id"), "embedding": embedding} for i, embedding in hits.items()]
+    misses = [c for i, c in enumerate(comments) if i not in hits]
+    return records, misses
+
+
+def _embed_and_cache(comments: List[dict], lengths: List[int] = None):
+    # Runs the model on cache misses and stores the results
+    if not comments:
         return []
-    
-    comment_bodies = [c.get("body", "") for c in comments]
+    comment_bodies = [embedding_cache.normalise_text(c.get("body", "")) for c in comments]
 
     try:
-        encoded_input = tokenizer(
-            comment_bodies,
-            return_tensors="pt", 
-            padding=True, 
-            truncation=True, 
-            max_length=128
-        )
-        
-        with torch.no_grad():
-            model_output = model(**encoded_input)
-        
-        embeddings = mean_pooling(model_output, encoded_input['attention_mask'])
-
-        embeddings = F.normalize(embeddings, p=2, dim=1)
+        # The model is shared with the rest of the process and loaded on first use
+        embeddings = embedding_service.embed_bucketed(comment_bodies, lengths)
+        if embeddings is None:
+            print("❌ Model not loaded, skipping vectorization.")
+            return []
+
+        cache = embedding_cache.get_cache()
+        if cache is not None:
+            try:
+                cache.put_many(comment_bodies, embeddings)
+            except Exception as e:
+                print(f"Embedding cache error: {e}")
 
         vector_records = []
         for i, embedding in enumerate(embeddings):
             vector_records.append({
                 "id": comments[i].get("id"),
-                "embedding": embedding.tolist(),
+                "embedding": embedding,
                 })
         return vector_records
     except Exception as e:
         print(f"Embedding error: {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+# Corrected function with proper syntax
+def vectorise_batch(comments: List[dict]):
+    """
+    Vectorizes a list of comments, running the model only on bodies missing from the embedding cache.
+    
+    Args:
+        comments (List[dict]): A list of comment dictionaries, each with at least an 'id' and 'body'.
+
+    Returns:
+        List[dict]: A list of vector records ready for insertion into Supabase, in the order of comments.
+    """
+    cached, misses = lookup_cached(comments)
+    by_id = {record["id"]: record for record in cached + _embed_and_cache(misses)}
+    return [by_id[c.get("id")] for c in comments if c.get("id") in by_id]
+
+
+class EmbeddingBatcher:
+    """
+    Collects comments to vectorise across posts and embeds them once FLUSH_TOKENS tokens are waiting.
+
+    Comments found in the embedding cache skip the model and are returned with the
+    next flush. add() returns the vector records of a flush (usually an empty list);
+    call flush() at the end of a scrape for whatever is still buffered.
+    """
+
+    def __init__(self, flush_tokens: int = FLUSH_TOKENS):
+        self.flush_tokens = flush_tokens
+        self.pending = []
+        self.lengths = []
+        self.pending_tokens = 0
+        self.cached = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def buffer(self, comments: List[dict]) -> bool:
+        """Queue comments without embedding them; False if the model is unavailable."""
+        if not comments:
+            return True
+        cached, misses = lookup_cached(comments)
+        self.cached.extend(cached)
+        self.cache_hits += len(cached)
+        self.cache_misses += len(misses)
+        if not misses:
+            return True
+        lengths = embedding_service.token_lengths([embedding_cache.normalise_text(c.get("body", "")) for c in misses])
+        if lengths is None:
+            print("❌ Model not loaded, skipping vectorization.")
+            return False
+        self.pending.extend(misses)
+        self.lengths.extend(lengths)
+        self.pending_tokens += sum(lengths)
+        return True
+
+    def add(self, comments: List[dict]) -> List[dict]:
+        """Queue comments and return vector records if the buffer is full enough to flush."""
+        if self.buffer(comments) and (self.pending_tokens >= self.flush_tokens or len(self.cached) >= BATCH_SIZE):
+            return self.flush()
+        return []
+
+    def flush(self) -> List[dict]:
+        """Embed everything buffered and return the vector records, cache hits included."""
+        cached, comments, lengths = self.cached, self.pending, self.lengths
+        self.cached, self.pending, self.lengths, self.pending_tokens = [], [], [], 0
+        if comments:
+            print(f"[VECTORISE] Embedding {len(comments)} buffered comments ({sum(lengths)} tokens)...")
+        return cached + _embed_and_cache(comments, lengths)
+
+    def hit_rate(self) -> float:
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.0
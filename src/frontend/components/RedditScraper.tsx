@@ -3,7 +3,7 @@ import { emotionEmoji } from "./Emotion";
 import type { ScraperCommentItem } from './ItemInterfaces';
 import { applyFiltersBackend, fetchAndParseCSVFiles } from './filterUtils';
 import { emotionOptions } from './Emotion'; // Imported from Emotion.ts
-import { BACKEND_SCRAPER_ROUTE, BACKEND_USEPREVIOUS_ROUTE, BACKEND_GET_FILTERED_CMTS_ROUTE } from './BackendURL';
+import { BACKEND_SCRAPER_ROUTE, BACKEND_JOBS_ROUTE, BACKEND_USEPREVIOUS_ROUTE, BACKEND_GET_FILTERED_CMTS_ROUTE } from './BackendURL';
 
 // Type declaration for PapaParse if loaded globally via CDN.
 // This is crucial if you are NOT importing Papa from a module and instead
@@ -515,6 +515,14 @@ const RedditScraper: React.FC = () => {
   // add this near your other refs/states
   const scrapingIntervalRef = useRef<NodeJS.Timeout | null>(null);
 
+  // How often the scrape job status is polled, and how much of the bar each phase covers
+  const JOB_POLL_INTERVAL_MS = 2000;
+  // Consecutive failed status requests (network errors, cold-start 5xx) tolerated before giving up
+  const JOB_POLL_MAX_FAILURES = 5;
+  const PHASE_PROGRESS: Record<string, number> = {
+    queued: 0, clearing: 2, scraping: 5, analysing: 85, saving: 90, storing: 95, done: 100,
+  };
+
 
   const calculateEstimatedTime = (): number => {
     if (!subreddits || !numPosts) { return 0; }
@@ -629,17 +637,6 @@ const RedditScraper: React.FC = () => {
   setFiltersEnabled(false);
   setProgress(0);
 
-  const totalSeconds = calculateEstimatedTime();
-  let currentProgress = 0;
-  const maxFakeProgress = 95;
-  const progressIncrement = maxFakeProgress / (totalSeconds / 0.5);
-
-  scrapingIntervalRef.current = setInterval(() => {
-    currentProgress += progressIncrement;
-    if (currentProgress > maxFakeProgress) { currentProgress = maxFakeProgress; }
-    setProgress(currentProgress);
-  }, 500);
-
   try {
     const subredditList = subreddits.split(',')
       .map(s => s.trim())
@@ -656,7 +653,7 @@ const RedditScraper: React.FC = () => {
       throw new Error("Post limit must be between 1 and 1000");
     }
 
-    // ✅ USE THE CORRECT ENDPOINT - /scrape_comments
+    // ✅ USE THE CORRECT ENDPOINT - /scrape_comments (returns a job id straight away)
     const response = await fetch(BACKEND_SCRAPER_ROUTE, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
@@ -671,11 +668,11 @@ const RedditScraper: React.FC = () => {
       throw new Error(errorData.detail || `Scraping failed: ${response.status}`);
     }
 
-    if (scrapingIntervalRef.current) { clearInterval(scrapingIntervalRef.current); }
+    const { job_id: jobId } = await response.json();
+    const job = await pollScrapeJob(jobId);
     setProgress(100);
 
-    const data = await response.json();
-    const urls: string[] = data.urls || [];
+    const urls: string[] = job.result?.urls || [];
 
     if (urls.length === 0) {
       alert('Scraping completed but no data was returned.');
@@ -701,6 +698,54 @@ const RedditScraper: React.FC = () => {
     hasScrapedDataRef.current = false;
   }
   };
+
+  // Poll /jobs/{id} until the scrape finishes, driving the progress bar and ETA from the job's counters
+  const pollScrapeJob = (jobId: string): Promise<any> => new Promise((resolve, reject) => {
+    let failures = 0;
+    scrapingIntervalRef.current = setInterval(async () => {
+      let job: any;
+      try {
+        const response = await fetch(`${BACKEND_JOBS_ROUTE}/${jobId}`);
+        if (!response.ok) {
+          throw new Error(`Could not read scrape job status: ${response.status}`);
+        }
+        job = await response.json();
+        failures = 0;
+      } catch (error) {
+        // The job keeps running server-side; only give up after several failed polls in a row
+        failures += 1;
+        if (failures >= JOB_POLL_MAX_FAILURES) {
+          if (scrapingIntervalRef.current) { clearInterval(scrapingIntervalRef.current); }
+          reject(error);
+        }
+        return;
+      }
+
+      try {
+        if (job.phase === 'scraping' && job.posts_total > 0) {
+          const span = PHASE_PROGRESS.analysing - PHASE_PROGRESS.scraping;
+          setProgress(PHASE_PROGRESS.scraping + span * Math.min(job.posts_done / job.posts_total, 1));
+        } else if (job.phase in PHASE_PROGRESS) {
+          setProgress(PHASE_PROGRESS[job.phase]);
+        }
+        if (typeof job.eta_seconds === 'number') {
+          setEstimatedTime(formatTime(job.eta_seconds));
+        }
+
+        if (job.phase === 'done' || job.phase === 'failed') {
+          if (scrapingIntervalRef.current) { clearInterval(scrapingIntervalRef.current); }
+          if (job.phase === 'failed') {
+            reject(new Error(job.error || 'Scrape job failed'));
+          } else {
+            resolve(job);
+          }
+        }
+      } catch (error) {
+        if (scrapingIntervalRef.current) { clearInterval(scrapingIntervalRef.current); }
+        reject(error);
+      }
+    }, JOB_POLL_INTERVAL_MS);
+  });
   
   const handleClear = () => {
   if (scrapingIntervalRef.current) { clearInterval(scrapingIntervalRef.current); }